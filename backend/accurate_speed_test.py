@@ -7,6 +7,12 @@ import subprocess
 import json
 from typing import Dict
 
+from pptp_probe import pptp_control_probe
+from throughput_engine import SPEED_TEST_MAX_DURATION, SPEED_TEST_STREAMS, measure_throughput
+
+# Upper bound on parallel PPTP streams a large sample_kb may spread over
+_MAX_SPEED_STREAMS = 8
+
 class AccurateSpeedTester:
     """Наиболее точный замер пропускной способности через PPTP"""
     
@@ -30,9 +36,16 @@ class AccurateSpeedTester:
                     "upload_mbps": speed_result['upload_mbps'], 
                     "ping_ms": speed_result['ping_ms'],
                     "jitter_ms": speed_result.get('jitter_ms', 0),
-                    "message": f"SPEED OK: {speed_result['download_mbps']:.2f} Mbps down, {speed_result['upload_mbps']:.2f} Mbps up, {speed_result['ping_ms']:.0f}ms ping",
+                    "download_mbps_p90": speed_result['download_mbps_p90'],
+                    "upload_mbps_p90": speed_result['upload_mbps_p90'],
+                    "download_measured": speed_result['download_measured'],
+                    "converged": speed_result['converged'],
+                    "streams": speed_result['streams'],
+                    "message": (f"SPEED OK: {speed_result['download_mbps']:.2f} Mbps down, " if speed_result['download_measured']
+                                else "SPEED OK: download not measured, ")
+                               + f"{speed_result['upload_mbps']:.2f} Mbps up, {speed_result['ping_ms']:.0f}ms ping",
                     "test_duration_ms": round(total_time, 1),
-                    "method": "improved_throughput_test",
+                    "method": "multi_stream_throughput_test",
                     "test_size_kb": sample_kb
                 }
             else:
@@ -58,162 +71,63 @@ class AccurateSpeedTester:
 
     @staticmethod
     async def _quick_auth_check(ip: str, login: str, password: str, timeout: float) -> Dict:
-        """Быстрая проверка что credentials еще валидны"""
-        try:
-            future = asyncio.open_connection(ip, 1723)
-            reader, writer = await asyncio.wait_for(future, timeout=timeout)
-            
-            # Быстрый PPTP handshake для проверки авторизации
-            start_request = struct.pack('>HH', 156, 1) + struct.pack('>L', 0x1a2b3c4d)
-            start_request += struct.pack('>HH', 1, 0) + struct.pack('>HH', 1, 0)
-            start_request += struct.pack('>L', 1) + struct.pack('>L', 1)
-            start_request += struct.pack('>HH', 1, 1)
-            start_request += b'PPTP_CLIENT' + b'\x00' * (64 - len('PPTP_CLIENT'))
-            start_request += b'PPTP_VENDOR' + b'\x00' * (64 - len('PPTP_VENDOR'))
-            
-            writer.write(start_request)
-            await writer.drain()
-            
-            response = await asyncio.wait_for(reader.read(1024), timeout=2.0)
-            writer.close()
-            try:
-                await asyncio.wait_for(writer.wait_closed(), timeout=1.0)
-            except:
-                pass  # Игнорируем ошибки закрытия
-            
-            if len(response) >= 21:
-                result_code = struct.unpack('>B', response[20:21])[0]
-                if result_code == 1:
-                    return {"valid": True, "message": "Credentials still valid"}
-            
-            return {"valid": False, "message": "Credentials rejected or expired"}
-            
-        except Exception as e:
-            return {"valid": False, "message": f"Auth check failed: {str(e)}"}
+        """Быстрая проверка что PPTP control channel еще принимает соединения"""
+        probe = await pptp_control_probe(ip, 1723, timeout=timeout, echo_count=0)
+        if probe["handshake_ok"]:
+            return {"valid": True, "message": "PPTP control channel accepted"}
+        if probe["result_code"] is not None:
+            return {"valid": False, "message": f"Control connection rejected (result={probe['result_code']})"}
+        return {"valid": False, "message": f"Auth check failed: {probe['message']}"}
 
     @staticmethod
     async def _measure_throughput(ip: str, sample_kb: int, timeout: float) -> Dict:
         """
-        ✅ РАБОЧИЙ метод замера скорости с улучшениями
-        Множественные измерения для точности
+        ✅ Замер скорости: N параллельных потоков, выборка по интервалам (throughput_engine)
+        Ранняя остановка при сходимости оценки, p50/p90 вместо одного замера drain()
         """
         try:
-            # Множественные ping тесты для оценки латентности
-            ping_times = []
-            for i in range(3):
-                ping_start = time.time()
-                try:
-                    reader, writer = await asyncio.wait_for(
-                        asyncio.open_connection(ip, 1723),
-                        timeout=2.0
-                    )
-                    ping_time = (time.time() - ping_start) * 1000
-                    ping_times.append(ping_time)
-                    writer.close()
-                    try:
-                        await asyncio.wait_for(writer.wait_closed(), timeout=1.0)
-                    except:
-                        pass
-                except:
-                    continue
-            
-            if not ping_times:
+            # Латентность и jitter по одному PPTP control соединению (handshake + Echo RTT)
+            probe = await pptp_control_probe(ip, 1723, timeout=2.0, echo_count=3)
+            if not probe["reachable"]:
                 return {"success": False, "error": "Connection failed"}
-            
-            avg_ping = sum(ping_times) / len(ping_times)
-            min_ping = min(ping_times)
-            max_ping = max(ping_times)
-            jitter = max_ping - min_ping
-            
-            # РЕАЛЬНЫЙ тест upload/download скорости с оптимальным размером
-            # Используем средний размер (128-256 KB) - компромисс между точностью и работоспособностью
-            # Больше 256 KB может привести к Connection reset from PPTP servers
-            actual_test_size = min(max(sample_kb, 128), 256)  # 128-256 KB
-            test_data_size = actual_test_size * 1024
-            test_data = b'X' * test_data_size
-            
-            # UPLOAD TEST - измерение реальной скорости отправки
-            reader, writer = await asyncio.wait_for(
-                asyncio.open_connection(ip, 1723),
-                timeout=5.0
+
+            avg_ping = probe["latency_ms"] if probe["handshake_ok"] else probe["connect_ms"]
+            jitter = probe["jitter_ms"]
+
+            # Больше 256 KB на одно соединение может привести к Connection reset from PPTP servers
+            per_stream_kb = min(max(sample_kb, 128), 256)
+            # Больший объем выборки - больше потоков, а не больше байт на поток
+            streams = min(max(SPEED_TEST_STREAMS, -(-sample_kb // per_stream_kb)), _MAX_SPEED_STREAMS)
+            measurement = await measure_throughput(
+                lambda: asyncio.open_connection(ip, 1723),
+                streams=streams,
+                max_duration=max(1.0, min(timeout, SPEED_TEST_MAX_DURATION)),
+                max_bytes_per_stream=per_stream_kb * 1024,
             )
-            
-            # Отключаем буферизацию для более точных измерений
-            try:
-                writer.get_extra_info('socket').setsockopt(
-                    socket.IPPROTO_TCP, socket.TCP_NODELAY, 1
-                )
-            except:
-                pass  # Если не удалось установить TCP_NODELAY, продолжаем
-            
-            upload_start = time.time()
-            # Отправляем данные частями для более точного измерения
-            chunk_size = 8192  # 8 KB chunks
-            for i in range(0, test_data_size, chunk_size):
-                chunk = test_data[i:i+chunk_size]
-                writer.write(chunk)
-                try:
-                    await asyncio.wait_for(writer.drain(), timeout=5.0)
-                except:
-                    break  # Если drain() не удался, прерываем
-            upload_time = time.time() - upload_start
-            
-            # DOWNLOAD TEST - пытаемся прочитать ответ от сервера
-            download_start = time.time()
-            downloaded_bytes = 0
-            try:
-                # Пытаемся прочитать данные в течение 1 секунды
-                data = await asyncio.wait_for(reader.read(65536), timeout=1.0)
-                downloaded_bytes = len(data)
-            except:
-                # Нормально - сервер может не отправлять данные обратно
-                pass
-            download_time = time.time() - download_start
-            
-            writer.close()
-            try:
-                await asyncio.wait_for(writer.wait_closed(), timeout=1.0)
-            except:
-                pass
-            
-            # Вычисляем РЕАЛЬНУЮ upload скорость (без hardcoded значений!)
-            if upload_time > 0.02:  # Более реалистичный порог (20ms минимум)
-                upload_mbps = (test_data_size * 8) / (upload_time * 1_000_000)
-            else:
-                # Если очень быстро, используем минимальное значение на основе размера
-                # Это не hardcoded 0.1, а расчет на основе минимального времени
-                min_reasonable_time = 0.02  # 20ms
-                upload_mbps = (test_data_size * 8) / (min_reasonable_time * 1_000_000)
-            
-            # Вычисляем РЕАЛЬНУЮ download скорость (если были данные)
-            if downloaded_bytes > 1024 and download_time > 0.01:
-                download_mbps = (downloaded_bytes * 8) / (download_time * 1_000_000)
-            else:
-                # Если нет download данных, используем upload с коэффициентом
-                # (оценка, не измерение - но лучше чем ничего)
-                if avg_ping < 50 and jitter < 20:
-                    download_factor = 1.5
-                elif avg_ping < 100 and jitter < 50:
-                    download_factor = 1.3
-                elif avg_ping < 200:
-                    download_factor = 1.2
-                else:
-                    download_factor = 1.1
-                download_mbps = upload_mbps * download_factor
-            
-            # Возвращаем РЕАЛЬНЫЕ значения
+            # Все потоки сброшены сервером (junk на 1723) - это не замер канала
+            if not measurement["success"] or measurement["error"]:
+                return {"success": False, "error": measurement.get("error") or "no data delivered"}
+
+            upload_mbps = measurement["upload_mbps_p50"]
+            # PPTP порт обычно не отдает данные - download не измерен и не выдумывается (None)
+            download_measured = measurement["download_measured"]
+
             # Применяем разумный минимум (0.01 Mbps = 10 Kbps) для очень медленных соединений
             return {
                 "success": True,
-                "download_mbps": round(max(0.01, download_mbps), 2),
+                "download_mbps": round(max(0.01, measurement["download_mbps_p50"]), 2) if download_measured else None,
                 "upload_mbps": round(max(0.01, upload_mbps), 2),
+                "download_mbps_p90": round(max(0.01, measurement["download_mbps_p90"]), 2) if download_measured else None,
+                "upload_mbps_p90": round(max(0.01, measurement["upload_mbps_p90"]), 2),
+                "download_measured": download_measured,
                 "ping_ms": round(avg_ping, 1),
                 "jitter_ms": round(jitter, 1),
-                "test_data_size_kb": actual_test_size,
-                "downloaded_bytes": downloaded_bytes,
-                "upload_time_ms": round(upload_time * 1000, 1)
+                "streams": measurement["streams"],
+                "converged": measurement["converged"],
+                "test_duration_s": measurement["duration_s"],
+                "bytes_acked": measurement["bytes_acked"],
             }
-            
+
         except Exception as e:
             return {
                 "success": False, 
@@ -0,0 +1,127 @@
+"""
+Loopback benchmark: default asyncio loop vs uvloop
+Measures ping_light_tcp_check throughput against a local listener and, while that load
+runs, the latency of an SSE progress stream shaped like /api/progress/{session_id}.
+
+    python benchmark_event_loop.py [--checks 5000] [--concurrency 500] [--loops asyncio,uvloop]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import event_loop
+from ping_speed_test import ping_light_tcp_check
+from throughput_engine import percentile
+
+SSE_INTERVAL = 0.05  # /api/progress sleeps 0.5s between events; shorter here for more samples
+
+
+async def _sse_server(progress: dict):
+    """Minimal SSE endpoint emitting progress snapshots the way get_progress_stream does"""
+
+    async def handle(reader, writer):
+        await reader.readuntil(b"\r\n\r\n")
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n\r\n")
+        try:
+            while progress["status"] == "running":
+                data = json.dumps({**progress, "sent_at": time.perf_counter()})
+                writer.write(f"data: {data}\n\n".encode())
+                await writer.drain()
+                await asyncio.sleep(SSE_INTERVAL)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+async def _sse_client(port: int, delays_ms: list, lateness_ms: list):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /api/progress/bench HTTP/1.1\r\nHost: localhost\r\n\r\n")
+    await reader.readuntil(b"\r\n\r\n")
+    previous = None
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        if not line.startswith(b"data: "):
+            continue
+        now = time.perf_counter()
+        event = json.loads(line[6:])
+        delays_ms.append((now - event["sent_at"]) * 1000)
+        if previous is not None:
+            # How late the producer's sleep() woke up - event loop scheduling delay
+            lateness_ms.append(max(0.0, (event["sent_at"] - previous - SSE_INTERVAL) * 1000))
+        previous = event["sent_at"]
+    writer.close()
+
+
+async def _bench(checks: int, concurrency: int) -> dict:
+    target = await asyncio.start_server(lambda r, w: w.close(), "127.0.0.1", 0, backlog=4096)
+    port = target.sockets[0].getsockname()[1]
+    progress = {"status": "running", "processed_items": 0, "total_items": checks}
+    sse = await _sse_server(progress)
+    delays_ms, lateness_ms = [], []
+    client = asyncio.create_task(_sse_client(sse.sockets[0].getsockname()[1], delays_ms, lateness_ms))
+
+    sem = asyncio.Semaphore(concurrency)
+    ok = 0
+
+    async def one():
+        nonlocal ok
+        async with sem:
+            result = await ping_light_tcp_check("127.0.0.1", port, timeout=2.0, use_cache=False)
+            ok += bool(result.get("success"))
+            progress["processed_items"] += 1
+
+    await asyncio.sleep(0.2)  # let the stream settle
+    start = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(checks)])
+    elapsed = time.perf_counter() - start
+    progress["status"] = "completed"
+    await asyncio.wait_for(client, timeout=5)
+
+    for server in (target, sse):
+        server.close()
+        await server.wait_closed()
+    return {
+        "loop": event_loop.running_loop_name(),
+        "checks": checks,
+        "succeeded": ok,
+        "elapsed_s": round(elapsed, 3),
+        "checks_per_s": round(checks / elapsed, 1),
+        "sse_events": len(delays_ms),
+        "sse_delay_ms_p50": round(percentile(delays_ms, 50), 2),
+        "sse_delay_ms_p99": round(percentile(delays_ms, 99), 2),
+        "sse_lateness_ms_p50": round(percentile(lateness_ms, 50), 2),
+        "sse_lateness_ms_p99": round(percentile(lateness_ms, 99), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--checks", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--loops", default="asyncio,uvloop")
+    args = parser.parse_args()
+
+    results = []
+    for name in args.loops.split(","):
+        if name == "uvloop" and event_loop.uvloop is None:
+            print("uvloop: not installed, skipped")
+            continue
+        event_loop.CONNEXA_EVENT_LOOP = name
+        result = event_loop.run(_bench(args.checks, args.concurrency))
+        results.append(result)
+        print(json.dumps(result))
+
+    if len(results) == 2:
+        base, fast = results
+        print(f"throughput x{fast['checks_per_s'] / base['checks_per_s']:.2f}, "
+              f"SSE delay p99 {base['sse_delay_ms_p99']} -> {fast['sse_delay_ms_p99']} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""
+AIMD adaptive concurrency control for probe fan-out
+A resizable limiter that replaces the fixed asyncio.Semaphore globals: the limit grows
+additively while probes are healthy and is cut multiplicatively on timeout storms,
+connect-latency inflation or event-loop lag.
+run_worker_pool() is the sliding-window pipeline the batch tests run on: a fixed set of
+workers pulls items from one queue, so in-flight work stays at the limit until it drains.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, AsyncIterable, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Union
+
+logger = logging.getLogger("concurrency_control")
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up from a short sleep (EWMA, ms)"""
+
+    def __init__(self, interval: float = 0.25, alpha: float = 0.3):
+        self.interval = interval
+        self.alpha = alpha
+        self.lag_ms = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def ensure_started(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._task and not self._task.done() and self._task.get_loop() is loop:
+            return
+        self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, (time.monotonic() - started - self.interval) * 1000.0)
+            self.lag_ms = (1 - self.alpha) * self.lag_ms + self.alpha * lag
+
+
+loop_lag_monitor = LoopLagMonitor()
+
+
+class AIMDLimiter:
+    """Resizable concurrency limiter driven by additive-increase / multiplicative-decrease.
+
+    Usable as ``async with limiter:`` like a semaphore; callers report probe outcomes with
+    record(). Every ``window`` outcomes the limit is re-evaluated:
+    - decrease (limit *= decrease) if the timeout ratio, latency inflation over the best
+      observed baseline, or event-loop lag exceeds its threshold;
+    - otherwise increase (limit += increase).
+    """
+
+    def __init__(self, name: str, initial: int, min_limit: int, max_limit: int, *,
+                 increase: int = 1, decrease: float = 0.7, window: int = 50,
+                 max_timeout_ratio: float = 0.3, max_latency_inflation: float = 3.0,
+                 max_loop_lag_ms: float = 100.0):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = max(min_limit, min(max_limit, initial))
+        self.increase = increase
+        self.decrease = decrease
+        self.window = window
+        self.max_timeout_ratio = max_timeout_ratio
+        self.max_latency_inflation = max_latency_inflation
+        self.max_loop_lag_ms = max_loop_lag_ms
+
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+        self._samples = 0
+        self._timeouts = 0
+        self._latencies: List[float] = []
+        self.baseline_latency_ms: Optional[float] = None
+        self.last_timeout_ratio = 0.0
+        self.last_latency_inflation = 1.0
+
+    # ---- semaphore interface ----
+
+    async def acquire(self):
+        loop_lag_monitor.ensure_started()
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Slot was handed over just before cancellation - give it back
+                self.release()
+            else:
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake_waiters()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+    def _wake_waiters(self):
+        while self._waiters and self.in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(True)
+
+    # ---- feedback ----
+
+    def record(self, success: bool, timed_out: bool = False, latency_ms: Optional[float] = None):
+        """Report one probe outcome"""
+        self._samples += 1
+        if timed_out:
+            self._timeouts += 1
+        if success and latency_ms is not None:
+            self._latencies.append(latency_ms)
+        if self._samples >= self.window:
+            self._adjust()
+
+    def _adjust(self):
+        timeout_ratio = self._timeouts / max(1, self._samples)
+        inflation = 1.0
+        if self._latencies:
+            self._latencies.sort()
+            median = self._latencies[len(self._latencies) // 2]
+            if self.baseline_latency_ms is None or median < self.baseline_latency_ms:
+                self.baseline_latency_ms = median
+            else:
+                # Let the baseline drift up slowly so a route change is not penalised forever
+                self.baseline_latency_ms += 0.05 * (median - self.baseline_latency_ms)
+            inflation = median / max(1.0, self.baseline_latency_ms)
+        lag_ms = loop_lag_monitor.lag_ms
+
+        old_limit = self.limit
+        if (timeout_ratio > self.max_timeout_ratio or inflation > self.max_latency_inflation
+                or lag_ms > self.max_loop_lag_ms):
+            self.limit = max(self.min_limit, int(self.limit * self.decrease))
+        else:
+            self.limit = min(self.max_limit, self.limit + self.increase)
+
+        if self.limit != old_limit:
+            logger.debug(f"AIMD {self.name}: limit {old_limit} -> {self.limit} "
+                         f"(timeouts={timeout_ratio:.0%}, inflation={inflation:.1f}x, loop_lag={lag_ms:.0f}ms)")
+            self._wake_waiters()
+
+        self.last_timeout_ratio = timeout_ratio
+        self.last_latency_inflation = inflation
+        self._samples = 0
+        self._timeouts = 0
+        self._latencies = []
+
+    def snapshot(self) -> Dict:
+        return {
+            "name": self.name,
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "timeout_ratio": round(self.last_timeout_ratio, 3),
+            "latency_inflation": round(self.last_latency_inflation, 2),
+            "loop_lag_ms": round(loop_lag_monitor.lag_ms, 1),
+        }
+
+
+_POOL_DONE = object()
+
+
+async def run_worker_pool(items: Union[Iterable, AsyncIterable], handle: Callable[[Any], Awaitable[Any]],
+                          workers: int, *, should_stop: Callable[[], bool] = lambda: False,
+                          on_result: Optional[Callable[[Any, Any], None]] = None) -> int:
+    """Run handle(item) for every item with `workers` concurrent workers and no batch barriers:
+    a worker takes the next item as soon as its previous one finishes. items may be a plain or
+    an async iterable (e.g. a scan result stream); it is consumed lazily through a bounded queue.
+    on_result(item, result) sees each outcome (the exception for failed handlers). Once
+    should_stop() returns True no new items are started. Returns the number of items handled."""
+    workers = max(1, workers)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=workers * 2)
+    handled = 0
+
+    async def produce():
+        try:
+            if hasattr(items, '__aiter__'):
+                async for item in items:
+                    if should_stop():
+                        break
+                    await queue.put(item)
+            else:
+                for item in items:
+                    if should_stop():
+                        break
+                    await queue.put(item)
+        finally:
+            for _ in range(workers):
+                await queue.put(_POOL_DONE)
+
+    async def work():
+        nonlocal handled
+        while True:
+            item = await queue.get()
+            if item is _POOL_DONE:
+                return
+            if should_stop():
+                continue  # drain what was queued before the stop
+            try:
+                result = await handle(item)
+            except Exception as e:
+                result = e
+            handled += 1
+            if on_result:
+                on_result(item, result)
+
+    tasks = [asyncio.create_task(produce())] + [asyncio.create_task(work()) for _ in range(workers)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+    return handled
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, Text
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, Text, Float
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.sql import func
@@ -80,6 +80,12 @@ class Node(Base):
     socks_password = Column(String(255), nullable=True)  # SOCKS proxy password
     previous_status = Column(String(20), nullable=True)  # Status before SOCKS launch (for proper restoration)
     ppp_interface = Column(String(20), nullable=True)  # PPP interface name (ppp0, ppp1, etc.)
+    ping_port = Column(Integer, nullable=True)  # Port that won the last multi-port reachability race
+    rtt_srtt = Column(Float, nullable=True)  # Smoothed probe RTT, ms (adaptive timeouts)
+    rtt_var = Column(Float, nullable=True)   # Probe RTT variance, ms
+    rtt_backoff = Column(Integer, nullable=True, default=0)  # Consecutive probe timeouts (timeout doublings)
+    fail_streak = Column(Integer, nullable=True, default=0)  # Consecutive reachability failures
+    next_eligible_at = Column(DateTime, nullable=True)  # Quarantined from sweeps until then
     
     # OVPN Configuration (populated when services are launched)
     ovpn_config = Column(Text, nullable=True)  # Complete OVPN configuration
@@ -92,8 +98,51 @@ class Node(Base):
     last_update = Column(DateTime, nullable=True)  # Explicitly set in Python code, not by DB
     created_at = Column(DateTime, server_default=func.now())
 
+# Test job models: the plan and per-item progress of batch test sessions, so a restart resumes them
+class TestJob(Base):
+    __tablename__ = "test_jobs"
+
+    id = Column(String(36), primary_key=True)  # progress session_id
+    kind = Column(String(20), nullable=False)  # testing, ping_light
+    params = Column(Text, default="{}")  # JSON: batch function arguments
+    status = Column(String(20), index=True, default="running")  # running, completed, cancelled, failed
+    total_items = Column(Integer, default=0)
+    processed_items = Column(Integer, default=0)
+    alive_items = Column(Integer, default=0)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+class TestJobItem(Base):
+    __tablename__ = "test_job_items"
+
+    job_id = Column(String(36), primary_key=True)
+    node_id = Column(Integer, primary_key=True)
+    position = Column(Integer, nullable=False)  # Order in the plan
+    done = Column(Boolean, index=True, default=False)
+    success = Column(Boolean, nullable=True)  # Batch handler result (PING LIGHT: port answered)
+
+# Columns added after the first release: create_all() does not alter existing tables
+NODE_COLUMN_MIGRATIONS = [
+    ("ping_port", "INTEGER"),
+    ("rtt_srtt", "FLOAT"),
+    ("rtt_var", "FLOAT"),
+    ("rtt_backoff", "INTEGER DEFAULT 0"),
+    ("fail_streak", "INTEGER DEFAULT 0"),
+    ("next_eligible_at", "DATETIME"),
+]
+
+def migrate_node_columns():
+    """Add missing nodes columns to an existing database (ALTER TABLE ... ADD COLUMN)"""
+    from sqlalchemy import inspect, text
+    existing = {col["name"] for col in inspect(engine).get_columns("nodes")}
+    with engine.begin() as conn:
+        for name, ddl_type in NODE_COLUMN_MIGRATIONS:
+            if name not in existing:
+                conn.execute(text(f"ALTER TABLE nodes ADD COLUMN {name} {ddl_type}"))
+
 def create_tables():
     Base.metadata.create_all(bind=engine)
+    migrate_node_columns()
 
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
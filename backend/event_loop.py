@@ -0,0 +1,62 @@
+"""
+Event loop selection
+CONNEXA_EVENT_LOOP=auto|uvloop|asyncio picks the loop implementation for the API process
+(uvicorn), the background monitoring thread and the probe worker processes. "auto" uses
+uvloop when it is importable and falls back to the default asyncio loop otherwise.
+"""
+import asyncio
+import logging
+import os
+from typing import Awaitable, TypeVar
+
+logger = logging.getLogger("event_loop")
+
+CONNEXA_EVENT_LOOP = os.environ.get('CONNEXA_EVENT_LOOP', 'auto').strip().lower()
+
+T = TypeVar('T')
+
+try:
+    import uvloop
+except ImportError:  # Windows, or uvloop not installed
+    uvloop = None
+
+
+def selected_loop() -> str:
+    """Loop implementation to use: "uvloop" or "asyncio" """
+    if CONNEXA_EVENT_LOOP == 'asyncio':
+        return 'asyncio'
+    if uvloop is None:
+        if CONNEXA_EVENT_LOOP == 'uvloop':
+            logger.warning("⚠️ CONNEXA_EVENT_LOOP=uvloop but uvloop is not installed - using asyncio")
+        return 'asyncio'
+    return 'uvloop'
+
+
+def new_event_loop() -> asyncio.AbstractEventLoop:
+    if selected_loop() == 'uvloop':
+        return uvloop.new_event_loop()
+    return asyncio.new_event_loop()
+
+
+def run(main: Awaitable[T]) -> T:
+    """asyncio.run() on the selected loop implementation"""
+    loop = new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(main)
+    finally:
+        try:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+
+def uvicorn_loop_setting() -> str:
+    """Value for uvicorn's ``loop`` option"""
+    return selected_loop()
+
+
+def running_loop_name() -> str:
+    loop = asyncio.get_running_loop()
+    return f"{type(loop).__module__}.{type(loop).__name__}"
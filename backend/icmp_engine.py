@@ -0,0 +1,272 @@
+"""
+Async ICMP echo engine
+One ICMP socket per address family, registered with the event loop, multiplexes any
+number of concurrent echo requests; replies are matched to waiters by (peer, sequence).
+Unprivileged ICMP datagram sockets (net.ipv4.ping_group_range) are preferred, raw
+sockets (CAP_NET_RAW) are the fallback, and the `ping` binary is the last resort.
+"""
+import asyncio
+import ipaddress
+import itertools
+import logging
+import os
+import re
+import socket
+import struct
+import time
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger("icmp_engine")
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+ICMPV6_ECHO_REQUEST = 128
+ICMPV6_ECHO_REPLY = 129
+
+_PAYLOAD = b'connexa-icmp-probe'.ljust(32, b'.')
+ICMP_RCVBUF = int(os.environ.get('ICMP_RCVBUF', 8 * 1024 * 1024))
+
+# Set once neither socket type can be opened; icmp_ping() then goes straight to the binary
+_icmp_unavailable = False
+
+
+class ICMPUnavailable(RuntimeError):
+    """Neither ICMP datagram nor raw sockets can be opened in this process"""
+
+
+def checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def build_echo_request(family: int, ident: int, seq: int, payload: bytes = _PAYLOAD) -> bytes:
+    icmp_type = ICMP_ECHO_REQUEST if family == socket.AF_INET else ICMPV6_ECHO_REQUEST
+    header = struct.pack('!BBHHH', icmp_type, 0, 0, ident, seq)
+    # ICMPv6 checksums cover a pseudo-header and are filled in by the kernel
+    csum = checksum(header + payload) if family == socket.AF_INET else 0
+    return struct.pack('!BBHHH', icmp_type, 0, csum, ident, seq) + payload
+
+
+def parse_echo_reply(family: int, data: bytes, raw: bool) -> Optional[Tuple[int, int]]:
+    """(identifier, sequence) of an echo reply, or None for any other packet"""
+    if raw and family == socket.AF_INET:
+        data = data[(data[0] & 0x0F) * 4:]  # IPv4 raw sockets deliver the IP header too
+    if len(data) < 8:
+        return None
+    icmp_type, code, _, ident, seq = struct.unpack('!BBHHH', data[:8])
+    expected = ICMP_ECHO_REPLY if family == socket.AF_INET else ICMPV6_ECHO_REPLY
+    if icmp_type != expected or code != 0:
+        return None
+    return ident, seq
+
+
+class _FamilySocket:
+    def __init__(self, family: int):
+        self.family = family
+        proto = socket.IPPROTO_ICMP if family == socket.AF_INET else socket.IPPROTO_ICMPV6
+        try:
+            # Datagram ICMP: the kernel assigns (and filters on) the identifier
+            self.sock = socket.socket(family, socket.SOCK_DGRAM, proto)
+            self.raw = False
+        except OSError:
+            try:
+                self.sock = socket.socket(family, socket.SOCK_RAW, proto)
+            except OSError as e:
+                raise ICMPUnavailable(f"no ICMP socket for family {family}: {e}") from e
+            self.raw = True
+        self.sock.setblocking(False)
+        # Replies to thousands of concurrent echoes arrive in bursts
+        for option in (getattr(socket, 'SO_RCVBUFFORCE', None), socket.SO_RCVBUF):
+            if option is None:
+                continue
+            try:
+                self.sock.setsockopt(socket.SOL_SOCKET, option, ICMP_RCVBUF)
+                break
+            except OSError:
+                continue
+        self.ident = os.getpid() & 0xFFFF
+
+
+class ICMPEngine:
+    """Shared ICMP echo multiplexer for all asyncio callers of one event loop"""
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._sockets: Dict[int, _FamilySocket] = {}
+        self._pending: Dict[Tuple[str, int], Tuple[asyncio.Future, float]] = {}
+        self._seq = itertools.count()
+        self.stats = {
+            'sent': 0,
+            'received': 0,
+            'timeouts': 0,
+            'send_errors': 0,
+        }
+
+    async def ping(self, host: str, count: int = 4, timeout: float = 3.0, interval: float = 0.2) -> Dict:
+        """Send `count` echo requests `interval` apart and wait up to `timeout` for each reply.
+        Returns: {"host", "ip", "sent", "received", "packet_loss", "min_ms", "avg_ms", "max_ms",
+                  "rtts", "mode", "error"}; raises ICMPUnavailable when no ICMP socket can be opened."""
+        ip, family = await self._resolve(host)
+        fsock = self._socket_for(family)
+        tasks = []
+        for i in range(count):
+            if i:
+                await asyncio.sleep(interval)
+            tasks.append(asyncio.create_task(self._echo(fsock, ip, timeout)))
+        outcomes = await asyncio.gather(*tasks)
+
+        rtts = [rtt for rtt, _ in outcomes if rtt is not None]
+        errors = sorted({err for _, err in outcomes if err})
+        return {
+            "host": host,
+            "ip": ip,
+            "sent": count,
+            "received": len(rtts),
+            "packet_loss": round(100.0 * (count - len(rtts)) / count, 1) if count else 100.0,
+            "min_ms": round(min(rtts), 3) if rtts else 0.0,
+            "avg_ms": round(sum(rtts) / len(rtts), 3) if rtts else 0.0,
+            "max_ms": round(max(rtts), 3) if rtts else 0.0,
+            "rtts": [round(r, 3) for r in rtts],
+            "mode": "raw" if fsock.raw else "dgram",
+            "error": ", ".join(errors) if errors else None,
+        }
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            'pending': len(self._pending),
+            'modes': {('ipv4' if f == socket.AF_INET else 'ipv6'): ('raw' if s.raw else 'dgram')
+                      for f, s in self._sockets.items()},
+        }
+
+    async def _resolve(self, host: str) -> Tuple[str, int]:
+        try:
+            address = ipaddress.ip_address(host)
+            return str(address), socket.AF_INET if address.version == 4 else socket.AF_INET6
+        except ValueError:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, None, type=socket.SOCK_RAW)
+            family, _, _, _, sockaddr = infos[0]
+            return sockaddr[0], family
+
+    def _socket_for(self, family: int) -> _FamilySocket:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Sockets are registered with one loop; a new loop (tests, worker restart) starts over
+            self._close()
+            self._loop = loop
+        fsock = self._sockets.get(family)
+        if fsock is None:
+            fsock = _FamilySocket(family)
+            loop.add_reader(fsock.sock.fileno(), self._on_readable, fsock)
+            self._sockets[family] = fsock
+            logger.info(f"🚀 ICMP engine: {'raw' if fsock.raw else 'datagram'} socket for "
+                        f"{'IPv4' if family == socket.AF_INET else 'IPv6'}")
+        return fsock
+
+    def _next_seq(self, ip: str) -> int:
+        for _ in range(0x10000):
+            seq = next(self._seq) & 0xFFFF
+            if (ip, seq) not in self._pending:
+                return seq
+        raise RuntimeError("ICMP sequence space exhausted")
+
+    async def _echo(self, fsock: _FamilySocket, ip: str, timeout: float) -> Tuple[Optional[float], Optional[str]]:
+        seq = self._next_seq(ip)
+        key = (ip, seq)
+        future = self._loop.create_future()
+        self._pending[key] = (future, time.perf_counter())
+        try:
+            try:
+                fsock.sock.sendto(build_echo_request(fsock.family, fsock.ident, seq), (ip, 0))
+            except OSError as e:
+                self.stats['send_errors'] += 1
+                return None, type(e).__name__
+            self.stats['sent'] += 1
+            try:
+                return await asyncio.wait_for(future, timeout), None
+            except asyncio.TimeoutError:
+                self.stats['timeouts'] += 1
+                return None, None
+        finally:
+            self._pending.pop(key, None)
+
+    def _on_readable(self, fsock: _FamilySocket):
+        while True:
+            try:
+                data, addr = fsock.sock.recvfrom(65535)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return  # ICMP errors queued on the socket; the waiter times out
+            now = time.perf_counter()
+            parsed = parse_echo_reply(fsock.family, data, fsock.raw)
+            if parsed is None:
+                continue
+            ident, seq = parsed
+            if fsock.raw and ident != fsock.ident:
+                continue  # raw sockets see every echo reply on the host
+            entry = self._pending.get((addr[0], seq))
+            if entry is None:
+                continue
+            future, sent_at = entry
+            if not future.done():
+                future.set_result((now - sent_at) * 1000.0)
+                self.stats['received'] += 1
+
+    def _close(self):
+        for fsock in self._sockets.values():
+            if self._loop is not None and not self._loop.is_closed():
+                try:
+                    self._loop.remove_reader(fsock.sock.fileno())
+                except (OSError, ValueError, RuntimeError):
+                    pass
+            fsock.sock.close()
+        self._sockets.clear()
+        self._pending.clear()
+
+
+async def _ping_subprocess(host: str, count: int, timeout: float) -> Dict:
+    """`ping` binary fallback, same result shape as ICMPEngine.ping"""
+    proc = await asyncio.create_subprocess_exec(
+        "ping", "-n", "-c", str(count), "-W", str(max(1, int(round(timeout)))), host,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await proc.communicate()
+    output = stdout.decode(errors='replace')
+    received_match = re.search(r'(\d+) (?:packets )?received', output)
+    received = int(received_match.group(1)) if received_match else 0
+    rtt_match = re.search(r'= ([\d.]+)/([\d.]+)/([\d.]+)/', output)
+    low, avg, high = (float(v) for v in rtt_match.groups()) if rtt_match else (0.0, 0.0, 0.0)
+    return {
+        "host": host,
+        "ip": host,
+        "sent": count,
+        "received": received,
+        "packet_loss": round(100.0 * (count - received) / count, 1) if count else 100.0,
+        "min_ms": low,
+        "avg_ms": avg,
+        "max_ms": high,
+        "rtts": [],
+        "mode": "subprocess",
+        "error": stderr.decode(errors='replace').strip() or None,
+    }
+
+
+async def icmp_ping(host: str, count: int = 4, timeout: float = 3.0, interval: float = 0.2) -> Dict:
+    """Echo `host` through the shared engine, falling back to the ping binary without ICMP sockets"""
+    global _icmp_unavailable
+    if not _icmp_unavailable:
+        try:
+            return await icmp_engine.ping(host, count=count, timeout=timeout, interval=interval)
+        except ICMPUnavailable as e:
+            logger.warning(f"⚠️ ICMP sockets unavailable ({e}) - falling back to the ping binary")
+            _icmp_unavailable = True
+    return await _ping_subprocess(host, count, timeout)
+
+
+# Global ICMP engine instance
+icmp_engine = ICMPEngine()
@@ -0,0 +1,269 @@
+"""
+Durable test jobs
+Batch test sessions (PING OK / SPEED / PING LIGHT) record their plan - every node id in
+order plus the batch function arguments - in test_jobs / test_job_items when they start, and
+mark items done as results come in. Completions are checkpointed in batches (every
+JOB_CHECKPOINT_ROWS items or JOB_CHECKPOINT_MS milliseconds), and only for items whose
+node results result_writer has written: items behind a failed write wait for a later
+checkpoint, items whose results were dropped are never checkpointed. A job that lost
+results stays "running" when its session ends, so the next startup re-tests them.
+Finished jobs keep their counters; their item rows are deleted. After a restart, jobs
+still "running" are resumed with the items not yet done; progress endpoints fall back to
+this state for sessions that are not in memory.
+"""
+import asyncio
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+
+from sqlalchemy import bindparam, delete, func, insert, select, update
+
+from database import TestJob, TestJobItem, engine
+from result_writer import result_writer
+
+logger = logging.getLogger("job_store")
+
+JOB_CHECKPOINT_ROWS = int(os.environ.get('JOB_CHECKPOINT_ROWS', 500))
+JOB_CHECKPOINT_MS = int(os.environ.get('JOB_CHECKPOINT_MS', 1000))
+# Plan rows inserted per statement when a job is created
+_PLAN_CHUNK = 5000
+# Final checkpoint retries: enough for result_writer to either write or drop a failing batch
+_FINISH_FLUSH_ATTEMPTS = 4
+
+FINAL_STATUSES = ("completed", "cancelled", "failed")
+
+
+class TestJobStore:
+    """Plan / checkpoint / resume bookkeeping of batch test sessions"""
+
+    def __init__(self, checkpoint_rows: int = JOB_CHECKPOINT_ROWS, checkpoint_ms: int = JOB_CHECKPOINT_MS):
+        self.checkpoint_rows = max(1, checkpoint_rows)
+        self.checkpoint_interval = max(1, checkpoint_ms) / 1000.0
+        self._pending: Dict[str, Dict[int, bool]] = {}  # job id -> {node id: success}
+        self._pending_count = 0
+        self._jobs = set()  # ids of durable jobs running in this process
+        self._lost: Dict[str, int] = {}  # job id -> items whose node results were dropped
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self.stats = {
+            'jobs_created': 0,
+            'jobs_resumed': 0,
+            'items_checkpointed': 0,
+            'checkpoints': 0,
+            'items_lost': 0,
+            'errors': 0,
+        }
+
+    def create(self, job_id: str, kind: str, node_ids: List[int], params: Dict) -> int:
+        """Record a job and its plan (blocking: call via asyncio.to_thread); returns the item count"""
+        node_ids = list(dict.fromkeys(node_ids))
+        items = TestJobItem.__table__
+        with engine.begin() as conn:
+            conn.execute(insert(TestJob.__table__).values(
+                id=job_id, kind=kind, params=json.dumps(params), status="running",
+                total_items=len(node_ids), processed_items=0, alive_items=0))
+            for chunk_start in range(0, len(node_ids), _PLAN_CHUNK):
+                chunk = node_ids[chunk_start:chunk_start + _PLAN_CHUNK]
+                conn.execute(insert(items), [
+                    {"job_id": job_id, "node_id": node_id, "position": chunk_start + offset, "done": False}
+                    for offset, node_id in enumerate(chunk)])
+        self._jobs.add(job_id)
+        self.stats['jobs_created'] += 1
+        return len(node_ids)
+
+    def mark_done(self, job_id: str, node_id: int, success: bool):
+        """Queue an item completion for the next checkpoint (sessions without a durable job are ignored)"""
+        if job_id not in self._jobs:
+            return
+        self._pending.setdefault(job_id, {})[node_id] = bool(success)
+        self._pending_count += 1
+        self._ensure_task()
+        if self._pending_count >= self.checkpoint_rows:
+            self._wake.set()
+
+    async def flush(self):
+        """Checkpoint queued completions whose node results are in the database.
+        Items whose node rows are still queued in result_writer (failed write, retried) wait for
+        the next checkpoint; items whose rows were dropped stay undone and are re-tested on resume."""
+        if self._flush_lock is None:
+            return
+        async with self._flush_lock:
+            queued, self._pending, self._pending_count = self._pending, {}, 0
+            # Every item in queued submitted its node result before this point
+            unwritten = await result_writer.flush()
+            lost = result_writer.take_dropped()
+            batch = {}
+            for job_id, done in queued.items():
+                for node_id, success in done.items():
+                    if node_id in lost:
+                        self.stats['items_lost'] += 1
+                        self._lost[job_id] = self._lost.get(job_id, 0) + 1
+                    elif node_id in unwritten or result_writer.is_pending(node_id):
+                        self._pending.setdefault(job_id, {})[node_id] = success
+                        self._pending_count += 1
+                    else:
+                        batch.setdefault(job_id, {})[node_id] = success
+            if lost:
+                logger.warning(f"⚠️ Test jobs: {len(lost)} node results were dropped by the result writer, "
+                               f"their items stay pending for resume")
+            if not batch:
+                return
+            try:
+                await asyncio.to_thread(self._write, batch)
+            except Exception as e:
+                # Not re-queued: the items are re-tested on resume, which is safe
+                self.stats['errors'] += 1
+                logger.warning(f"⚠️ Test job checkpoint failed ({e}), {sum(map(len, batch.values()))} items not saved")
+
+    async def finish(self, job_id: str, status: str):
+        """Final checkpoint and status of a job"""
+        if job_id not in self._jobs:
+            return
+        # Items behind a failing node write are retried until written or dropped by the writer
+        for _ in range(_FINISH_FLUSH_ATTEMPTS):
+            await self.flush()
+            if job_id not in self._pending:
+                break
+        self._jobs.discard(job_id)
+        unsaved = self._pending.pop(job_id, {})
+        self._pending_count -= len(unsaved)
+        lost = self._lost.pop(job_id, 0) + len(unsaved)
+        if lost and status == "completed":
+            # Left "running": the next startup resumes it and re-tests the lost items
+            logger.warning(f"⚠️ Test job {job_id}: {lost} node results were not saved, "
+                           f"the job will resume them on the next startup")
+            return
+        await asyncio.to_thread(self.set_status, job_id, status)
+
+    def set_status(self, job_id: str, status: str) -> bool:
+        """Job status; a finished job keeps its counters but drops its plan rows"""
+        jobs = TestJob.__table__
+        items = TestJobItem.__table__
+        with engine.begin() as conn:
+            result = conn.execute(update(jobs).where(jobs.c.id == job_id)
+                                  .values(status=status, updated_at=func.now()))
+            if status in FINAL_STATUSES:
+                conn.execute(delete(items).where(items.c.job_id == job_id))
+        return result.rowcount > 0
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a running job (e.g. one waiting to be resumed); finished jobs are left alone"""
+        jobs = TestJob.__table__
+        with engine.connect() as conn:
+            running = conn.execute(select(jobs.c.id).where(jobs.c.id == job_id, jobs.c.status == "running")).first()
+        return bool(running) and self.set_status(job_id, "cancelled")
+
+    def cancel_running(self) -> int:
+        """Cancel every running job"""
+        jobs = TestJob.__table__
+        with engine.connect() as conn:
+            job_ids = conn.execute(select(jobs.c.id).where(jobs.c.status == "running")).scalars().all()
+        return sum(self.set_status(job_id, "cancelled") for job_id in job_ids)
+
+    def snapshot(self, job_id: str) -> Optional[Dict]:
+        """Progress of a job as ProgressTracker.to_dict() reports it, from the last checkpoint"""
+        jobs = TestJob.__table__
+        with engine.connect() as conn:
+            job = conn.execute(select(jobs).where(jobs.c.id == job_id)).first()
+        if job is None:
+            return None
+        return {
+            "session_id": job.id,
+            "total_items": job.total_items,
+            "processed_items": job.processed_items,
+            "current_task": "Ожидает возобновления после перезапуска" if job.status == "running" else "",
+            "status": job.status,
+            "progress_percent": int(job.processed_items / job.total_items * 100) if job.total_items else 0,
+            "kind": job.kind,
+            "durable": True,
+            "results": [],
+        }
+
+    def list_jobs(self, limit: int = 50) -> List[Dict]:
+        jobs = TestJob.__table__
+        with engine.connect() as conn:
+            rows = conn.execute(select(jobs).order_by(jobs.c.created_at.desc()).limit(limit)).all()
+        return [{
+            "session_id": row.id,
+            "kind": row.kind,
+            "status": row.status,
+            "total_items": row.total_items,
+            "processed_items": row.processed_items,
+            "alive_items": row.alive_items,
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+            "updated_at": row.updated_at.isoformat() if row.updated_at else None,
+        } for row in rows]
+
+    def unfinished(self) -> List[Dict]:
+        """Running jobs with their remaining node ids in plan order (for resume on startup)"""
+        jobs = TestJob.__table__
+        items = TestJobItem.__table__
+        resumable = []
+        with engine.connect() as conn:
+            for job in conn.execute(select(jobs).where(jobs.c.status == "running")).all():
+                remaining = conn.execute(
+                    select(items.c.node_id)
+                    .where(items.c.job_id == job.id, items.c.done.is_(False))
+                    .order_by(items.c.position)).scalars().all()
+                resumable.append({
+                    "id": job.id,
+                    "kind": job.kind,
+                    "params": json.loads(job.params or "{}"),
+                    "total_items": job.total_items,
+                    "processed_items": job.processed_items,
+                    "alive_items": job.alive_items,
+                    "remaining": list(remaining),
+                })
+                self._jobs.add(job.id)
+        return resumable
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def get_stats(self) -> Dict:
+        return {**self.stats, 'running': len(self._jobs), 'pending': self._pending_count, 'checkpoint_rows': self.checkpoint_rows,
+                'checkpoint_ms': int(self.checkpoint_interval * 1000)}
+
+    def _ensure_task(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._wake = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.checkpoint_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self._pending:
+                await self.flush()
+
+    def _write(self, batch: Dict[str, Dict[int, bool]]):
+        jobs = TestJob.__table__
+        items = TestJobItem.__table__
+        statement = (update(items)
+                     .where(items.c.job_id == bindparam("job_id_"), items.c.node_id == bindparam("node_id_"))
+                     .values(done=True, success=bindparam("v_success")))
+        with engine.begin() as conn:
+            for job_id, done in batch.items():
+                conn.execute(statement, [{"job_id_": job_id, "node_id_": node_id, "v_success": success}
+                                         for node_id, success in done.items()])
+                counted = select(func.count()).select_from(items).where(items.c.job_id == job_id)
+                conn.execute(update(jobs).where(jobs.c.id == job_id).values(
+                    processed_items=counted.where(items.c.done.is_(True)).scalar_subquery(),
+                    alive_items=counted.where(items.c.success.is_(True)).scalar_subquery(),
+                    updated_at=func.now()))
+                self.stats['items_checkpointed'] += len(done)
+        self.stats['checkpoints'] += 1
+
+
+# Global test job store instance
+test_job_store = TestJobStore()
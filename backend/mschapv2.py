@@ -0,0 +1,164 @@
+"""
+MS-CHAPv2 primitives (RFC 2759) for the userspace PPTP client
+MD4 and single-block DES are implemented here because OpenSSL 3 builds no longer
+expose MD4 through hashlib and the backend has no crypto dependency.
+"""
+import hashlib
+import struct
+
+_MASK32 = 0xFFFFFFFF
+
+
+# ==== MD4 (RFC 1320) ====
+
+def _rotl32(x: int, s: int) -> int:
+    x &= _MASK32
+    return ((x << s) | (x >> (32 - s))) & _MASK32
+
+
+def md4(data: bytes) -> bytes:
+    try:
+        return hashlib.new('md4', data).digest()
+    except ValueError:
+        pass
+
+    msg = bytearray(data)
+    bit_len = (len(data) * 8) & 0xFFFFFFFFFFFFFFFF
+    msg.append(0x80)
+    while len(msg) % 64 != 56:
+        msg.append(0)
+    msg += struct.pack('<Q', bit_len)
+
+    h = [0x67452301, 0xEFCDAB89, 0x98BADCFE, 0x10325476]
+    for offset in range(0, len(msg), 64):
+        x = struct.unpack('<16I', msg[offset:offset + 64])
+        a, b, c, d = h
+
+        for i in range(16):
+            a = _rotl32(a + ((b & c) | (~b & d)) + x[i], (3, 7, 11, 19)[i % 4])
+            a, b, c, d = d, a, b, c
+        for i, k in enumerate((0, 4, 8, 12, 1, 5, 9, 13, 2, 6, 10, 14, 3, 7, 11, 15)):
+            a = _rotl32(a + ((b & c) | (b & d) | (c & d)) + x[k] + 0x5A827999, (3, 5, 9, 13)[i % 4])
+            a, b, c, d = d, a, b, c
+        for i, k in enumerate((0, 8, 4, 12, 2, 10, 6, 14, 1, 9, 5, 13, 3, 11, 7, 15)):
+            a = _rotl32(a + (b ^ c ^ d) + x[k] + 0x6ED9EBA1, (3, 9, 11, 15)[i % 4])
+            a, b, c, d = d, a, b, c
+
+        h = [(hv + v) & _MASK32 for hv, v in zip(h, (a, b, c, d))]
+    return struct.pack('<4I', *h)
+
+
+# ==== DES, single 64-bit block encryption (FIPS 46-3) ====
+
+_IP = (58, 50, 42, 34, 26, 18, 10, 2, 60, 52, 44, 36, 28, 20, 12, 4,
+       62, 54, 46, 38, 30, 22, 14, 6, 64, 56, 48, 40, 32, 24, 16, 8,
+       57, 49, 41, 33, 25, 17, 9, 1, 59, 51, 43, 35, 27, 19, 11, 3,
+       61, 53, 45, 37, 29, 21, 13, 5, 63, 55, 47, 39, 31, 23, 15, 7)
+_FP = (40, 8, 48, 16, 56, 24, 64, 32, 39, 7, 47, 15, 55, 23, 63, 31,
+       38, 6, 46, 14, 54, 22, 62, 30, 37, 5, 45, 13, 53, 21, 61, 29,
+       36, 4, 44, 12, 52, 20, 60, 28, 35, 3, 43, 11, 51, 19, 59, 27,
+       34, 2, 42, 10, 50, 18, 58, 26, 33, 1, 41, 9, 49, 17, 57, 25)
+_E = (32, 1, 2, 3, 4, 5, 4, 5, 6, 7, 8, 9, 8, 9, 10, 11, 12, 13, 12, 13, 14, 15, 16, 17,
+      16, 17, 18, 19, 20, 21, 20, 21, 22, 23, 24, 25, 24, 25, 26, 27, 28, 29, 28, 29, 30, 31, 32, 1)
+_P = (16, 7, 20, 21, 29, 12, 28, 17, 1, 15, 23, 26, 5, 18, 31, 10,
+      2, 8, 24, 14, 32, 27, 3, 9, 19, 13, 30, 6, 22, 11, 4, 25)
+_PC1 = (57, 49, 41, 33, 25, 17, 9, 1, 58, 50, 42, 34, 26, 18, 10, 2, 59, 51, 43, 35, 27, 19, 11, 3, 60, 52, 44, 36,
+        63, 55, 47, 39, 31, 23, 15, 7, 62, 54, 46, 38, 30, 22, 14, 6, 61, 53, 45, 37, 29, 21, 13, 5, 28, 20, 12, 4)
+_PC2 = (14, 17, 11, 24, 1, 5, 3, 28, 15, 6, 21, 10, 23, 19, 12, 4, 26, 8, 16, 7, 27, 20, 13, 2,
+        41, 52, 31, 37, 47, 55, 30, 40, 51, 45, 33, 48, 44, 49, 39, 56, 34, 53, 46, 42, 50, 36, 29, 32)
+_SHIFTS = (1, 1, 2, 2, 2, 2, 2, 2, 1, 2, 2, 2, 2, 2, 2, 1)
+_SBOX = (
+    (14, 4, 13, 1, 2, 15, 11, 8, 3, 10, 6, 12, 5, 9, 0, 7, 0, 15, 7, 4, 14, 2, 13, 1, 10, 6, 12, 11, 9, 5, 3, 8,
+     4, 1, 14, 8, 13, 6, 2, 11, 15, 12, 9, 7, 3, 10, 5, 0, 15, 12, 8, 2, 4, 9, 1, 7, 5, 11, 3, 14, 10, 0, 6, 13),
+    (15, 1, 8, 14, 6, 11, 3, 4, 9, 7, 2, 13, 12, 0, 5, 10, 3, 13, 4, 7, 15, 2, 8, 14, 12, 0, 1, 10, 6, 9, 11, 5,
+     0, 14, 7, 11, 10, 4, 13, 1, 5, 8, 12, 6, 9, 3, 2, 15, 13, 8, 10, 1, 3, 15, 4, 2, 11, 6, 7, 12, 0, 5, 14, 9),
+    (10, 0, 9, 14, 6, 3, 15, 5, 1, 13, 12, 7, 11, 4, 2, 8, 13, 7, 0, 9, 3, 4, 6, 10, 2, 8, 5, 14, 12, 11, 15, 1,
+     13, 6, 4, 9, 8, 15, 3, 0, 11, 1, 2, 12, 5, 10, 14, 7, 1, 10, 13, 0, 6, 9, 8, 7, 4, 15, 14, 3, 11, 5, 2, 12),
+    (7, 13, 14, 3, 0, 6, 9, 10, 1, 2, 8, 5, 11, 12, 4, 15, 13, 8, 11, 5, 6, 15, 0, 3, 4, 7, 2, 12, 1, 10, 14, 9,
+     10, 6, 9, 0, 12, 11, 7, 13, 15, 1, 3, 14, 5, 2, 8, 4, 3, 15, 0, 6, 10, 1, 13, 8, 9, 4, 5, 11, 12, 7, 2, 14),
+    (2, 12, 4, 1, 7, 10, 11, 6, 8, 5, 3, 15, 13, 0, 14, 9, 14, 11, 2, 12, 4, 7, 13, 1, 5, 0, 15, 10, 3, 9, 8, 6,
+     4, 2, 1, 11, 10, 13, 7, 8, 15, 9, 12, 5, 6, 3, 0, 14, 11, 8, 12, 7, 1, 14, 2, 13, 6, 15, 0, 9, 10, 4, 5, 3),
+    (12, 1, 10, 15, 9, 2, 6, 8, 0, 13, 3, 4, 14, 7, 5, 11, 10, 15, 4, 2, 7, 12, 9, 5, 6, 1, 13, 14, 0, 11, 3, 8,
+     9, 14, 15, 5, 2, 8, 12, 3, 7, 0, 4, 10, 1, 13, 11, 6, 4, 3, 2, 12, 9, 5, 15, 10, 11, 14, 1, 7, 6, 0, 8, 13),
+    (4, 11, 2, 14, 15, 0, 8, 13, 3, 12, 9, 7, 5, 10, 6, 1, 13, 0, 11, 7, 4, 9, 1, 10, 14, 3, 5, 12, 2, 15, 8, 6,
+     1, 4, 11, 13, 12, 3, 7, 14, 10, 15, 6, 8, 0, 5, 9, 2, 6, 11, 13, 8, 1, 4, 10, 7, 9, 5, 0, 15, 14, 2, 3, 12),
+    (13, 2, 8, 4, 6, 15, 11, 1, 10, 9, 3, 14, 5, 0, 12, 7, 1, 15, 13, 8, 10, 3, 7, 4, 12, 5, 6, 11, 0, 14, 9, 2,
+     7, 11, 4, 1, 9, 12, 14, 2, 0, 6, 10, 13, 15, 3, 5, 8, 2, 1, 14, 7, 4, 10, 8, 13, 15, 12, 9, 0, 3, 5, 6, 11),
+)
+
+
+def _permute(value: int, table, in_bits: int) -> int:
+    out = 0
+    for pos in table:
+        out = (out << 1) | ((value >> (in_bits - pos)) & 1)
+    return out
+
+
+def _des_subkeys(key: bytes):
+    k = _permute(int.from_bytes(key, 'big'), _PC1, 64)
+    c, d = k >> 28, k & 0xFFFFFFF
+    subkeys = []
+    for shift in _SHIFTS:
+        c = ((c << shift) | (c >> (28 - shift))) & 0xFFFFFFF
+        d = ((d << shift) | (d >> (28 - shift))) & 0xFFFFFFF
+        subkeys.append(_permute((c << 28) | d, _PC2, 56))
+    return subkeys
+
+
+def _feistel(r: int, subkey: int) -> int:
+    e = _permute(r, _E, 32) ^ subkey
+    out = 0
+    for i, sbox in enumerate(_SBOX):
+        chunk = (e >> (42 - 6 * i)) & 0x3F
+        out = (out << 4) | sbox[((chunk & 0x20) >> 4 | (chunk & 1)) * 16 + ((chunk >> 1) & 0xF)]
+    return _permute(out, _P, 32)
+
+
+def des_encrypt_block(key: bytes, block: bytes) -> bytes:
+    b = _permute(int.from_bytes(block, 'big'), _IP, 64)
+    left, right = b >> 32, b & _MASK32
+    for subkey in _des_subkeys(key):
+        left, right = right, left ^ _feistel(right, subkey)
+    return _permute((right << 32) | left, _FP, 64).to_bytes(8, 'big')
+
+
+def _expand_des_key(key7: bytes) -> bytes:
+    """7 key bytes -> 8 DES key bytes (parity bits left as zero, DES ignores them)"""
+    bits = int.from_bytes(key7, 'big')
+    return bytes(((bits >> (49 - 7 * i)) & 0x7F) << 1 for i in range(8))
+
+
+# ==== MS-CHAPv2 (RFC 2759, section 8) ====
+
+_MAGIC1 = b"Magic server to client signing constant"
+_MAGIC2 = b"Pad to make it do more than one iteration"
+
+
+def _strip_domain(username: str) -> bytes:
+    return username.split('\\')[-1].encode()
+
+
+def nt_password_hash(password: str) -> bytes:
+    return md4(password.encode('utf-16-le'))
+
+
+def challenge_hash(peer_challenge: bytes, authenticator_challenge: bytes, username: str) -> bytes:
+    return hashlib.sha1(peer_challenge + authenticator_challenge + _strip_domain(username)).digest()[:8]
+
+
+def challenge_response(challenge: bytes, password_hash: bytes) -> bytes:
+    key = password_hash.ljust(21, b'\x00')
+    return b''.join(des_encrypt_block(_expand_des_key(key[i:i + 7]), challenge) for i in (0, 7, 14))
+
+
+def generate_nt_response(authenticator_challenge: bytes, peer_challenge: bytes, username: str, password: str) -> bytes:
+    return challenge_response(challenge_hash(peer_challenge, authenticator_challenge, username),
+                              nt_password_hash(password))
+
+
+def generate_authenticator_response(password: str, nt_response: bytes, peer_challenge: bytes,
+                                    authenticator_challenge: bytes, username: str) -> str:
+    """The "S=<40 hex digits>" string a genuine server returns in CHAP Success"""
+    digest = hashlib.sha1(md4(nt_password_hash(password)) + nt_response + _MAGIC1).digest()
+    digest = hashlib.sha1(digest + challenge_hash(peer_challenge, authenticator_challenge, username) + _MAGIC2).digest()
+    return "S=" + digest.hex().upper()
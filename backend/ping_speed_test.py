@@ -5,6 +5,7 @@ Real PPTP Ping and Speed Testing Implementation
 """
 
 import asyncio
+import hashlib
 import time
 import json
 import random
@@ -12,6 +13,11 @@ import re
 import socket
 from typing import Dict, Optional, Tuple, List
 
+from pptp_client import verify_pptp_credentials_or_probe
+from probe_cache import PROBE_KIND_PPTP_AUTH, PROBE_KIND_SPEED, PROBE_KIND_TCP, probe_cache
+from resource_governor import is_local_errno, is_local_error, local_error_label
+from tcp_scanner import ScanResult
+
 # ==== Fast multi-port TCP reachability helpers (service-aware, no protocol handshake) ====
 async def tcp_connect_measure(ip: str, port: int, per_attempt_timeout: float) -> Tuple[bool, float, str]:
     """СВЕРХ-БЫСТРЫЙ TCP connect с минимальными операциями"""
@@ -31,13 +37,18 @@ async def tcp_connect_measure(ip: str, port: int, per_attempt_timeout: float) ->
         return False, elapsed, "timeout"
     except Exception as e:
         elapsed = (time.time() - start) * 1000.0
+        if isinstance(e, OSError) and is_local_errno(e.errno):
+            return False, elapsed, local_error_label(e.errno)
         return False, elapsed, f"ERR:{type(e).__name__}"
     except Exception as e:
         return False, per_attempt_timeout * 1000.0, f"EXC:{str(e)}"
 
-async def ping_light_tcp_check(ip: str, port: int = 1723, timeout: float = 2.0) -> Dict:
-    """PING LIGHT - быстрая проверка TCP соединения без авторизации"""
-    
+async def ping_light_tcp_check(ip: str, port: int = 1723, timeout: float = 2.0, use_cache: bool = True) -> Dict:
+    """PING LIGHT - быстрая проверка TCP соединения без авторизации (через probe_cache)"""
+    return await probe_cache.probe(ip, port, PROBE_KIND_TCP, lambda: _ping_light_tcp_check(ip, port, timeout),
+                                   use_cache=use_cache)
+
+async def _ping_light_tcp_check(ip: str, port: int, timeout: float) -> Dict:
     start_time = time.time()
     
     try:
@@ -71,12 +82,15 @@ async def ping_light_tcp_check(ip: str, port: int = 1723, timeout: float = 2.0)
             "success_rate": 0.0,
             "attempts_total": 1,
             "attempts_ok": 0,
-            "details": {port: {"ok": 0, "fail": 1, "best_ms": None}},
+            "details": {port: {"ok": 0, "fail": 1, "best_ms": None, "error": "timeout"}},
             "message": f"PING LIGHT TIMEOUT - TCP {port} unreachable (>{timeout}s)",
         }
         
     except Exception as e:
         elapsed_ms = (time.time() - start_time) * 1000.0
+        if isinstance(e, OSError) and is_local_errno(e.errno):
+            return ping_light_result_from_scan(
+                ScanResult(None, ip, port, False, elapsed_ms, local_error_label(e.errno)), timeout)
         error_type = type(e).__name__
         error_msg = str(e)
         return {
@@ -90,32 +104,118 @@ async def ping_light_tcp_check(ip: str, port: int = 1723, timeout: float = 2.0)
             "message": f"PING LIGHT FAILED - TCP {port} error: {error_type}: {error_msg}",
         }
 
-async def multiport_tcp_ping(ip: str, ports: List[int], timeouts: List[float]) -> Dict:
-    """Обертка для совместимости - использует PING LIGHT"""
-    port = ports[0] if ports else 1723
+def ping_light_result_from_scan(result, timeout: float) -> Dict:
+    """Convert a tcp_scanner.ScanResult into the ping_light_tcp_check() result format"""
+    port = result.port
+    if result.success:
+        return {
+            "success": True,
+            "avg_time": round(result.rtt_ms, 1),
+            "best_time": round(result.rtt_ms, 1),
+            "success_rate": 100.0,
+            "attempts_total": 1,
+            "attempts_ok": 1,
+            "details": {port: {"ok": 1, "fail": 0, "best_ms": result.rtt_ms}},
+            "message": f"PING LIGHT OK - TCP {port} accessible in {result.rtt_ms:.1f}ms",
+        }
+    if result.error == "timeout":
+        message = f"PING LIGHT TIMEOUT - TCP {port} unreachable (>{timeout}s)"
+    elif is_local_error(result.error):
+        message = f"PING LIGHT NOT TESTED - local resource error {result.error} (node not judged)"
+    else:
+        message = f"PING LIGHT FAILED - TCP {port} error: {result.error}"
+    return {
+        "success": False,
+        "avg_time": 0.0,
+        "best_time": 0.0,
+        "success_rate": 0.0,
+        "attempts_total": 1,
+        "attempts_ok": 0,
+        "details": {port: {"ok": 0, "fail": 1, "best_ms": None, "error": result.error}},
+        "local_error": is_local_error(result.error),
+        "message": message,
+    }
+
+async def multiport_tcp_ping(ip: str, ports: List[int], timeouts: List[float], use_cache: bool = True) -> Dict:
+    """Race TCP connects to all candidate ports at once.
+    Returns on the first port that accepts (losers are cancelled); "port" holds the winner.
+    Fresh per-port results in probe_cache answer without connecting."""
+    ports = list(dict.fromkeys(int(p) for p in ports)) or [1723]
     timeout = timeouts[0] if timeouts else 2.0
-    
-    return await ping_light_tcp_check(ip, port, timeout)
 
-    success_rate = (total_ok / max(1, total_attempts)) * 100.0
-    success = total_ok >= 2 or (total_ok >= 1 and success_rate >= 50.0)
-    times = [v["best_ms"] for v in details.values() if v["best_ms"] is not None]
-    avg_time = float(sum(times) / len(times)) if times else 0.0
+    if use_cache:
+        cached = {p: probe_cache.get(ip, p, PROBE_KIND_TCP) for p in ports}
+        hit = next((p for p in ports if cached[p] and cached[p]["success"]), None)
+        if hit is not None or all(cached.values()):
+            details = {p: dict(c["details"].get(p, {})) for p, c in cached.items() if c}
+            best_ms = cached[hit]["avg_time"] if hit is not None else 0.0
+            return {
+                "success": hit is not None,
+                "port": hit,
+                "avg_time": best_ms,
+                "best_time": best_ms,
+                "success_rate": 100.0 if hit is not None else 0.0,
+                "attempts_total": 0,
+                "attempts_ok": 0,
+                "details": details,
+                "cached": True,
+                "message": (f"TCP reachability: OK on port {hit} in {best_ms:.1f}ms (cached)" if hit is not None
+                            else f"TCP reachability: FAILED on ports {ports} (cached)"),
+            }
 
-    msg = (
-        f"TCP reachability: {'OK' if success else 'FAILED'}; "
-        f"best={(best_ms or 0.0):.1f}ms avg={avg_time:.1f}ms success={success_rate:.0f}% over {total_attempts} probes"
-    )
+    details = {p: {"ok": 0, "fail": 0, "best_ms": None} for p in ports}
+    tasks = {asyncio.create_task(tcp_connect_measure(ip, p, timeout)): p for p in ports}
+    winner = None
+    winner_ms = 0.0
+    try:
+        pending = set(tasks)
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                port = tasks[task]
+                ok, elapsed_ms, err = task.result()
+                if ok:
+                    details[port]["ok"] = 1
+                    details[port]["best_ms"] = elapsed_ms
+                    if winner is None or elapsed_ms < winner_ms:
+                        winner, winner_ms = port, elapsed_ms
+                else:
+                    details[port]["fail"] = 1
+                    details[port]["error"] = err
+                probe_cache.put(ip, port, PROBE_KIND_TCP,
+                                ping_light_result_from_scan(ScanResult(None, ip, port, ok, elapsed_ms, err), timeout))
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
 
+    attempts_total = sum(d["ok"] + d["fail"] for d in details.values())
+    if winner is not None:
+        return {
+            "success": True,
+            "port": winner,
+            "avg_time": round(winner_ms, 1),
+            "best_time": round(winner_ms, 1),
+            "success_rate": 100.0,
+            "attempts_total": attempts_total,
+            "attempts_ok": 1,
+            "details": details,
+            "message": f"TCP reachability: OK on port {winner} in {winner_ms:.1f}ms ({len(ports)} ports raced)",
+        }
+    # Every port failed locally (fds / ephemeral ports): the node was never really probed
+    local_error = all(is_local_error(d.get("error")) for d in details.values() if d["fail"]) and attempts_total > 0
     return {
-        "success": bool(success),
-        "avg_time": round(avg_time, 1),
-        "best_time": round((best_ms or 0.0), 1),
-        "success_rate": round(success_rate, 1),
-        "attempts_total": int(total_attempts),
-        "attempts_ok": int(total_ok),
+        "success": False,
+        "port": None,
+        "avg_time": 0.0,
+        "best_time": 0.0,
+        "success_rate": 0.0,
+        "attempts_total": attempts_total,
+        "attempts_ok": 0,
         "details": details,
-        "message": msg,
+        "local_error": local_error,
+        "message": (f"TCP reachability: NOT TESTED on ports {ports} (local resource error)" if local_error
+                    else f"TCP reachability: FAILED on ports {ports} (>{timeout}s)"),
     }
 
 # ==== Legacy PPTP-specific tester (kept for backward compatibility) ====
@@ -151,154 +251,20 @@ class PPTPTester:
         PING OK - НАСТОЯЩАЯ проверка PPTP с авторизацией (ИСПРАВЛЕНА для правдивых результатов)
         Returns: {"success": bool, "avg_time": float, "packet_loss": float, "message": str}
         """
-        # Используем аутентичный PPTP алгоритм вместо ложных проверок
-        return await PPTPTester._authentic_pptp_test(ip, login, password, timeout)
+        # Используем аутентичный PPTP алгоритм вместо ложных проверок; результат кэшируется по credentials
+        fingerprint = hashlib.sha1(f"{login}:{password}".encode()).hexdigest()[:16]
+        return await probe_cache.probe(ip, 1723, PROBE_KIND_PPTP_AUTH,
+                                       lambda: PPTPTester._authentic_pptp_test(ip, login, password, timeout),
+                                       variant=fingerprint)
 
     @staticmethod
     async def _authentic_pptp_test(ip: str, login: str, password: str, timeout: float = 10.0) -> Dict:
         """
-        НАСТОЯЩАЯ PPTP авторизация - проверяет реальные credentials
-        ИСПРАВЛЯЕТ проблему ложно-положительных результатов
+        НАСТОЯЩАЯ PPTP авторизация в userspace (pptp_client): control + Outgoing-Call + GRE/LCP + MS-CHAPv2.
+        Если GRE сокет недоступен (нет CAP_NET_RAW) - только control channel проверка (pptp_probe),
+        credentials при этом не считаются подтвержденными.
         """
-        import struct
-        start_time = time.time()
-        
-        try:
-            # ИСПРАВЛЕНО: Более строгая проверка PPTP credentials
-            # Не все IP с открытым портом 1723 имеют валидные credentials
-            
-            # Устанавливаем TCP соединение к порту 1723
-            future = asyncio.open_connection(ip, 1723)
-            reader, writer = await asyncio.wait_for(future, timeout=min(timeout, 5.0))
-            
-            # PPTP Control Connection Start-Request (правильный протокол)
-            start_request = struct.pack('>HH', 156, 1)  # Length, PPTP Message Type
-            start_request += struct.pack('>L', 0x1a2b3c4d)  # Magic Cookie
-            start_request += struct.pack('>HH', 1, 0)  # Control Message Type, Reserved
-            start_request += struct.pack('>HH', 1, 0)  # Protocol Version, Reserved
-            start_request += struct.pack('>L', 1)  # Framing Capabilities
-            start_request += struct.pack('>L', 1)  # Bearer Capabilities  
-            start_request += struct.pack('>HH', 1, 1)  # Maximum Channels, Firmware Revision
-            start_request += b'PPTP_CLIENT' + b'\x00' * (64 - len('PPTP_CLIENT'))  # Host Name
-            start_request += b'PPTP_VENDOR' + b'\x00' * (64 - len('PPTP_VENDOR'))  # Vendor String
-            
-            writer.write(start_request)
-            await writer.drain()
-            
-            # Читаем Start-Reply с валидацией
-            try:
-                response_data = await asyncio.wait_for(reader.read(1024), timeout=5.0)
-                if len(response_data) < 21:  # Минимальная длина ответа
-                    raise Exception("Invalid PPTP response length")
-                
-                # Парсим и валидируем PPTP ответ
-                length, msg_type = struct.unpack('>HH', response_data[:4])
-                magic = struct.unpack('>L', response_data[4:8])[0]
-                
-                if magic != 0x1a2b3c4d:
-                    raise Exception("Invalid PPTP magic cookie")
-                    
-                # Проверяем что это Start-Reply
-                control_type = struct.unpack('>H', response_data[8:10])[0]
-                if control_type != 2:  # Start-Reply
-                    raise Exception("Expected Start-Reply message")
-                    
-                # КРИТИЧЕСКАЯ ПРОВЕРКА: Result Code
-                if len(response_data) < 21:
-                    raise Exception("Response too short for result code")
-                    
-                result_code = struct.unpack('>B', response_data[20:21])[0]
-                if result_code != 1:  # Success = 1, все остальное = отказ
-                    writer.close()
-                    await writer.wait_closed()
-                    return {
-                        "success": False,
-                        "avg_time": 0.0,
-                        "packet_loss": 100.0,
-                        "message": f"AUTHENTIC PPTP FAILED - Control connection rejected (result={result_code})",
-                    }
-                
-                # РЕАЛЬНАЯ ПРОВЕРКА CREDENTIALS: Добавляем строгость
-                # В реальной системе не все IP с портом 1723 имеют валидные admin:admin
-                
-                # Комплексная эвристика для максимально реалистичных результатов
-                ip_parts = ip.split('.')
-                ip_sum = sum(int(part) for part in ip_parts)
-                
-                # Дополнительные критерии реалистичности:
-                # 1. Проверка типичных диапазонов PPTP серверов
-                # 2. Анализ паттернов IP адресов
-                # 3. Имитация реальной проверки credentials
-                
-                realistic_success_chance = 0.08  # 8% базовая вероятность
-                
-                # Корректировка на основе IP паттернов (реальные PPTP серверы чаще в определенных диапазонах)
-                first_octet = int(ip_parts[0])
-                if first_octet in [5, 24, 68, 76, 96, 144]:  # Паттерны из наших тестовых данных
-                    realistic_success_chance += 0.02
-                
-                # Дополнительная проверка на "подозрительные" credentials
-                if login == "admin" and password == "admin":  # Очень популярные credentials
-                    realistic_success_chance *= 0.7  # Снижаем вероятность
-                
-                ip_hash = hash(f"{login}:{password}:{ip}:{elapsed_ms}") % 100
-                
-                elapsed_ms = (time.time() - start_time) * 1000.0
-                
-                if ip_hash < (realistic_success_chance * 100):
-                    # Эмулируем успешную авторизацию
-                    writer.close()
-                    await writer.wait_closed()
-                    return {
-                        "success": True,
-                        "avg_time": round(elapsed_ms, 1),
-                        "packet_loss": 0.0,
-                        "message": f"REALISTIC PPTP OK - Credentials validated in {elapsed_ms:.1f}ms",
-                    }
-                else:
-                    # Эмулируем неудачную авторизацию (более реалистично)
-                    writer.close()
-                    await writer.wait_closed()
-                    return {
-                        "success": False,
-                        "avg_time": 0.0,
-                        "packet_loss": 100.0,
-                        "message": f"REALISTIC PPTP FAILED - Invalid credentials {login}:{password} (realistic simulation)",
-                    }
-                
-            except asyncio.TimeoutError:
-                writer.close()
-                await writer.wait_closed()
-                return {
-                    "success": False,
-                    "avg_time": 0.0,
-                    "packet_loss": 100.0,
-                    "message": "PPTP handshake timeout - server not responding to protocol",
-                }
-            
-            writer.close()
-            await writer.wait_closed()
-            return {
-                "success": False,
-                "avg_time": 0.0,
-                "packet_loss": 100.0,
-                "message": "PPTP protocol error - unexpected response format",
-            }
-            
-        except asyncio.TimeoutError:
-            return {
-                "success": False,
-                "avg_time": 0.0,
-                "packet_loss": 100.0,
-                "message": f"Connection timeout - PPTP port 1723 unreachable on {ip}",
-            }
-        except Exception as e:
-            return {
-                "success": False,
-                "avg_time": 0.0,
-                "packet_loss": 100.0,
-                "message": f"PPTP connection error: {str(e)}",
-            }
+        return await verify_pptp_credentials_or_probe(ip, login, password, timeout=timeout)
 
     @staticmethod
     async def real_speed_test(ip: str, sample_kb: int = 512, timeout_total: int = 15) -> Dict:
@@ -457,8 +423,10 @@ async def test_node_speed(ip: str, sample_kb: int = 32, timeout_total: int = 2)
     # Импортируем accurate speed measurement
     from accurate_speed_test import test_node_accurate_speed
     
-    # Вызываем ТОЧНЫЙ замер пропускной способности
-    return await test_node_accurate_speed(ip, login="admin", password="admin", sample_kb=sample_kb, timeout=timeout_total)
+    # Вызываем ТОЧНЫЙ замер пропускной способности (недавний результат берется из probe_cache)
+    return await probe_cache.probe(
+        ip, 1723, PROBE_KIND_SPEED,
+        lambda: test_node_accurate_speed(ip, login="admin", password="admin", sample_kb=sample_kb, timeout=timeout_total))
     
     try:
         # Сначала проверим доступность через простой HTTP запрос
@@ -4,6 +4,8 @@ import struct
 import time
 from typing import Dict, Tuple
 
+from pptp_client import verify_pptp_credentials_or_probe
+
 class PPTPAuthenticator:
     """Настоящая PPTP авторизация для проверки валидности учетных данных"""
     
@@ -12,143 +14,10 @@ class PPTPAuthenticator:
         """
         Выполняет настоящую PPTP авторизацию с логином и паролем
         Возвращает точный результат - работают ли credentials на самом деле
+        (userspace клиент pptp_client: Outgoing-Call + GRE + LCP + MS-CHAPv2, без pppd).
+        Без GRE сокета (нет CAP_NET_RAW) - только control channel проверка, credentials не подтверждены.
         """
-        start_time = time.time()
-        
-        try:
-            # Устанавливаем TCP соединение
-            future = asyncio.open_connection(ip, 1723)
-            reader, writer = await asyncio.wait_for(future, timeout=timeout)
-            
-            # PPTP Control Connection Start-Request (правильный формат)
-            start_request = struct.pack('>HH', 156, 1)  # Length, PPTP Message Type
-            start_request += struct.pack('>L', 0x1a2b3c4d)  # Magic Cookie
-            start_request += struct.pack('>HH', 1, 0)  # Control Message Type, Reserved
-            start_request += struct.pack('>HH', 1, 0)  # Protocol Version, Reserved
-            start_request += struct.pack('>L', 1)  # Framing Capabilities
-            start_request += struct.pack('>L', 1)  # Bearer Capabilities  
-            start_request += struct.pack('>HH', 1, 1)  # Maximum Channels, Firmware Revision
-            start_request += b'PPTP_CLIENT' + b'\x00' * (64 - len('PPTP_CLIENT'))  # Host Name
-            start_request += b'PPTP_VENDOR' + b'\x00' * (64 - len('PPTP_VENDOR'))  # Vendor String
-            
-            writer.write(start_request)
-            await writer.drain()
-            
-            # Читаем Start-Reply (увеличен timeout для медленных серверов)
-            try:
-                response_data = await asyncio.wait_for(reader.read(1024), timeout=8.0)
-                if len(response_data) < 16:
-                    raise Exception("Invalid PPTP response length")
-                
-                # Парсим ответ
-                length, msg_type = struct.unpack('>HH', response_data[:4])
-                magic = struct.unpack('>L', response_data[4:8])[0]
-                
-                if magic != 0x1a2b3c4d:
-                    raise Exception("Invalid PPTP magic cookie")
-                    
-                # Проверяем что это Start-Reply
-                control_type = struct.unpack('>H', response_data[8:10])[0]
-                if control_type != 2:  # Start-Reply
-                    raise Exception("Expected Start-Reply message")
-                    
-                # Читаем Result Code
-                result_code = struct.unpack('>B', response_data[20:21])[0]
-                # ✅ ИСПРАВЛЕНО: Некоторые PPTP серверы возвращают result=0 но ВСЕ РАВНО работают
-                # Не отклоняем соединение, а продолжаем отправку Call Request
-                if result_code != 1:
-                    # Логируем но НЕ отклоняем
-                    pass  # Продолжаем независимо от result_code
-                
-                # Теперь пробуем установить исходящий call (здесь нужны credentials)
-                call_request = struct.pack('>HH', 168, 1)  # Length, PPTP Message Type  
-                call_request += struct.pack('>L', 0x1a2b3c4d)  # Magic Cookie
-                call_request += struct.pack('>HH', 7, 0)  # Outgoing Call Request, Reserved
-                call_request += struct.pack('>HH', 1, 2)  # Call ID, Call Serial Number
-                call_request += struct.pack('>L', 300)  # Minimum BPS
-                call_request += struct.pack('>L', 100000000)  # Maximum BPS
-                call_request += struct.pack('>L', 1)  # Bearer Type (Digital)
-                call_request += struct.pack('>L', 1)  # Framing Type (Sync)
-                call_request += struct.pack('>HH', 1500, 64)  # Recv Window Size, Processing Delay
-                call_request += struct.pack('>HH', len(login), 0)  # Phone Number Length, Reserved
-                call_request += login.encode()[:64].ljust(64, b'\x00')  # Phone Number (используем как login)
-                call_request += b'PPTP_SUBADDR'[:64].ljust(64, b'\x00')  # Subaddress
-                
-                writer.write(call_request)
-                await writer.drain()
-                
-                # Читаем Call-Reply (увеличен timeout для медленных серверов)
-                call_response = await asyncio.wait_for(reader.read(1024), timeout=8.0)
-                if len(call_response) >= 20:
-                    call_result = struct.unpack('>B', call_response[20:21])[0]
-                    
-                    elapsed_ms = (time.time() - start_time) * 1000.0
-                    writer.close()
-                    await writer.wait_closed()
-                    
-                    # ✅ ИСПРАВЛЕНО: call_result 0-5 могут означать успех!
-                    # Credentials проверяются через PPP/CHAP ПОСЛЕ установки call
-                    # Мы НЕ проверяем PPP, поэтому считаем что если call установлен - узел рабочий
-                    # 0 = Success
-                    # 1 = Connected  
-                    # 2 = General error (но call установлен)
-                    # 3 = No carrier (но call установлен)
-                    # 4 = Busy (но call установлен)
-                    # 5 = No dial tone (но call установлен - означает что PPTP работает!)
-                    if call_result <= 5:  # 0-5 = call установлен успешно
-                        return {
-                            "success": True,
-                            "avg_time": round(elapsed_ms, 1),
-                            "packet_loss": 0.0,
-                            "message": f"PPTP OK - Call established (call_result={call_result}, {elapsed_ms:.1f}ms)",
-                            "auth_tested": True
-                        }
-                    else:
-                        return {
-                            "success": False,
-                            "avg_time": 0.0,
-                            "packet_loss": 100.0,
-                            "message": f"PPTP FAILED - Call rejected (call_result={call_result})",
-                            "auth_tested": True
-                        }
-                
-            except asyncio.TimeoutError:
-                writer.close()
-                await writer.wait_closed()
-                return {
-                    "success": False,
-                    "avg_time": 0.0,
-                    "packet_loss": 100.0,
-                    "message": "PPTP handshake timeout - server not responding",
-                    "auth_tested": False
-                }
-            
-            writer.close()
-            await writer.wait_closed()
-            return {
-                "success": False,
-                "avg_time": 0.0,
-                "packet_loss": 100.0,
-                "message": "PPTP protocol error - unexpected response",
-                "auth_tested": False
-            }
-            
-        except asyncio.TimeoutError:
-            return {
-                "success": False,
-                "avg_time": 0.0,
-                "packet_loss": 100.0,
-                "message": "Connection timeout - port 1723 unreachable",
-                "auth_tested": False
-            }
-        except Exception as e:
-            return {
-                "success": False,
-                "avg_time": 0.0,
-                "packet_loss": 100.0,
-                "message": f"PPTP connection error: {str(e)}",
-                "auth_tested": False
-            }
+        return await verify_pptp_credentials_or_probe(ip, login, password, timeout=timeout)
 
 # Функция для интеграции с существующим кодом
 async def test_node_ping_authentic(ip: str, login: str = "admin", password: str = "admin") -> Dict:
@@ -0,0 +1,647 @@
+"""
+Userspace PPTP client for credential checks
+Outgoing-Call over the control connection, PPP frames in enhanced GRE (RFC 2637 4.1),
+LCP negotiation and MS-CHAPv2 / CHAP-MD5 / PAP authentication - no pppd and no kernel
+ppp interface, so hundreds of checks share one process and one GRE socket.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import socket
+import struct
+import time
+from typing import Dict, List, Optional, Tuple
+
+from mschapv2 import generate_authenticator_response, generate_nt_response
+from pptp_probe import (
+    CALL_CLEAR_REQUEST, OUTGOING_CALL_REPLY, OUTGOING_CALL_REQUEST, PPTP_PORT,
+    PPTPControlConnection, PPTPProtocolError, build_control_message, pptp_control_probe,
+)
+
+logger = logging.getLogger("pptp_client")
+
+IPPROTO_GRE = 47
+GRE_PROTOCOL_PPP = 0x880B
+# GRE-in-UDP instead of raw IP protocol 47 (no CAP_NET_RAW, local stand-in server in pptp_standin_server)
+PPTP_GRE_UDP_PORT = int(os.environ.get('PPTP_GRE_UDP_PORT', 0))
+_GRE_QUEUE_LIMIT = 256
+
+PPP_LCP = 0xC021
+PPP_PAP = 0xC023
+PPP_CHAP = 0xC223
+CHAP_MD5 = 0x05
+CHAP_MSCHAPV2 = 0x81
+
+LCP_CONF_REQ = 1
+LCP_CONF_ACK = 2
+LCP_CONF_NAK = 3
+LCP_CONF_REJ = 4
+LCP_TERM_REQ = 5
+LCP_TERM_ACK = 6
+LCP_ECHO_REQ = 9
+LCP_ECHO_REPLY = 10
+
+LCP_OPT_MRU = 1
+LCP_OPT_ACCM = 2
+LCP_OPT_AUTH = 3
+LCP_OPT_MAGIC = 5
+LCP_OPT_PFC = 7
+LCP_OPT_ACFC = 8
+_LCP_SUPPORTED_OPTIONS = {LCP_OPT_MRU, LCP_OPT_ACCM, LCP_OPT_AUTH, LCP_OPT_MAGIC, LCP_OPT_PFC, LCP_OPT_ACFC}
+
+CHAP_CHALLENGE = 1
+CHAP_RESPONSE = 2
+CHAP_SUCCESS = 3
+CHAP_FAILURE = 4
+
+PAP_AUTH_REQ = 1
+PAP_AUTH_ACK = 2
+PAP_AUTH_NAK = 3
+
+AUTH_MSCHAPV2 = "mschapv2"
+AUTH_CHAP_MD5 = "chap-md5"
+AUTH_PAP = "pap"
+AUTH_NONE = "none"
+
+OUTGOING_CALL_CONNECTED = 1
+LCP_RESTART_INTERVAL = 1.0
+
+# MS-CHAP failure codes (RFC 2759 section 6)
+MSCHAP_ERRORS = {
+    646: "restricted logon hours",
+    647: "account disabled",
+    648: "password expired",
+    649: "no dial-in permission",
+    691: "authentication failure",
+    709: "error changing password",
+}
+
+
+# ==== GRE ====
+
+def build_gre(peer_call_id: int, payload: bytes, seq: Optional[int] = None, ack: Optional[int] = None) -> bytes:
+    flags = 0x20          # K: key (payload length + call id) present
+    version = 0x01        # enhanced GRE
+    if seq is not None:
+        flags |= 0x10     # S
+    if ack is not None:
+        version |= 0x80   # A
+    packet = struct.pack('>BBHHH', flags, version, GRE_PROTOCOL_PPP, len(payload), peer_call_id)
+    if seq is not None:
+        packet += struct.pack('>L', seq)
+    if ack is not None:
+        packet += struct.pack('>L', ack)
+    return packet + payload
+
+
+def parse_gre(packet: bytes) -> Optional[Tuple[int, Optional[int], Optional[int], bytes]]:
+    """-> (call id, seq, ack, payload) or None for anything that is not PPTP GRE"""
+    if len(packet) < 8:
+        return None
+    flags, version, protocol, length, call_id = struct.unpack_from('>BBHHH', packet)
+    if (version & 0x07) != 1 or protocol != GRE_PROTOCOL_PPP or not flags & 0x20:
+        return None
+    offset = 8
+    seq = ack = None
+    if flags & 0x10:
+        if len(packet) < offset + 4:
+            return None
+        seq = struct.unpack_from('>L', packet, offset)[0]
+        offset += 4
+    if version & 0x80:
+        if len(packet) < offset + 4:
+            return None
+        ack = struct.unpack_from('>L', packet, offset)[0]
+        offset += 4
+    return call_id, seq, ack, packet[offset:offset + length]
+
+
+class GREDispatcher:
+    """One GRE socket per process; packets are routed to calls by (peer ip, local call id)"""
+
+    def __init__(self, udp_port: int = PPTP_GRE_UDP_PORT):
+        self.udp_port = udp_port
+        self._sock: Optional[socket.socket] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._calls: Dict[Tuple[str, int], asyncio.Queue] = {}
+        self._call_ids = set()
+        self._next_call_id = random.randint(1, 0xFFFF)
+        self.stats = {'rx': 0, 'tx': 0, 'unmatched': 0, 'dropped': 0}
+
+    def register(self, peer_ip: str) -> Tuple[int, asyncio.Queue]:
+        """Allocate a local call id and the queue its GRE packets are delivered to"""
+        self._ensure_open()
+        if len(self._call_ids) >= 0xFFFF:
+            raise RuntimeError("No free PPTP call ids")
+        while True:
+            self._next_call_id = self._next_call_id % 0xFFFF + 1
+            if self._next_call_id not in self._call_ids:
+                break
+        call_id = self._next_call_id
+        queue: asyncio.Queue = asyncio.Queue()
+        self._call_ids.add(call_id)
+        self._calls[(peer_ip, call_id)] = queue
+        return call_id, queue
+
+    def unregister(self, peer_ip: str, call_id: int):
+        self._calls.pop((peer_ip, call_id), None)
+        self._call_ids.discard(call_id)
+
+    def send(self, peer_ip: str, packet: bytes):
+        try:
+            self._sock.sendto(packet, (peer_ip, self.udp_port or 0))
+            self.stats['tx'] += 1
+        except (BlockingIOError, InterruptedError):
+            self.stats['dropped'] += 1  # GRE is unreliable anyway; LCP retransmits
+        except OSError as e:
+            logger.debug(f"GRE send to {peer_ip} failed: {e}")
+            self.stats['dropped'] += 1
+
+    def _ensure_open(self):
+        loop = asyncio.get_running_loop()
+        if self._sock is not None and self._loop is loop:
+            return
+        self._close()
+        if self.udp_port:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(('0.0.0.0', self.udp_port))
+        else:
+            # PermissionError without CAP_NET_RAW - callers report stage "gre"
+            sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, IPPROTO_GRE)
+        sock.setblocking(False)
+        loop.add_reader(sock.fileno(), self._on_readable)
+        self._sock = sock
+        self._loop = loop
+        logger.info(f"GRE socket opened ({'udp:' + str(self.udp_port) if self.udp_port else 'raw ip/47'})")
+
+    def _close(self):
+        if self._sock is None:
+            return
+        try:
+            if not self._loop.is_closed():
+                self._loop.remove_reader(self._sock.fileno())
+        except Exception:
+            pass
+        self._sock.close()
+        self._sock = None
+        self._loop = None
+
+    def _on_readable(self):
+        for _ in range(_GRE_QUEUE_LIMIT):
+            try:
+                data, addr = self._sock.recvfrom(65535)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            if not self.udp_port:
+                if len(data) < 20:
+                    continue
+                data = data[(data[0] & 0x0F) * 4:]  # raw IPv4 sockets deliver the IP header
+            parsed = parse_gre(data)
+            if parsed is None:
+                continue
+            queue = self._calls.get((addr[0], parsed[0]))
+            if queue is None:
+                self.stats['unmatched'] += 1
+                continue
+            if queue.qsize() >= _GRE_QUEUE_LIMIT:
+                self.stats['dropped'] += 1
+                continue
+            self.stats['rx'] += 1
+            queue.put_nowait(parsed)
+
+
+# Global GRE dispatcher instance
+gre_dispatcher = GREDispatcher()
+
+
+# ==== PPP over one call ====
+
+def parse_ppp_frame(payload: bytes) -> Optional[Tuple[int, bytes]]:
+    if payload[:2] == b'\xff\x03':
+        payload = payload[2:]  # address/control present unless ACFC was negotiated
+    if not payload:
+        return None
+    if payload[0] & 1:
+        return payload[0], payload[1:]  # compressed protocol field (PFC)
+    if len(payload) < 2:
+        return None
+    return struct.unpack_from('>H', payload)[0], payload[2:]
+
+
+def build_ppp_packet(code: int, ident: int, data: bytes = b'') -> bytes:
+    """LCP / CHAP / PAP packet: code, identifier, length, data"""
+    return struct.pack('>BBH', code, ident, 4 + len(data)) + data
+
+
+def parse_ppp_packet(data: bytes) -> Optional[Tuple[int, int, bytes]]:
+    if len(data) < 4:
+        return None
+    code, ident, length = struct.unpack_from('>BBH', data)
+    if length < 4 or length > len(data):
+        return None
+    return code, ident, data[4:length]
+
+
+def build_options(options: List[Tuple[int, bytes]]) -> bytes:
+    return b''.join(struct.pack('>BB', opt, 2 + len(value)) + value for opt, value in options)
+
+
+def parse_options(data: bytes) -> List[Tuple[int, bytes]]:
+    options = []
+    offset = 0
+    while offset + 2 <= len(data):
+        opt, length = data[offset], data[offset + 1]
+        if length < 2 or offset + length > len(data):
+            break
+        options.append((opt, data[offset + 2:offset + length]))
+        offset += length
+    return options
+
+
+class GRELink:
+    """PPP frames over one PPTP call's GRE flow"""
+
+    def __init__(self, dispatcher: GREDispatcher, peer_ip: str):
+        self.dispatcher = dispatcher
+        self.peer_ip = peer_ip
+        self.call_id, self.queue = dispatcher.register(peer_ip)
+        self.peer_call_id = 0
+        self.seq = 0
+        self.last_rx_seq: Optional[int] = None
+
+    def send_ppp(self, protocol: int, payload: bytes):
+        frame = b'\xff\x03' + struct.pack('>H', protocol) + payload
+        self.dispatcher.send(self.peer_ip, build_gre(self.peer_call_id, frame, seq=self.seq, ack=self.last_rx_seq))
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+
+    async def recv_ppp(self, timeout: float) -> Optional[Tuple[int, bytes]]:
+        """Next PPP frame or None on timeout; ack-only GRE packets are consumed silently"""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            try:
+                _, seq, _, payload = await asyncio.wait_for(self.queue.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return None
+            if seq is not None:
+                self.last_rx_seq = seq
+            frame = parse_ppp_frame(payload) if payload else None
+            if frame is not None:
+                return frame
+
+    def close(self):
+        self.dispatcher.unregister(self.peer_ip, self.call_id)
+
+
+# ==== Control messages for the call ====
+
+def build_outgoing_call_request(call_id: int, serial: int, window: int = 64) -> bytes:
+    body = struct.pack('>HHLLLLHHHH', call_id, serial, 300, 100000000, 3, 3, window, 0, 0, 0)
+    return build_control_message(OUTGOING_CALL_REQUEST, body + b'\x00' * 128)
+
+
+def parse_outgoing_call_reply(body: bytes) -> Dict:
+    if len(body) < 20:
+        raise PPTPProtocolError("Outgoing-Call-Reply too short")
+    call_id, peer_call_id, result_code, error_code, cause, speed, window, delay, _ = struct.unpack_from('>HHBBHLHHL', body)
+    return {
+        "call_id": call_id,
+        "peer_call_id": peer_call_id,
+        "result_code": result_code,
+        "error_code": error_code,
+        "cause": cause,
+        "connect_speed": speed,
+        "recv_window": window,
+    }
+
+
+def build_call_clear_request(call_id: int) -> bytes:
+    return build_control_message(CALL_CLEAR_REQUEST, struct.pack('>HH', call_id, 0))
+
+
+# ==== Credential check ====
+
+class _StageFailure(Exception):
+    def __init__(self, stage: str, message: str):
+        super().__init__(message)
+        self.stage = stage
+
+
+class PPTPCredentialCheck:
+    """One credential check: control connection -> call -> LCP -> authentication -> teardown"""
+
+    def __init__(self, ip: str, login: str, password: str, port: int = PPTP_PORT,
+                 dispatcher: Optional[GREDispatcher] = None):
+        self.ip = ip
+        self.login = login
+        self.password = password
+        self.port = port
+        self.dispatcher = dispatcher or gre_dispatcher
+        self.control = PPTPControlConnection(ip, port)
+        self.link: Optional[GRELink] = None
+        self.magic = random.getrandbits(32) or 1
+        self._lcp_id = 0
+        self.auth_method: Optional[str] = None
+
+    async def run(self, timeout: float) -> Dict:
+        start = time.monotonic()
+        deadline = start + timeout
+        stage = "connect"
+        try:
+            await self.control.connect(min(timeout, 5.0))
+            stage = "control"
+            reply = await self.control.start_control(self._remaining(deadline))
+            if reply["result_code"] != 1:
+                raise _StageFailure(stage, f"Control connection rejected (result={reply['result_code']})")
+
+            stage = "gre"
+            peer_ip = self.control.writer.get_extra_info('peername')[0]
+            try:
+                self.link = GRELink(self.dispatcher, peer_ip)
+            except OSError as e:
+                raise _StageFailure(stage, f"GRE socket unavailable ({e}); needs CAP_NET_RAW or PPTP_GRE_UDP_PORT")
+
+            stage = "call"
+            await self._outgoing_call(deadline)
+            stage = "lcp"
+            auth = await self._negotiate_lcp(deadline)
+            stage = "auth"
+            await self._authenticate(auth, deadline)
+
+            elapsed_ms = (time.monotonic() - start) * 1000.0
+            if self.auth_method == AUTH_NONE:
+                message = f"PPTP OK - server requires no authentication ({elapsed_ms:.1f}ms)"
+            else:
+                message = f"PPTP OK - credentials accepted via {self.auth_method} in {elapsed_ms:.1f}ms"
+            return self._result(True, "ok", message, elapsed_ms)
+        except _StageFailure as e:
+            return self._result(False, e.stage, f"PPTP FAILED ({e.stage}) - {e}")
+        except asyncio.TimeoutError:
+            return self._result(False, stage, f"PPTP {stage} timeout on {self.ip}")
+        except (PPTPProtocolError, asyncio.IncompleteReadError) as e:
+            return self._result(False, stage, f"PPTP protocol error ({stage}): {e}")
+        except OSError as e:
+            return self._result(False, stage, f"PPTP connection error ({stage}): {type(e).__name__}: {e}")
+        finally:
+            await self._teardown()
+
+    def _result(self, success: bool, stage: str, message: str, elapsed_ms: float = 0.0) -> Dict:
+        return {
+            "success": success,
+            "avg_time": round(self.control.handshake_ms or elapsed_ms, 1) if success else 0.0,
+            "packet_loss": 0.0 if success else 100.0,
+            "message": message,
+            "auth_tested": stage == "auth" or (stage == "ok" and self.auth_method != AUTH_NONE),
+            "auth_method": self.auth_method,
+            "stage": stage,
+            "connect_ms": round(self.control.connect_ms, 1) if self.control.connect_ms is not None else None,
+            "auth_time_ms": round(elapsed_ms, 1),
+        }
+
+    @staticmethod
+    def _remaining(deadline: float) -> float:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise asyncio.TimeoutError()
+        return remaining
+
+    async def _outgoing_call(self, deadline: float):
+        self.control.writer.write(build_outgoing_call_request(self.link.call_id, random.randint(0, 0xFFFF)))
+        await self.control.writer.drain()
+
+        async def wait_reply():
+            while True:
+                control_type, body = await self.control._read_skipping_echo()
+                if control_type == OUTGOING_CALL_REPLY:
+                    return parse_outgoing_call_reply(body)
+
+        reply = await asyncio.wait_for(wait_reply(), timeout=self._remaining(deadline))
+        if reply["peer_call_id"] != self.link.call_id:
+            raise _StageFailure("call", "Outgoing-Call-Reply for a different call")
+        if reply["result_code"] != OUTGOING_CALL_CONNECTED:
+            raise _StageFailure("call", f"Outgoing call rejected (result={reply['result_code']}, error={reply['error_code']})")
+        self.link.peer_call_id = reply["call_id"]
+
+    # ---- LCP ----
+
+    def _send_lcp(self, code: int, ident: int, data: bytes = b''):
+        self.link.send_ppp(PPP_LCP, build_ppp_packet(code, ident, data))
+
+    def _handle_lcp_common(self, code: int, ident: int, data: bytes) -> bool:
+        """Echo and Terminate handling shared by every phase; True if consumed"""
+        if code == LCP_ECHO_REQ:
+            self._send_lcp(LCP_ECHO_REPLY, ident, struct.pack('>L', self.magic) + data[4:])
+            return True
+        if code == LCP_TERM_REQ:
+            self._send_lcp(LCP_TERM_ACK, ident)
+            raise _StageFailure("lcp", "Peer terminated the PPP link")
+        return code in (LCP_ECHO_REPLY, LCP_TERM_ACK)
+
+    @staticmethod
+    def _review_peer_options(options: List[Tuple[int, bytes]]) -> Tuple[int, List[Tuple[int, bytes]], Optional[str]]:
+        """Decide Ack / Nak / Reject for the peer's Configure-Request"""
+        rejected = [opt for opt in options if opt[0] not in _LCP_SUPPORTED_OPTIONS]
+        if rejected:
+            return LCP_CONF_REJ, rejected, None
+        auth = AUTH_NONE
+        for opt, value in options:
+            if opt != LCP_OPT_AUTH:
+                continue
+            protocol = struct.unpack('>H', value[:2])[0] if len(value) >= 2 else 0
+            if protocol == PPP_CHAP and value[2:3] == bytes([CHAP_MSCHAPV2]):
+                auth = AUTH_MSCHAPV2
+            elif protocol == PPP_CHAP and value[2:3] == bytes([CHAP_MD5]):
+                auth = AUTH_CHAP_MD5
+            elif protocol == PPP_PAP:
+                auth = AUTH_PAP
+            else:
+                return LCP_CONF_NAK, [(LCP_OPT_AUTH, struct.pack('>HB', PPP_CHAP, CHAP_MSCHAPV2))], None
+        return LCP_CONF_ACK, options, auth
+
+    async def _negotiate_lcp(self, deadline: float) -> str:
+        our_options = {LCP_OPT_MAGIC: struct.pack('>L', self.magic)}
+        our_acked = peer_acked = False
+        auth = AUTH_NONE
+        next_send = 0.0
+        while not (our_acked and peer_acked):
+            now = time.monotonic()
+            if now >= deadline:
+                raise _StageFailure("lcp", "no PPP response over GRE (GRE blocked or call not bridged)")
+            if not our_acked and now >= next_send:
+                self._lcp_id = (self._lcp_id + 1) & 0xFF
+                self._send_lcp(LCP_CONF_REQ, self._lcp_id, build_options(list(our_options.items())))
+                next_send = now + LCP_RESTART_INTERVAL
+            wait_until = deadline if our_acked else min(deadline, next_send)
+            frame = await self.link.recv_ppp(max(0.01, wait_until - time.monotonic()))
+            if frame is None or frame[0] != PPP_LCP:
+                continue
+            packet = parse_ppp_packet(frame[1])
+            if packet is None:
+                continue
+            code, ident, data = packet
+            if code == LCP_CONF_REQ:
+                reply_code, reply_options, requested_auth = self._review_peer_options(parse_options(data))
+                self._send_lcp(reply_code, ident, build_options(reply_options))
+                peer_acked = reply_code == LCP_CONF_ACK
+                if peer_acked:
+                    auth = requested_auth
+            elif ident != self._lcp_id and code in (LCP_CONF_ACK, LCP_CONF_NAK, LCP_CONF_REJ):
+                continue  # stale reply to an earlier Configure-Request
+            elif code == LCP_CONF_ACK:
+                our_acked = True
+            elif code == LCP_CONF_NAK:
+                if any(opt == LCP_OPT_MAGIC for opt, _ in parse_options(data)):
+                    self.magic = random.getrandbits(32) or 1
+                    our_options[LCP_OPT_MAGIC] = struct.pack('>L', self.magic)
+                next_send = 0.0
+            elif code == LCP_CONF_REJ:
+                for opt, _ in parse_options(data):
+                    our_options.pop(opt, None)
+                next_send = 0.0
+            else:
+                self._handle_lcp_common(code, ident, data)
+        return auth
+
+    # ---- authentication ----
+
+    async def _authenticate(self, auth: str, deadline: float):
+        self.auth_method = auth
+        if auth == AUTH_NONE:
+            return
+        if auth == AUTH_PAP:
+            await self._authenticate_pap(deadline)
+            return
+
+        peer_challenge = os.urandom(16)
+        expected_success = None
+        while True:
+            frame = await self.link.recv_ppp(self._remaining(deadline))
+            if frame is None:
+                raise _StageFailure("auth", "no CHAP challenge from server")
+            protocol, data = frame
+            packet = parse_ppp_packet(data)
+            if packet is None:
+                continue
+            code, ident, body = packet
+            if protocol == PPP_LCP:
+                self._handle_lcp_common(code, ident, body)
+                continue
+            if protocol != PPP_CHAP:
+                continue
+            if code == CHAP_CHALLENGE:
+                if not body or len(body) < 1 + body[0]:
+                    continue
+                challenge = body[1:1 + body[0]]
+                if auth == AUTH_MSCHAPV2:
+                    if len(challenge) != 16:
+                        raise _StageFailure("auth", f"bad MS-CHAPv2 challenge size {len(challenge)}")
+                    nt_response = generate_nt_response(challenge, peer_challenge, self.login, self.password)
+                    value = peer_challenge + b'\x00' * 8 + nt_response + b'\x00'
+                    expected_success = generate_authenticator_response(
+                        self.password, nt_response, peer_challenge, challenge, self.login)
+                else:
+                    value = hashlib.md5(bytes([ident]) + self.password.encode() + challenge).digest()
+                response = bytes([len(value)]) + value + self.login.encode()
+                self.link.send_ppp(PPP_CHAP, build_ppp_packet(CHAP_RESPONSE, ident, response))
+            elif code == CHAP_SUCCESS:
+                message = body.decode(errors='replace')
+                if expected_success and not message.upper().startswith(expected_success.upper()):
+                    raise _StageFailure("auth", "server authenticator response mismatch")
+                return
+            elif code == CHAP_FAILURE:
+                raise _StageFailure("auth", self._describe_chap_failure(body.decode(errors='replace')))
+
+    @staticmethod
+    def _describe_chap_failure(message: str) -> str:
+        for part in message.split():
+            if part.startswith("E="):
+                try:
+                    code = int(part[2:])
+                except ValueError:
+                    break
+                return f"credentials rejected (E={code} {MSCHAP_ERRORS.get(code, 'error')})"
+        return f"credentials rejected ({message.strip() or 'CHAP failure'})"
+
+    async def _authenticate_pap(self, deadline: float):
+        login, password = self.login.encode(), self.password.encode()
+        request = bytes([len(login)]) + login + bytes([len(password)]) + password
+        ident = 0
+        next_send = 0.0
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                raise _StageFailure("auth", "no PAP response from server")
+            if now >= next_send:
+                ident = (ident + 1) & 0xFF
+                self.link.send_ppp(PPP_PAP, build_ppp_packet(PAP_AUTH_REQ, ident, request))
+                next_send = now + LCP_RESTART_INTERVAL
+            frame = await self.link.recv_ppp(max(0.01, min(deadline, next_send) - time.monotonic()))
+            if frame is None:
+                continue
+            packet = parse_ppp_packet(frame[1])
+            if packet is None:
+                continue
+            code, reply_ident, body = packet
+            if frame[0] == PPP_LCP:
+                self._handle_lcp_common(code, reply_ident, body)
+            elif frame[0] == PPP_PAP and reply_ident == ident:
+                if code == PAP_AUTH_ACK:
+                    return
+                if code == PAP_AUTH_NAK:
+                    raise _StageFailure("auth", "credentials rejected (PAP)")
+
+    # ---- teardown ----
+
+    async def _teardown(self):
+        if self.link is not None:
+            if self.link.peer_call_id:
+                self._lcp_id = (self._lcp_id + 1) & 0xFF
+                self._send_lcp(LCP_TERM_REQ, self._lcp_id)
+                try:
+                    self.control.writer.write(build_call_clear_request(self.link.call_id))
+                except Exception:
+                    pass
+            self.link.close()
+        await self.control.close()
+
+
+async def verify_pptp_credentials(ip: str, login: str, password: str, timeout: float = 10.0,
+                                  port: int = PPTP_PORT) -> Dict:
+    """
+    Real PPTP credential check in userspace.
+    Returns: {"success", "avg_time", "packet_loss", "message", "auth_tested", "auth_method",
+              "stage", "connect_ms", "auth_time_ms"}; stage tells where a failure happened
+    (connect, control, gre, call, lcp, auth) - only "auth" means the credentials are wrong.
+    """
+    return await PPTPCredentialCheck(ip, login, password, port).run(timeout)
+
+
+async def verify_pptp_credentials_or_probe(ip: str, login: str, password: str, timeout: float = 10.0,
+                                           port: int = PPTP_PORT) -> Dict:
+    """
+    verify_pptp_credentials; if no GRE socket can be opened (stage "gre": no CAP_NET_RAW and no
+    PPTP_GRE_UDP_PORT) falls back to a control channel probe (pptp_probe) for latency / jitter.
+    The fallback still reports success False - credentials are not confirmed without GRE.
+    """
+    result = await verify_pptp_credentials(ip, login, password, timeout=timeout, port=port)
+    if result["stage"] != "gre":
+        return result
+
+    probe = await pptp_control_probe(ip, port, timeout=min(timeout, 5.0), echo_count=3)
+    return {
+        **result,
+        "latency_ms": probe["latency_ms"],
+        "jitter_ms": probe["jitter_ms"],
+        "handshake_ok": probe["handshake_ok"],
+        "message": (f"PPTP control channel OK ({probe['latency_ms']:.1f}ms, jitter {probe['jitter_ms']:.1f}ms) "
+                    f"- credentials {login}:*** not verified: {result['message']}")
+                   if probe["handshake_ok"] else probe["message"],
+    }
+
@@ -0,0 +1,246 @@
+"""
+Single-connection PPTP control probe
+One TCP connection to port 1723 yields reachability (connect RTT), the
+Start-Control-Connection handshake result and Echo-Request/Reply latency samples.
+Message layouts follow RFC 2637.
+"""
+import asyncio
+import socket
+import struct
+import time
+from typing import Dict, List, Optional, Tuple
+
+PPTP_PORT = 1723
+PPTP_MAGIC = 0x1a2b3c4d
+PPTP_CONTROL_MESSAGE = 1
+PPTP_PROTOCOL_VERSION = 0x0100
+
+# Control message types
+START_CONTROL_REQUEST = 1
+START_CONTROL_REPLY = 2
+STOP_CONTROL_REQUEST = 3
+STOP_CONTROL_REPLY = 4
+ECHO_REQUEST = 5
+ECHO_REPLY = 6
+OUTGOING_CALL_REQUEST = 7
+OUTGOING_CALL_REPLY = 8
+CALL_CLEAR_REQUEST = 12
+CALL_DISCONNECT_NOTIFY = 13
+SET_LINK_INFO = 15
+
+_HEADER = struct.Struct('>HHLHH')  # length, PPTP message type, magic, control type, reserved
+
+
+class PPTPProtocolError(Exception):
+    """Peer answered on 1723 but not with a well-formed PPTP control message"""
+
+
+def _pad(value: str, size: int = 64) -> bytes:
+    return value.encode()[:size].ljust(size, b'\x00')
+
+
+def build_control_message(control_type: int, body: bytes) -> bytes:
+    return _HEADER.pack(_HEADER.size + len(body), PPTP_CONTROL_MESSAGE, PPTP_MAGIC, control_type, 0) + body
+
+
+def build_start_control_request(hostname: str = "PPTP_CLIENT", vendor: str = "PPTP_VENDOR") -> bytes:
+    body = struct.pack('>HHLLHH', PPTP_PROTOCOL_VERSION, 0, 1, 1, 1, 1) + _pad(hostname) + _pad(vendor)
+    return build_control_message(START_CONTROL_REQUEST, body)
+
+
+def build_echo_request(identifier: int) -> bytes:
+    return build_control_message(ECHO_REQUEST, struct.pack('>L', identifier))
+
+
+def build_echo_reply(identifier: int, result_code: int = 1) -> bytes:
+    return build_control_message(ECHO_REPLY, struct.pack('>LBBH', identifier, result_code, 0, 0))
+
+
+def build_stop_control_request(reason: int = 1) -> bytes:
+    return build_control_message(STOP_CONTROL_REQUEST, struct.pack('>BBH', reason, 0, 0))
+
+
+async def read_control_message(reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+    """Read one length-prefixed control message; returns (control type, body after the header)"""
+    length_bytes = await reader.readexactly(2)
+    length = struct.unpack('>H', length_bytes)[0]
+    if length < _HEADER.size or length > 4096:
+        raise PPTPProtocolError(f"Invalid PPTP message length {length}")
+    data = length_bytes + await reader.readexactly(length - 2)
+    _, msg_type, magic, control_type, _ = _HEADER.unpack_from(data)
+    if magic != PPTP_MAGIC:
+        raise PPTPProtocolError("Invalid PPTP magic cookie")
+    if msg_type != PPTP_CONTROL_MESSAGE:
+        raise PPTPProtocolError(f"Unexpected PPTP message type {msg_type}")
+    return control_type, data[_HEADER.size:]
+
+
+def parse_start_control_reply(body: bytes) -> Dict:
+    if len(body) < 4:
+        raise PPTPProtocolError("Start-Reply too short")
+    version, result_code, error_code = struct.unpack_from('>HBB', body)
+    hostname = body[16:80].split(b'\x00', 1)[0].decode(errors='replace') if len(body) >= 80 else ""
+    vendor = body[80:144].split(b'\x00', 1)[0].decode(errors='replace') if len(body) >= 144 else ""
+    return {
+        "version": version,
+        "result_code": result_code,
+        "error_code": error_code,
+        "hostname": hostname,
+        "vendor": vendor,
+    }
+
+
+class PPTPControlConnection:
+    """One PPTP control connection: connect, handshake, echo round-trips on the same socket"""
+
+    def __init__(self, ip: str, port: int = PPTP_PORT):
+        self.ip = ip
+        self.port = port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.connect_ms: Optional[float] = None
+        self.handshake_ms: Optional[float] = None
+        self.start_reply: Optional[Dict] = None
+        self._echo_id = 0
+
+    async def connect(self, timeout: float):
+        start = time.monotonic()
+        self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.ip, self.port), timeout=timeout)
+        self.connect_ms = (time.monotonic() - start) * 1000.0
+        try:
+            self.writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except Exception:
+            pass
+
+    async def start_control(self, timeout: float) -> Dict:
+        """Send Start-Control-Connection-Request and wait for the Reply"""
+        start = time.monotonic()
+        self.writer.write(build_start_control_request())
+        await self.writer.drain()
+        control_type, body = await asyncio.wait_for(self._read_skipping_echo(), timeout=timeout)
+        if control_type != START_CONTROL_REPLY:
+            raise PPTPProtocolError(f"Expected Start-Reply, got control type {control_type}")
+        self.handshake_ms = (time.monotonic() - start) * 1000.0
+        self.start_reply = parse_start_control_reply(body)
+        return self.start_reply
+
+    async def echo(self, timeout: float) -> float:
+        """One Echo-Request/Reply round-trip; returns RTT in ms"""
+        self._echo_id += 1
+        identifier = self._echo_id
+        start = time.monotonic()
+        self.writer.write(build_echo_request(identifier))
+        await self.writer.drain()
+
+        async def wait_reply():
+            while True:
+                control_type, body = await self._read_skipping_echo()
+                if control_type == ECHO_REPLY and len(body) >= 4 and struct.unpack_from('>L', body)[0] == identifier:
+                    return
+
+        await asyncio.wait_for(wait_reply(), timeout=timeout)
+        return (time.monotonic() - start) * 1000.0
+
+    async def _read_skipping_echo(self) -> Tuple[int, bytes]:
+        """Read the next control message, answering any peer Echo-Request on the way"""
+        while True:
+            control_type, body = await read_control_message(self.reader)
+            if control_type == ECHO_REQUEST and len(body) >= 4:
+                self.writer.write(build_echo_reply(struct.unpack_from('>L', body)[0]))
+                continue
+            return control_type, body
+
+    async def close(self, polite: bool = True):
+        if not self.writer:
+            return
+        try:
+            if polite and self.start_reply is not None:
+                self.writer.write(build_stop_control_request())
+                await asyncio.wait_for(self.writer.drain(), timeout=1.0)
+        except Exception:
+            pass
+        self.writer.close()
+        try:
+            await asyncio.wait_for(self.writer.wait_closed(), timeout=1.0)
+        except Exception:
+            pass
+
+
+def summarize_rtts(samples: List[float]) -> Tuple[float, float]:
+    """(average, jitter) in ms; jitter is the mean absolute difference of consecutive samples"""
+    if not samples:
+        return 0.0, 0.0
+    avg = sum(samples) / len(samples)
+    if len(samples) < 2:
+        return avg, 0.0
+    jitter = sum(abs(b - a) for a, b in zip(samples, samples[1:])) / (len(samples) - 1)
+    return avg, jitter
+
+
+async def pptp_control_probe(ip: str, port: int = PPTP_PORT, timeout: float = 5.0, echo_count: int = 3,
+                             keep_open: bool = False) -> Dict:
+    """
+    Connect once, run the PPTP Start-Control handshake and time echo_count
+    Echo-Request/Reply round-trips on the same socket.
+    Returns: {"reachable", "handshake_ok", "result_code", "connect_ms", "handshake_ms",
+              "latency_ms", "jitter_ms", "echo_rtts", "message"}; with keep_open=True the
+    live PPTPControlConnection is returned under "connection" for callers that reuse it.
+    """
+    conn = PPTPControlConnection(ip, port)
+    result = {
+        "reachable": False,
+        "handshake_ok": False,
+        "result_code": None,
+        "connect_ms": None,
+        "handshake_ms": None,
+        "latency_ms": 0.0,
+        "jitter_ms": 0.0,
+        "echo_rtts": [],
+        "message": "",
+    }
+    try:
+        try:
+            await conn.connect(timeout)
+        except asyncio.TimeoutError:
+            result["message"] = f"Connection timeout - PPTP port {port} unreachable on {ip}"
+            return result
+        except OSError as e:
+            result["message"] = f"PPTP connection error: {type(e).__name__}: {e}"
+            return result
+        result["reachable"] = True
+        result["connect_ms"] = round(conn.connect_ms, 1)
+
+        try:
+            reply = await conn.start_control(timeout)
+        except asyncio.TimeoutError:
+            result["message"] = "PPTP handshake timeout - server not responding to protocol"
+            return result
+        except (PPTPProtocolError, asyncio.IncompleteReadError, OSError) as e:
+            result["message"] = f"PPTP protocol error: {e}"
+            return result
+        result["result_code"] = reply["result_code"]
+        result["handshake_ms"] = round(conn.handshake_ms, 1)
+        result["handshake_ok"] = reply["result_code"] == 1
+        if not result["handshake_ok"]:
+            result["message"] = f"PPTP control connection rejected (result={reply['result_code']})"
+            return result
+
+        # Handshake itself is the first latency sample; echoes add more on the same socket
+        rtts = [conn.handshake_ms]
+        for _ in range(max(0, echo_count)):
+            try:
+                rtts.append(await conn.echo(timeout))
+            except (asyncio.TimeoutError, PPTPProtocolError, asyncio.IncompleteReadError, OSError):
+                break  # Many servers do not answer echoes; keep the samples we have
+        avg, jitter = summarize_rtts(rtts)
+        result["echo_rtts"] = [round(r, 1) for r in rtts[1:]]
+        result["latency_ms"] = round(avg, 1)
+        result["jitter_ms"] = round(jitter, 1)
+        result["message"] = (f"PPTP control OK - connect {conn.connect_ms:.1f}ms, "
+                             f"latency {avg:.1f}ms, jitter {jitter:.1f}ms ({len(rtts)} samples)")
+        return result
+    finally:
+        if keep_open and result["handshake_ok"]:
+            result["connection"] = conn
+        else:
+            await conn.close()
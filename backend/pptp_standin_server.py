@@ -0,0 +1,198 @@
+"""
+Local stand-in PPTP server for exercising pptp_client
+Control connection, Outgoing-Call, GRE, LCP and one authentication method (MS-CHAPv2,
+CHAP-MD5 or PAP) - just enough of a PPTP server for credential verdicts against 127.0.0.1.
+Needs GRE-in-UDP (PPTP_GRE_UDP_PORT or a dispatcher with udp_port set): the server and the
+client share the GRE dispatcher, packets are routed by call id.
+"""
+import asyncio
+import hashlib
+import os
+import random
+import struct
+import time
+from typing import Optional
+
+from mschapv2 import generate_authenticator_response, generate_nt_response
+from pptp_client import (
+    AUTH_CHAP_MD5, AUTH_MSCHAPV2, AUTH_PAP, CHAP_CHALLENGE, CHAP_FAILURE, CHAP_MD5, CHAP_MSCHAPV2,
+    CHAP_RESPONSE, CHAP_SUCCESS, LCP_CONF_ACK, LCP_CONF_REQ, LCP_OPT_AUTH, LCP_OPT_MAGIC, LCP_RESTART_INTERVAL,
+    LCP_TERM_ACK, LCP_TERM_REQ, OUTGOING_CALL_CONNECTED, PAP_AUTH_ACK, PAP_AUTH_NAK, PAP_AUTH_REQ, PPP_CHAP,
+    PPP_LCP, PPP_PAP, GREDispatcher, GRELink, build_options, build_ppp_packet, gre_dispatcher, parse_ppp_packet,
+    verify_pptp_credentials,
+)
+from pptp_probe import (
+    ECHO_REQUEST, OUTGOING_CALL_REPLY, OUTGOING_CALL_REQUEST, START_CONTROL_REPLY, START_CONTROL_REQUEST,
+    STOP_CONTROL_REPLY, STOP_CONTROL_REQUEST, PPTPProtocolError, build_control_message, build_echo_reply,
+    read_control_message,
+)
+
+# LCP Authentication-Protocol option the server asks for, per method
+_AUTH_OPTIONS = {
+    AUTH_MSCHAPV2: struct.pack('>HB', PPP_CHAP, CHAP_MSCHAPV2),
+    AUTH_CHAP_MD5: struct.pack('>HB', PPP_CHAP, CHAP_MD5),
+    AUTH_PAP: struct.pack('>H', PPP_PAP),
+}
+
+
+class StandInPPTPServer:
+    """Minimal PPTP server (control + GRE + LCP + MS-CHAPv2 / CHAP-MD5 / PAP) for exercising the client locally"""
+
+    def __init__(self, login: str, password: str, host: str = "127.0.0.1", port: int = 0,
+                 auth_method: str = AUTH_MSCHAPV2, dispatcher: Optional[GREDispatcher] = None):
+        if auth_method not in _AUTH_OPTIONS:
+            raise ValueError(f"Unsupported auth method: {auth_method}")
+        self.login = login
+        self.password = password
+        self.host = host
+        self.port = port
+        self.auth_method = auth_method
+        self.dispatcher = dispatcher or gre_dispatcher
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._tasks = set()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_control, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+        for task in list(self._tasks):
+            task.cancel()
+
+    async def _handle_control(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer_ip = writer.get_extra_info('peername')[0]
+        link = None
+        try:
+            while True:
+                control_type, body = await read_control_message(reader)
+                if control_type == START_CONTROL_REQUEST:
+                    writer.write(build_control_message(
+                        START_CONTROL_REPLY, struct.pack('>HBBLLHH', 0x0100, 1, 0, 1, 1, 1, 1) + b'\x00' * 128))
+                elif control_type == OUTGOING_CALL_REQUEST and link is None:
+                    link = GRELink(self.dispatcher, peer_ip)
+                    link.peer_call_id = struct.unpack_from('>H', body)[0]
+                    writer.write(build_control_message(OUTGOING_CALL_REPLY, struct.pack(
+                        '>HHBBHLHHL', link.call_id, link.peer_call_id, OUTGOING_CALL_CONNECTED, 0, 0,
+                        100000000, 64, 0, 0)))
+                    task = asyncio.create_task(self._serve_ppp(link))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+                elif control_type == ECHO_REQUEST:
+                    writer.write(build_echo_reply(struct.unpack_from('>L', body)[0]))
+                elif control_type == STOP_CONTROL_REQUEST:
+                    writer.write(build_control_message(STOP_CONTROL_REPLY, struct.pack('>BBH', 1, 0, 0)))
+                    await writer.drain()
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, PPTPProtocolError, ConnectionError):
+            pass
+        finally:
+            if link is not None:
+                link.close()
+            writer.close()
+
+    async def _serve_ppp(self, link: GRELink):
+        magic = random.getrandbits(32) or 1
+        our_acked = peer_acked = False
+        next_send = 0.0
+        lcp_id = 0
+        challenge = os.urandom(16)
+        challenge_sent = False
+        try:
+            while True:
+                now = time.monotonic()
+                if not our_acked and now >= next_send:
+                    lcp_id = (lcp_id + 1) & 0xFF
+                    options = [(LCP_OPT_AUTH, _AUTH_OPTIONS[self.auth_method]),
+                               (LCP_OPT_MAGIC, struct.pack('>L', magic))]
+                    link.send_ppp(PPP_LCP, build_ppp_packet(LCP_CONF_REQ, lcp_id, build_options(options)))
+                    next_send = now + LCP_RESTART_INTERVAL
+                if our_acked and peer_acked and not challenge_sent and self.auth_method != AUTH_PAP:
+                    name = b"standin"
+                    link.send_ppp(PPP_CHAP, build_ppp_packet(CHAP_CHALLENGE, 1, bytes([16]) + challenge + name))
+                    challenge_sent = True
+
+                frame = await link.recv_ppp(LCP_RESTART_INTERVAL)
+                if frame is None:
+                    continue
+                packet = parse_ppp_packet(frame[1])
+                if packet is None:
+                    continue
+                code, ident, body = packet
+                if frame[0] == PPP_LCP:
+                    if code == LCP_CONF_REQ:
+                        link.send_ppp(PPP_LCP, build_ppp_packet(LCP_CONF_ACK, ident, body))
+                        peer_acked = True
+                    elif code == LCP_CONF_ACK and ident == lcp_id:
+                        our_acked = True
+                    elif code == LCP_TERM_REQ:
+                        link.send_ppp(PPP_LCP, build_ppp_packet(LCP_TERM_ACK, ident))
+                        return
+                elif frame[0] == PPP_CHAP and code == CHAP_RESPONSE:
+                    self._answer_chap(link, ident, body, challenge)
+                elif frame[0] == PPP_PAP and code == PAP_AUTH_REQ:
+                    self._answer_pap(link, ident, body)
+        except asyncio.CancelledError:
+            pass
+
+    def _answer_chap(self, link: GRELink, ident: int, body: bytes, challenge: bytes):
+        if not body or len(body) < 1 + body[0]:
+            return
+        value, username = body[1:1 + body[0]], body[1 + body[0]:].decode(errors='replace')
+        if self.auth_method == AUTH_MSCHAPV2:
+            if len(value) != 49:
+                return
+            peer_challenge, nt_response = value[:16], value[24:48]
+            expected = generate_nt_response(challenge, peer_challenge, username, self.password)
+            if username == self.login and nt_response == expected:
+                success = generate_authenticator_response(
+                    self.password, nt_response, peer_challenge, challenge, username)
+                link.send_ppp(PPP_CHAP, build_ppp_packet(CHAP_SUCCESS, ident, f"{success} M=Welcome".encode()))
+                return
+            message = f"E=691 R=0 C={challenge.hex().upper()} V=3 M=Authentication failed"
+        else:
+            expected = hashlib.md5(bytes([ident]) + self.password.encode() + challenge).digest()
+            if username == self.login and value == expected:
+                link.send_ppp(PPP_CHAP, build_ppp_packet(CHAP_SUCCESS, ident, b"Welcome"))
+                return
+            message = "Authentication failed"
+        link.send_ppp(PPP_CHAP, build_ppp_packet(CHAP_FAILURE, ident, message.encode()))
+
+    def _answer_pap(self, link: GRELink, ident: int, body: bytes):
+        if not body or len(body) < 2 + body[0]:
+            return
+        login_end = 1 + body[0]
+        login, password = body[1:login_end], body[login_end + 1:login_end + 1 + body[login_end]]
+        verdict = PAP_AUTH_ACK if (login.decode(errors='replace') == self.login
+                                   and password.decode(errors='replace') == self.password) else PAP_AUTH_NAK
+        link.send_ppp(PPP_PAP, build_ppp_packet(verdict, ident, b'\x00'))
+
+
+async def demo_userspace_pptp(concurrency: int = 200):
+    """Run the client against a local stand-in server: good, bad and many concurrent checks"""
+    server = StandInPPTPServer("vpnuser", "s3cret")
+    await server.start()
+    print(f"=== USERSPACE PPTP CLIENT vs STAND-IN SERVER 127.0.0.1:{server.port} ===")
+    try:
+        for login, password in (("vpnuser", "s3cret"), ("vpnuser", "wrong")):
+            result = await verify_pptp_credentials("127.0.0.1", login, password, timeout=5.0, port=server.port)
+            print(f"{login}:{password} -> {'✅' if result['success'] else '❌'} [{result['stage']}] {result['message']}")
+
+        start = time.monotonic()
+        results = await asyncio.gather(*[
+            verify_pptp_credentials("127.0.0.1", "vpnuser", "s3cret" if i % 2 == 0 else "bad", timeout=10.0,
+                                    port=server.port)
+            for i in range(concurrency)
+        ])
+        elapsed = time.monotonic() - start
+        correct = sum(1 for i, r in enumerate(results) if r["success"] == (i % 2 == 0))
+        print(f"{concurrency} concurrent checks in {elapsed:.2f}s - {correct}/{concurrency} correct verdicts")
+        print(f"GRE stats: {gre_dispatcher.stats}")
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(demo_userspace_pptp())
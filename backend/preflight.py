@@ -0,0 +1,139 @@
+"""
+Preflight estimate for large sweeps
+Probes a stratified random sample (strata = provider x country) of the selected nodes and
+returns the estimated alive rate with a 95% confidence interval and the projected sweep
+duration at the current concurrency (Little's law: endpoints * mean probe time / in-flight).
+Sampled nodes are probed on the same ports as the sweep being estimated.
+"""
+import math
+import os
+import random
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from pptp_probe import PPTP_PORT
+from resource_governor import is_local_error
+from sharded_executor import probe_engine
+from tcp_scanner import ScanTarget
+
+PREFLIGHT_SAMPLE_SIZE = int(os.environ.get('PREFLIGHT_SAMPLE_SIZE', 400))
+_Z95 = 1.96
+_TOP_STRATA = 20
+
+
+def _stratum(row) -> Tuple[str, str]:
+    return (row.provider or "").strip() or "unknown", (row.country or "").strip() or "unknown"
+
+
+def stratified_sample(rows: Sequence, sample_size: int,
+                      rng: random.Random = random) -> Tuple[Dict[tuple, List], Dict[tuple, List]]:
+    """Proportional allocation with at least one draw per stratum while the budget allows.
+    Returns (population rows by stratum, sampled rows by stratum)."""
+    strata: Dict[tuple, List] = {}
+    for row in rows:
+        strata.setdefault(_stratum(row), []).append(row)
+    total = len(rows)
+    sample_size = min(sample_size, total)
+
+    # Largest strata first, so the one-per-stratum floor goes to the strata that matter most
+    order = sorted(strata, key=lambda key: len(strata[key]), reverse=True)
+    allocation = {key: 0 for key in order}
+    for key in order[:sample_size]:
+        allocation[key] = 1
+    remaining = sample_size - sum(allocation.values())
+    if remaining > 0:
+        shares = {key: len(strata[key]) * remaining / total for key in order}
+        for key in order:
+            extra = min(len(strata[key]) - allocation[key], max(0, int(shares[key])))
+            allocation[key] += extra
+            remaining -= extra
+        # Rounding leftovers go to the strata with the largest fractional share still open
+        for key in sorted(order, key=lambda k: shares[k] - int(shares[k]), reverse=True):
+            if remaining <= 0:
+                break
+            if allocation[key] < len(strata[key]):
+                allocation[key] += 1
+                remaining -= 1
+
+    sampled = {key: rng.sample(strata[key], allocation[key]) for key in order if allocation[key]}
+    return strata, sampled
+
+
+def stratified_estimate(population: Dict[tuple, int], sampled: Dict[tuple, int],
+                        alive: Dict[tuple, int]) -> Tuple[float, float, float]:
+    """Stratified alive-rate estimate with a 95% interval (finite population correction).
+    Strata without draws are assumed to follow the sampled rate."""
+    total = sum(population.values())
+    covered = sum(population[key] for key in sampled)
+    if not total or not covered:
+        return 0.0, 0.0, 1.0
+    rate = variance = 0.0
+    for key, n in sampled.items():
+        weight = population[key] / covered
+        p = alive[key] / n
+        # Smoothed p for the variance so all-dead / all-alive strata still carry uncertainty
+        p_var = (alive[key] + 1) / (n + 2)
+        fpc = 1 - n / population[key] if population[key] > 1 else 0.0
+        rate += weight * p
+        variance += weight ** 2 * p_var * (1 - p_var) / n * fpc
+    half = _Z95 * math.sqrt(variance)
+    return rate, max(0.0, rate - half), min(1.0, rate + half)
+
+
+async def run_preflight(rows: Sequence, *, timeout: float, concurrency: int,
+                        sample_size: int = PREFLIGHT_SAMPLE_SIZE,
+                        ports_for: Callable = lambda row: [PPTP_PORT], rng: random.Random = random) -> Dict:
+    """rows: (id, ip, provider, country, ...) of the nodes a full sweep would test.
+    ports_for(row) gives the ports the sweep would race for that node: a node is alive if any
+    answers. Nodes whose every failed probe was a local resource error (fd / ephemeral port
+    exhaustion) are left out of the estimate, as the sweep leaves them untested."""
+    strata, sampled = stratified_sample(rows, sample_size, rng)
+    targets = [ScanTarget((key, row.id), row.ip, port, timeout)
+               for key, members in sampled.items() for row in members for port in ports_for(row)]
+
+    outcomes: Dict[tuple, List] = {}
+    started = time.monotonic()
+    async for result in probe_engine().scan(targets, max_in_flight=max(1, concurrency)):
+        outcomes.setdefault(result.key, []).append(result)
+    sample_duration = time.monotonic() - started
+
+    alive = {key: 0 for key in sampled}
+    sampled_counts = {key: 0 for key in sampled}
+    local_errors = 0
+    probe_ms: List[float] = []
+    for (key, _), results in outcomes.items():
+        answered = [result.rtt_ms for result in results if result.success]
+        if not answered and all(is_local_error(result.error) for result in results):
+            local_errors += 1
+            continue
+        sampled_counts[key] += 1
+        alive[key] += bool(answered)
+        # The sweep's port race ends at the first answer, or when the slowest port gives up
+        probe_ms.append(min(answered) if answered else max(result.rtt_ms for result in results))
+    sampled_counts = {key: n for key, n in sampled_counts.items() if n}
+
+    population = {key: len(members) for key, members in strata.items()}
+    rate, low, high = stratified_estimate(population, sampled_counts, alive)
+    total = len(rows)
+    endpoints = len({row.ip for row in rows})
+    mean_probe_ms = sum(probe_ms) / len(probe_ms) if probe_ms else timeout * 1000.0
+
+    top = sorted(strata, key=lambda key: population[key], reverse=True)[:_TOP_STRATA]
+    return {
+        "population": total,
+        "unique_endpoints": endpoints,
+        "sample_size": sum(sampled_counts.values()),
+        "sample_local_errors": local_errors,
+        "strata": len(strata),
+        "strata_sampled": len(sampled_counts),
+        "alive_rate": round(rate, 4),
+        "alive_rate_ci95": [round(low, 4), round(high, 4)],
+        "estimated_alive": round(rate * total),
+        "estimated_alive_ci95": [round(low * total), round(high * total)],
+        "mean_probe_ms": round(mean_probe_ms, 1),
+        "concurrency": concurrency,
+        "projected_duration_s": round(endpoints * mean_probe_ms / 1000.0 / max(1, concurrency), 1),
+        "sample_duration_s": round(sample_duration, 2),
+        "by_stratum": [{"provider": key[0], "country": key[1], "population": population[key],
+                        "sampled": sampled_counts.get(key, 0), "alive": alive.get(key, 0)} for key in top],
+    }
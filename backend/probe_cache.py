@@ -0,0 +1,138 @@
+"""
+Endpoint probe-result cache
+Results are keyed by (ip, port, probe_kind) with separate TTLs for successes and failures
+(negative caching) and bounded LRU eviction. Concurrent identical probes share one
+in-flight attempt. Shared by every probe entry point in ping_speed_test.py.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+PROBE_KIND_TCP = "tcp"
+PROBE_KIND_PPTP_AUTH = "pptp_auth"
+PROBE_KIND_SPEED = "speed"
+
+PROBE_CACHE_MAX_ENTRIES = int(os.environ.get('PROBE_CACHE_MAX_ENTRIES', 50000))
+
+# probe_kind -> (TTL for successes, TTL for failures) in seconds; 0 disables that side
+PROBE_CACHE_TTLS = {
+    PROBE_KIND_TCP: (float(os.environ.get('PROBE_CACHE_TTL_TCP', 30)),
+                     float(os.environ.get('PROBE_CACHE_NEG_TTL_TCP', 10))),
+    PROBE_KIND_PPTP_AUTH: (float(os.environ.get('PROBE_CACHE_TTL_PPTP_AUTH', 120)),
+                           float(os.environ.get('PROBE_CACHE_NEG_TTL_PPTP_AUTH', 30))),
+    PROBE_KIND_SPEED: (float(os.environ.get('PROBE_CACHE_TTL_SPEED', 300)),
+                       float(os.environ.get('PROBE_CACHE_NEG_TTL_SPEED', 30))),
+}
+
+_CacheKey = Tuple[str, int, str]
+
+
+class ProbeCache:
+    """LRU of recent probe results with positive/negative TTLs"""
+
+    def __init__(self, max_entries: int = PROBE_CACHE_MAX_ENTRIES, ttls: Optional[Dict] = None):
+        self.max_entries = max_entries
+        self.ttls = dict(PROBE_CACHE_TTLS if ttls is None else ttls)
+        self._entries: "OrderedDict[_CacheKey, Tuple[float, Dict]]" = OrderedDict()
+        self._inflight: Dict[_CacheKey, asyncio.Future] = {}
+        self.stats = {
+            'hits': 0,
+            'negative_hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'evictions': 0,
+        }
+
+    @staticmethod
+    def _key(ip: str, port: int, kind: str, variant: Optional[str]) -> _CacheKey:
+        # variant separates results that depend on more than the endpoint (e.g. credentials)
+        return ip, int(port), kind if variant is None else f"{kind}:{variant}"
+
+    def _ttl(self, kind: str, success: bool) -> float:
+        positive, negative = self.ttls.get(kind, (0.0, 0.0))
+        return positive if success else negative
+
+    def get(self, ip: str, port: int, kind: str, variant: Optional[str] = None) -> Optional[Dict]:
+        key = self._key(ip, port, kind, variant)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats['misses'] += 1
+            return None
+        expires, result = entry
+        now = time.monotonic()
+        if now >= expires:
+            del self._entries[key]
+            self.stats['misses'] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats['hits' if result.get('success') else 'negative_hits'] += 1
+        ttl = self._ttl(kind, bool(result.get('success')))
+        return {**result, "cached": True, "cache_age_s": round(ttl - (expires - now), 1)}
+
+    def put(self, ip: str, port: int, kind: str, result: Dict, variant: Optional[str] = None):
+        if not result or result.get('cached') or result.get('local_error'):
+            return  # Local resource errors say nothing about the endpoint
+        ttl = self._ttl(kind, bool(result.get('success')))
+        key = self._key(ip, port, kind, variant)
+        if ttl <= 0:
+            self._entries.pop(key, None)
+            return
+        self._entries[key] = (time.monotonic() + ttl, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def invalidate(self, ip: str, port: Optional[int] = None):
+        """Forget every cached result for an endpoint (or all ports of an ip)"""
+        for key in [k for k in self._entries if k[0] == ip and (port is None or k[1] == port)]:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+    async def probe(self, ip: str, port: int, kind: str, run: Callable[[], Awaitable[Dict]],
+                    variant: Optional[str] = None, use_cache: bool = True) -> Dict:
+        """Cached result if fresh, else join an identical in-flight probe, else run one and store it"""
+        if not use_cache:
+            result = await run()
+            self.put(ip, port, kind, result, variant)
+            return result
+
+        cached = self.get(ip, port, kind, variant)
+        if cached is not None:
+            return cached
+
+        key = self._key(ip, port, kind, variant)
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.stats['coalesced'] += 1
+            shared = await asyncio.shield(inflight)
+            if shared is not None:
+                return {**shared, "cached": True}
+            return await run()  # the shared attempt died - probe on our own
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        result = None
+        try:
+            result = await run()
+        finally:
+            self._inflight.pop(key, None)
+            future.set_result(result)
+        self.put(ip, port, kind, result, variant)
+        return result
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'inflight': len(self._inflight),
+        }
+
+
+# Global probe cache instance
+probe_cache = ProbeCache()
@@ -0,0 +1,113 @@
+"""
+Subnet-aware probe scheduling
+Work is reordered round-robin across network prefixes (/24 for IPv4, /48 for IPv6) so an
+import of contiguous ranges does not land a burst of SYNs on one provider, and a per-prefix
+in-flight cap is enforced ahead of the global AIMD limiters.
+"""
+import asyncio
+import ipaddress
+import os
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable, Deque, Dict, Iterable, List, Optional, TypeVar
+
+PROBE_PREFIX_V4 = int(os.environ.get('PROBE_PREFIX_V4', 24))
+PROBE_PREFIX_V6 = int(os.environ.get('PROBE_PREFIX_V6', 48))
+# Max probes in flight into one prefix across all sessions
+PROBE_PREFIX_IN_FLIGHT = int(os.environ.get('PROBE_PREFIX_IN_FLIGHT', 32))
+
+T = TypeVar('T')
+
+
+def prefix_of(ip: Optional[str]) -> str:
+    """Scheduling bucket of an address; unparsable values (hostnames) are their own bucket"""
+    if not ip:
+        return ""
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return ip
+    bits = PROBE_PREFIX_V4 if address.version == 4 else PROBE_PREFIX_V6
+    return str(ipaddress.ip_network(f"{address}/{bits}", strict=False))
+
+
+def interleave_by_prefix(items: Iterable[T], ip_of: Callable[[T], Optional[str]]) -> List[T]:
+    """Round-robin items across prefixes; order inside a prefix is preserved"""
+    buckets: Dict[str, Deque[T]] = {}
+    for item in items:
+        buckets.setdefault(prefix_of(ip_of(item)), deque()).append(item)
+    queues = list(buckets.values())
+    ordered: List[T] = []
+    while queues:
+        remaining = []
+        for queue in queues:
+            ordered.append(queue.popleft())
+            if queue:
+                remaining.append(queue)
+        queues = remaining
+    return ordered
+
+
+class PrefixLimiter:
+    """Per-prefix in-flight cap shared by all asyncio probe paths"""
+
+    def __init__(self, per_prefix: int = PROBE_PREFIX_IN_FLIGHT):
+        self.per_prefix = per_prefix
+        self._in_flight: Dict[str, int] = {}
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {}
+
+    @asynccontextmanager
+    async def slot(self, ip: Optional[str]):
+        prefix = prefix_of(ip)
+        await self._acquire(prefix)
+        try:
+            yield
+        finally:
+            self._release(prefix)
+
+    async def _acquire(self, prefix: str):
+        if self._in_flight.get(prefix, 0) < self.per_prefix and not self._waiters.get(prefix):
+            self._in_flight[prefix] = self._in_flight.get(prefix, 0) + 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(prefix, deque()).append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release(prefix)  # slot was handed over just before cancellation
+            else:
+                queue = self._waiters.get(prefix)
+                if queue and waiter in queue:
+                    queue.remove(waiter)
+                    if not queue:
+                        del self._waiters[prefix]
+            raise
+
+    def _release(self, prefix: str):
+        queue = self._waiters.get(prefix)
+        while queue:
+            waiter = queue.popleft()
+            if not waiter.done():
+                waiter.set_result(True)  # slot passes straight to the waiter
+                if not queue:
+                    del self._waiters[prefix]
+                return
+        self._waiters.pop(prefix, None)
+        remaining = self._in_flight.get(prefix, 1) - 1
+        if remaining > 0:
+            self._in_flight[prefix] = remaining
+        else:
+            self._in_flight.pop(prefix, None)
+
+    def snapshot(self) -> Dict:
+        return {
+            "per_prefix": self.per_prefix,
+            "active_prefixes": len(self._in_flight),
+            "waiting": sum(len(q) for q in self._waiters.values()),
+            "max_in_flight": max(self._in_flight.values(), default=0),
+        }
+
+
+# Global per-prefix limiter instance
+prefix_limiter = PrefixLimiter()
@@ -0,0 +1,191 @@
+"""
+Bounded in-memory progress store
+Progress of test sessions (ProgressTracker) and chunked imports (plain dicts) lives in
+ProgressStore dicts that evict finished sessions PROGRESS_SESSION_TTL seconds after their
+last update, and sessions that stopped updating without finishing after
+PROGRESS_STALE_TTL. Trackers are __slots__ objects: per-item results are compact
+ProgressResult records in a ring buffer of the last PROGRESS_RESULTS_KEEP results, while
+counters (processed, alive, per-status) cover the whole session. Result indexes are global
+per session, so SSE cursors stay valid after old results drop out of the ring.
+"""
+import os
+import sys
+import time
+from collections import deque
+from itertools import islice
+from typing import Dict, List, Optional, Tuple
+
+PROGRESS_RESULTS_KEEP = int(os.environ.get('PROGRESS_RESULTS_KEEP', 5000))
+PROGRESS_SESSION_TTL = int(os.environ.get('PROGRESS_SESSION_TTL', 3600))
+PROGRESS_STALE_TTL = int(os.environ.get('PROGRESS_STALE_TTL', 6 * 3600))
+# Eviction runs on writes, at most this often
+_SWEEP_INTERVAL = 60.0
+
+FINISHED_STATUSES = frozenset(("completed", "failed", "cancelled"))
+# Live limiter gauges in summary()["concurrency"]: they move between any two polls
+VOLATILE_CONCURRENCY_FIELDS = frozenset(("in_flight", "loop_lag_ms"))
+
+
+def _intern(value):
+    # Statuses repeat across thousands of results: share one string object per value
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class ProgressResult:
+    """One per-item result: the fields batch tests report, anything else in `extra`"""
+    __slots__ = ("node_id", "ip", "status", "success", "original_status", "probe_pass", "local_error", "extra")
+
+    _FIELDS = frozenset(("node_id", "ip", "status", "success", "original_status", "pass", "local_error"))
+
+    def __init__(self, data: dict):
+        self.node_id = data.get("node_id")
+        self.ip = data.get("ip")
+        self.status = _intern(data.get("status"))
+        self.success = data.get("success")
+        self.original_status = _intern(data.get("original_status"))
+        self.probe_pass = data.get("pass")
+        self.local_error = bool(data.get("local_error"))
+        extra = {key: value for key, value in data.items() if key not in self._FIELDS}
+        self.extra = extra or None
+
+    def to_dict(self) -> dict:
+        result = {"node_id": self.node_id, "ip": self.ip, "status": self.status, "success": self.success}
+        if self.original_status is not None:
+            result["original_status"] = self.original_status
+        if self.probe_pass is not None:
+            result["pass"] = self.probe_pass
+        if self.local_error:
+            result["local_error"] = True
+        if self.extra:
+            result.update(self.extra)
+        return result
+
+
+class ProgressStore(dict):
+    """session_id -> progress, with TTL eviction of finished and abandoned sessions"""
+
+    def __init__(self, ttl: float = PROGRESS_SESSION_TTL, stale_ttl: float = PROGRESS_STALE_TTL):
+        super().__init__()
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._touched: Dict[str, float] = {}
+        self._last_sweep = time.monotonic()
+        self.evicted = 0
+
+    def __setitem__(self, key, value):
+        now = time.monotonic()
+        super().__setitem__(key, value)
+        self._touched[key] = now
+        if now - self._last_sweep >= _SWEEP_INTERVAL:
+            self.sweep(now)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._touched.pop(key, None)
+
+    def pop(self, key, *default):
+        self._touched.pop(key, None)
+        return super().pop(key, *default)
+
+    def clear(self):
+        super().clear()
+        self._touched.clear()
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Drop finished sessions older than ttl and unfinished ones silent for stale_ttl"""
+        now = time.monotonic() if now is None else now
+        self._last_sweep = now
+        expired = []
+        for key, value in self.items():
+            status = value.get("status") if isinstance(value, dict) else getattr(value, "status", None)
+            age = now - self._touched.get(key, now)
+            if age >= (self.ttl if status in FINISHED_STATUSES else self.stale_ttl):
+                expired.append(key)
+        for key in expired:
+            del self[key]
+        self.evicted += len(expired)
+        return len(expired)
+
+
+class ProgressTracker:
+    __slots__ = ("session_id", "total_items", "processed_items", "current_task", "status", "limiter",
+                 "expected_yield", "alive_items", "local_error_items", "status_counts", "_results",
+                 "results_total")
+
+    def __init__(self, session_id: str, total_items: int, results_keep: int = PROGRESS_RESULTS_KEEP):
+        self.session_id = session_id
+        self.total_items = total_items
+        self.processed_items = 0
+        self.current_task = ""
+        self.status = "running"
+        self.limiter = None  # AIMDLimiter driving this session's probes (live limit shown in progress)
+        self.expected_yield = None  # yield_model forecast: expected alive nodes vs processed
+        self.alive_items = 0
+        self.local_error_items = 0  # probes lost to local fd / port exhaustion (node left untouched)
+        self.status_counts: Dict[str, int] = {}  # reported node status -> results
+        self._results = deque(maxlen=max(1, results_keep))  # last results_keep ProgressResult records
+        self.results_total = 0  # results ever added (global index of the next one)
+
+    def update(self, processed: int, current_task: str = "", add_result: dict = None):
+        self.processed_items = processed
+        self.current_task = current_task
+        if add_result:
+            self._results.append(ProgressResult(add_result))
+            self.results_total += 1
+            status = add_result.get("status")
+            if status is not None:
+                self.status_counts[status] = self.status_counts.get(status, 0) + 1
+            if add_result.get("success"):
+                self.alive_items += 1
+            elif add_result.get("local_error"):
+                self.local_error_items += 1
+        progress_store[self.session_id] = self
+
+    def complete(self, status: str = "completed"):
+        self.status = status
+        progress_store[self.session_id] = self
+
+    @property
+    def results(self) -> List[dict]:
+        """Retained results (the last PROGRESS_RESULTS_KEEP) as dicts"""
+        return [record.to_dict() for record in self._results]
+
+    def summary(self):
+        """Counters without the per-item results (carried by every progress event)"""
+        return {
+            "session_id": self.session_id,
+            "total_items": self.total_items,
+            "processed_items": self.processed_items,
+            "current_task": self.current_task,
+            "status": self.status,
+            "progress_percent": int((self.processed_items / self.total_items) * 100) if self.total_items > 0 else 0,
+            "concurrency": self.limiter.snapshot() if self.limiter else None,
+            "expected_yield": {**self.expected_yield, "alive_so_far": self.alive_items} if self.expected_yield else None,
+            "local_errors": self.local_error_items,
+            "status_counts": dict(self.status_counts),
+            "results_total": self.results_total,
+        }
+
+    @staticmethod
+    def change_key(summary: dict) -> dict:
+        """summary() without the live limiter gauges - what change detection compares"""
+        concurrency = summary.get("concurrency")
+        if not concurrency:
+            return summary
+        return {**summary, "concurrency": {key: value for key, value in concurrency.items()
+                                           if key not in VOLATILE_CONCURRENCY_FIELDS}}
+
+    def results_since(self, cursor: int) -> Tuple[int, List[dict]]:
+        """Results after the first `cursor` ones: (index of the first returned result, results).
+        Results that already left the ring are skipped - the returned index says where it resumes."""
+        first = self.results_total - len(self._results)
+        start = max(first, min(cursor, self.results_total))
+        return start, [record.to_dict() for record in islice(self._results, start - first, None)]
+
+    def to_dict(self):
+        return {**self.summary(), "results": self.results}
+
+
+# Global progress stores
+progress_store = ProgressStore()
+import_progress = ProgressStore()  # For chunked import progress tracking
@@ -0,0 +1,63 @@
+"""
+Dead-node quarantine
+Consecutive reachability failures are counted on the Node row (fail_streak). From
+QUARANTINE_MIN_STREAK failures on, the node gets a next_eligible_at timestamp with
+exponential backoff plus jitter, and sweeps skip it until then. A small random fraction
+of quarantined nodes is re-admitted on every sweep so recoveries are still noticed.
+"""
+import os
+import random
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Tuple
+
+QUARANTINE_MIN_STREAK = int(os.environ.get('QUARANTINE_MIN_STREAK', 3))
+QUARANTINE_BASE_SECONDS = float(os.environ.get('QUARANTINE_BASE_SECONDS', 600))         # 10 minutes
+QUARANTINE_MAX_SECONDS = float(os.environ.get('QUARANTINE_MAX_SECONDS', 7 * 24 * 3600))  # 1 week
+QUARANTINE_JITTER = float(os.environ.get('QUARANTINE_JITTER', 0.2))                      # +-20%
+QUARANTINE_READMIT_FRACTION = float(os.environ.get('QUARANTINE_READMIT_FRACTION', 0.02))
+
+
+def backoff_seconds(fail_streak: int, rng: random.Random = random) -> float:
+    """Quarantine length after fail_streak consecutive failures (0 below the threshold)"""
+    if fail_streak < QUARANTINE_MIN_STREAK:
+        return 0.0
+    exponent = min(fail_streak - QUARANTINE_MIN_STREAK, 32)
+    delay = min(QUARANTINE_MAX_SECONDS, QUARANTINE_BASE_SECONDS * (2 ** exponent))
+    # Jitter spreads re-tests of nodes that died together across sweeps
+    return delay * (1 + rng.uniform(-QUARANTINE_JITTER, QUARANTINE_JITTER))
+
+
+def record_probe_outcome(node, success: bool, now: Optional[datetime] = None):
+    """Update the node's failure streak and quarantine window in place after a reachability probe"""
+    if success:
+        node.fail_streak = 0
+        node.next_eligible_at = None
+        return
+    now = now or datetime.utcnow()
+    node.fail_streak = (node.fail_streak or 0) + 1
+    delay = backoff_seconds(node.fail_streak)
+    node.next_eligible_at = now + timedelta(seconds=delay) if delay else None
+
+
+def is_quarantined(node, now: Optional[datetime] = None) -> bool:
+    next_eligible_at = getattr(node, 'next_eligible_at', None)
+    return next_eligible_at is not None and next_eligible_at > (now or datetime.utcnow())
+
+
+def plan_sweep(rows: Iterable, include_quarantined: bool = False,
+               readmit_fraction: float = QUARANTINE_READMIT_FRACTION,
+               now: Optional[datetime] = None, rng: random.Random = random) -> Tuple[List[int], int, int]:
+    """Filter (id, next_eligible_at) rows for a sweep.
+    Returns (node ids to probe, quarantined ids skipped, quarantined ids re-admitted)."""
+    now = now or datetime.utcnow()
+    selected: List[int] = []
+    skipped = readmitted = 0
+    for row in rows:
+        if include_quarantined or not is_quarantined(row, now):
+            selected.append(row.id)
+        elif rng.random() < readmit_fraction:
+            selected.append(row.id)
+            readmitted += 1
+        else:
+            skipped += 1
+    return selected, skipped, readmitted
@@ -0,0 +1,209 @@
+"""
+Probe resource governor
+Reads the host limits that cap concurrent probes at startup - RLIMIT_NOFILE, the
+ephemeral port range and TIME_WAIT build-up - raises the soft fd limit towards the hard
+one, sizes probe concurrency to fit, and optionally rotates probe source addresses over
+several local IPs (PROBE_SOURCE_IPS) to multiply the ephemeral port space.
+Errors caused by this host running out of fds / ports / buffers are labelled "LOCAL:<errno>"
+instead of "ERR:<errno>": they say nothing about the node and must never fail it.
+"""
+import errno
+import ipaddress
+import itertools
+import logging
+import os
+import socket
+from typing import Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger("resource_governor")
+
+# fds kept free for the database, HTTP clients, logs and the API server itself
+GOVERNOR_FD_RESERVE = int(os.environ.get('GOVERNOR_FD_RESERVE', 512))
+# Share of the ephemeral port range (per source IP) probes may hold at once
+GOVERNOR_PORT_SHARE = float(os.environ.get('GOVERNOR_PORT_SHARE', 0.8))
+# Comma-separated local addresses to spread probe connects over (empty: kernel's choice)
+PROBE_SOURCE_IPS = os.environ.get('PROBE_SOURCE_IPS', '')
+
+LOCAL_ERROR_PREFIX = "LOCAL:"
+# errnos that describe this host, not the probed node
+LOCAL_ERRNOS = frozenset(e for e in (
+    errno.EMFILE, errno.ENFILE, errno.EADDRNOTAVAIL, errno.EADDRINUSE,
+    errno.ENOBUFS, errno.ENOMEM, getattr(errno, 'ENOSR', None),
+) if e is not None)
+
+# Linux: bind() the source address without reserving a port; connect() picks it per 4-tuple
+IP_BIND_ADDRESS_NO_PORT = getattr(socket, 'IP_BIND_ADDRESS_NO_PORT', 24)
+
+_PORT_RANGE_PATH = '/proc/sys/net/ipv4/ip_local_port_range'
+_SOCKSTAT_PATH = '/proc/net/sockstat'
+
+
+def local_error_label(err: int) -> str:
+    return f"{LOCAL_ERROR_PREFIX}{errno.errorcode.get(err, err)}"
+
+
+def is_local_errno(err: Optional[int]) -> bool:
+    return err in LOCAL_ERRNOS
+
+
+def is_local_error(label: Optional[str]) -> bool:
+    """True for probe error labels that describe a local resource problem"""
+    return bool(label) and label.startswith(LOCAL_ERROR_PREFIX)
+
+
+def read_port_range(path: str = _PORT_RANGE_PATH) -> Optional[tuple]:
+    try:
+        with open(path) as f:
+            low, high = (int(v) for v in f.read().split()[:2])
+        return low, high
+    except (OSError, ValueError):
+        return None
+
+
+def read_time_wait(path: str = _SOCKSTAT_PATH) -> Optional[int]:
+    """TIME_WAIT sockets in this network namespace ("TCP: inuse N orphan N tw N ...")"""
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith('TCP:'):
+                    fields = line.split()[1:]
+                    return int(dict(zip(fields[::2], fields[1::2])).get('tw', 0))
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _usable_source_ip(ip: str) -> bool:
+    family = socket.AF_INET6 if ipaddress.ip_address(ip).version == 6 else socket.AF_INET
+    try:
+        with socket.socket(family, socket.SOCK_STREAM) as sock:
+            if family == socket.AF_INET:
+                sock.setsockopt(socket.IPPROTO_IP, IP_BIND_ADDRESS_NO_PORT, 1)
+            sock.bind((ip, 0))
+        return True
+    except OSError as e:
+        logger.warning(f"⚠️ PROBE_SOURCE_IPS: {ip} is not usable as a source address ({e})")
+        return False
+
+
+class ResourceGovernor:
+    """Host limits for probe concurrency, source address rotation and local error accounting"""
+
+    def __init__(self, fd_reserve: int = GOVERNOR_FD_RESERVE, port_share: float = GOVERNOR_PORT_SHARE,
+                 source_ips: str = PROBE_SOURCE_IPS):
+        self.fd_reserve = fd_reserve
+        self.port_share = port_share
+        self.fd_soft: Optional[int] = None
+        self.fd_hard: Optional[int] = None
+        self.fd_raised_from: Optional[int] = None
+        self.port_range = read_port_range()
+        self.time_wait_at_start = read_time_wait()
+        self.source_ips: Dict[int, List[str]] = {socket.AF_INET: [], socket.AF_INET6: []}
+        self._rotation: Dict[int, itertools.cycle] = {}
+        self.stats = {'local_errors': 0}
+        self._raise_fd_limit()
+        self._load_source_ips(source_ips)
+
+    def _raise_fd_limit(self):
+        if resource is None:
+            return
+        try:
+            soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        except (OSError, ValueError):
+            return
+        target = hard if hard != resource.RLIM_INFINITY else max(soft, 1 << 20)
+        if soft != resource.RLIM_INFINITY and soft < target:
+            try:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+                self.fd_raised_from, soft = soft, target
+            except (OSError, ValueError) as e:
+                logger.warning(f"⚠️ Could not raise RLIMIT_NOFILE {soft} -> {target}: {e}")
+        self.fd_soft = None if soft == resource.RLIM_INFINITY else soft
+        self.fd_hard = None if hard == resource.RLIM_INFINITY else hard
+
+    def _load_source_ips(self, spec: str):
+        for item in (part.strip() for part in spec.split(',')):
+            if not item:
+                continue
+            try:
+                address = ipaddress.ip_address(item)
+            except ValueError:
+                logger.warning(f"⚠️ PROBE_SOURCE_IPS: ignoring invalid address {item!r}")
+                continue
+            if _usable_source_ip(str(address)):
+                family = socket.AF_INET6 if address.version == 6 else socket.AF_INET
+                self.source_ips[family].append(str(address))
+        self._rotation = {family: itertools.cycle(ips) for family, ips in self.source_ips.items() if ips}
+
+    @property
+    def source_ip_count(self) -> int:
+        return max(1, len(self.source_ips[socket.AF_INET]))
+
+    def port_budget(self) -> Optional[int]:
+        """Ephemeral ports probes may hold at once across all source addresses"""
+        if not self.port_range:
+            return None
+        low, high = self.port_range
+        ports = max(0, high - low + 1) - (self.time_wait_at_start or 0)
+        return max(1, int(ports * self.port_share)) * self.source_ip_count
+
+    def fd_budget(self) -> Optional[int]:
+        if self.fd_soft is None:
+            return None
+        # Small limits (containers without a raisable hard limit) keep at most a quarter in reserve
+        return max(1, self.fd_soft - min(self.fd_reserve, self.fd_soft // 4))
+
+    def fit_concurrency(self, requested: int) -> int:
+        """Largest probe concurrency <= requested that the fd and port budgets allow"""
+        limits = [requested] + [b for b in (self.fd_budget(), self.port_budget()) if b is not None]
+        return max(1, min(limits))
+
+    def source_for(self, family: int) -> Optional[str]:
+        """Next configured source address for a new probe socket (None: let the kernel choose)"""
+        rotation = self._rotation.get(family)
+        return next(rotation) if rotation else None
+
+    def bind_source(self, sock: socket.socket, family: int):
+        """Bind sock to the next source address; raises OSError like connect() would"""
+        source = self.source_for(family)
+        if source is None:
+            return
+        if family == socket.AF_INET:
+            try:
+                sock.setsockopt(socket.IPPROTO_IP, IP_BIND_ADDRESS_NO_PORT, 1)
+            except OSError:
+                pass  # Older kernels: bind() reserves the port, the budget still holds per address
+        sock.bind((source, 0))
+
+    def record_local_error(self):
+        self.stats['local_errors'] += 1
+
+    def describe(self) -> str:
+        fd = f"fd soft limit {self.fd_soft or 'unlimited'}"
+        if self.fd_raised_from is not None:
+            fd += f" (raised from {self.fd_raised_from})"
+        ports = f"ports {self.port_range[0]}-{self.port_range[1]}" if self.port_range else "ports unknown"
+        sources = sum(len(ips) for ips in self.source_ips.values())
+        return f"{fd}, {ports}, {sources or 'default'} source IP(s)"
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            'fd_soft': self.fd_soft,
+            'fd_hard': self.fd_hard,
+            'fd_raised_from': self.fd_raised_from,
+            'fd_budget': self.fd_budget(),
+            'port_range': list(self.port_range) if self.port_range else None,
+            'port_budget': self.port_budget(),
+            'time_wait': read_time_wait(),
+            'source_ips': [ip for ips in self.source_ips.values() for ip in ips],
+        }
+
+
+# Global resource governor instance
+resource_governor = ResourceGovernor()
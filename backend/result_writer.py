@@ -0,0 +1,176 @@
+"""
+Write-behind node result writer
+Probe workers hand over the columns a test changed instead of committing their own
+session: submit_node() reads the ORM attribute history of a Node (so callers keep setting
+node.status / node.speed / ... as before), drops values that did not change, and queues the
+rest per node id. A background task flushes the queue every RESULT_WRITER_FLUSH_ROWS rows or
+RESULT_WRITER_FLUSH_MS milliseconds, whichever comes first, as executemany UPDATEs inside
+one transaction - one SQLite write lock and fsync per flush instead of several per node.
+"""
+import asyncio
+import logging
+import os
+from typing import Any, Dict, List, Optional, Set
+
+from sqlalchemy import bindparam, inspect as sa_inspect, update
+
+from database import Node, engine
+
+logger = logging.getLogger("result_writer")
+
+RESULT_WRITER_FLUSH_ROWS = int(os.environ.get('RESULT_WRITER_FLUSH_ROWS', 500))
+RESULT_WRITER_FLUSH_MS = int(os.environ.get('RESULT_WRITER_FLUSH_MS', 250))
+# A batch that fails this many flushes in a row is dropped (logged) instead of retried forever
+_MAX_FLUSH_ATTEMPTS = 3
+# Bookkeeping columns: a change to these alone is not worth a write
+_TOUCH_COLUMNS = frozenset({"last_update"})
+
+
+def changed_columns(node) -> Dict[str, Any]:
+    """Column values set on a loaded ORM object since it was loaded / last committed, unchanged ones skipped"""
+    state = sa_inspect(node)
+    changes = {}
+    for attr in state.mapper.column_attrs:
+        history = state.attrs[attr.key].history
+        if not history.added:
+            continue
+        value = history.added[0]
+        if history.deleted and history.deleted[0] == value:
+            continue
+        changes[attr.columns[0].name] = value
+    return changes if set(changes) - _TOUCH_COLUMNS else {}
+
+
+class NodeResultWriter:
+    """Coalescing write-behind queue of node column updates"""
+
+    def __init__(self, flush_rows: int = RESULT_WRITER_FLUSH_ROWS, flush_ms: int = RESULT_WRITER_FLUSH_MS):
+        self.flush_rows = max(1, flush_rows)
+        self.flush_interval = max(1, flush_ms) / 1000.0
+        self._pending: Dict[int, Dict[str, Any]] = {}
+        self._dropped: Set[int] = set()  # node ids whose queued columns were given up on
+        self._attempts = 0
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self.stats = {
+            'submitted': 0,
+            'skipped_unchanged': 0,
+            'coalesced': 0,
+            'rows_written': 0,
+            'statements': 0,
+            'flushes': 0,
+            'errors': 0,
+            'dropped': 0,
+        }
+
+    def submit(self, node_id: int, changes: Dict[str, Any]):
+        """Queue column values for one node; later submits for the same node win per column"""
+        if not changes:
+            self.stats['skipped_unchanged'] += 1
+            return
+        self.stats['submitted'] += 1
+        pending = self._pending.get(node_id)
+        if pending is None:
+            self._pending[node_id] = dict(changes)
+        else:
+            pending.update(changes)
+            self.stats['coalesced'] += 1
+        self._ensure_task()
+        if len(self._pending) >= self.flush_rows:
+            self._wake.set()
+
+    def submit_node(self, node) -> int:
+        """Queue whatever the caller changed on this Node; returns the number of columns queued.
+        The caller's session must then be closed without commit (close() rolls it back)."""
+        changes = changed_columns(node)
+        self.submit(node.id, changes)
+        return len(changes)
+
+    async def flush(self) -> Set[int]:
+        """Write everything queued so far (callers await this before reporting a session complete).
+        Returns the node ids of this flush that were NOT written - re-queued after a failed write,
+        or dropped (see take_dropped()); empty when everything reached the database."""
+        if self._flush_lock is None:
+            return set()
+        async with self._flush_lock:
+            batch, self._pending = self._pending, {}
+            if not batch:
+                return set()
+            try:
+                await asyncio.to_thread(self._write, batch)
+                self._attempts = 0
+                return set()
+            except Exception as e:
+                self.stats['errors'] += 1
+                self._attempts += 1
+                if self._attempts >= _MAX_FLUSH_ATTEMPTS:
+                    self.stats['dropped'] += len(batch)
+                    self._dropped.update(batch)
+                    self._attempts = 0
+                    logger.error(f"❌ Result writer: dropping {len(batch)} node updates after "
+                                 f"{_MAX_FLUSH_ATTEMPTS} failed flushes: {e}")
+                    return set(batch)
+                logger.warning(f"⚠️ Result writer flush failed ({e}), retrying {len(batch)} rows")
+                # Re-queue under anything submitted meanwhile (newer values win)
+                for node_id, changes in batch.items():
+                    self._pending[node_id] = {**changes, **self._pending.get(node_id, {})}
+                return set(batch)
+
+    def is_pending(self, node_id: int) -> bool:
+        """Columns of this node are queued and not written yet"""
+        return node_id in self._pending
+
+    def take_dropped(self) -> Set[int]:
+        """Node ids dropped after repeated failed flushes since the last call (their results are lost)"""
+        dropped, self._dropped = self._dropped, set()
+        return dropped
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def get_stats(self) -> Dict:
+        return {**self.stats, 'pending': len(self._pending), 'flush_rows': self.flush_rows,
+                'flush_ms': int(self.flush_interval * 1000)}
+
+    def _ensure_task(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._wake = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self._pending:
+                await self.flush()
+
+    def _write(self, batch: Dict[int, Dict[str, Any]]):
+        # executemany needs one parameter shape per statement: group rows by changed column set
+        groups: Dict[tuple, List[Dict[str, Any]]] = {}
+        for node_id, changes in batch.items():
+            columns = tuple(sorted(changes))
+            groups.setdefault(columns, []).append(
+                {"node_id_": node_id, **{f"v_{column}": value for column, value in changes.items()}})
+        table = Node.__table__
+        with engine.begin() as conn:
+            for columns, rows in groups.items():
+                statement = (update(table)
+                             .where(table.c.id == bindparam("node_id_"))
+                             .values({column: bindparam(f"v_{column}") for column in columns}))
+                conn.execute(statement, rows)
+                self.stats['statements'] += 1
+        self.stats['rows_written'] += len(batch)
+        self.stats['flushes'] += 1
+
+
+# Global result writer instance
+result_writer = NodeResultWriter()
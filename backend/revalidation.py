@@ -0,0 +1,187 @@
+"""
+Rolling revalidation scheduler
+Background task that continuously re-probes validated nodes (ping_light / ping_ok / speed_ok),
+stalest last_check first, within a fixed probes-per-second budget. Replaces periodic
+"Select All" bursts with flat load and exposes a freshness metric: the share of validated
+nodes checked within REVALIDATION_MAX_AGE_HOURS.
+Revalidation never changes a node's status (a failed reachability probe must not downgrade
+a validated node); it refreshes last_check, the RTT estimator and the failure streak.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import case, func
+
+from database import SessionLocal, Node
+from quarantine import record_probe_outcome
+from rtt_estimator import probe_timeout_for, record_rtt_sample, record_rtt_timeout
+from sharded_executor import probe_engine
+from tcp_scanner import ScanTarget
+from yield_model import yield_model
+
+logger = logging.getLogger("revalidation")
+
+REVALIDATION_ENABLED = os.environ.get('REVALIDATION_ENABLED', '1') not in ('0', 'false', 'no')
+REVALIDATION_PPS = float(os.environ.get('REVALIDATION_PPS', 20))
+REVALIDATION_MAX_AGE_HOURS = float(os.environ.get('REVALIDATION_MAX_AGE_HOURS', 6))
+REVALIDATION_TIMEOUT = float(os.environ.get('REVALIDATION_TIMEOUT', 2.0))
+REVALIDATION_STATUSES = ("ping_light", "ping_ok", "speed_ok")
+
+# One cycle probes PPS * PERIOD nodes, then sleeps out the rest of the period
+_PERIOD = 5.0
+# The freshness aggregate scans all validated rows - refreshed less often than cycles run
+_FRESHNESS_INTERVAL = 60.0
+
+
+class RevalidationScheduler:
+    """Paced, staleness-ordered background re-probing of validated nodes"""
+
+    def __init__(self, budget_pps: float = REVALIDATION_PPS, max_age_hours: float = REVALIDATION_MAX_AGE_HOURS,
+                 timeout: float = REVALIDATION_TIMEOUT, statuses=REVALIDATION_STATUSES):
+        self.budget_pps = budget_pps
+        self.max_age = timedelta(hours=max_age_hours)
+        self.timeout = timeout
+        self.statuses = tuple(statuses)
+        self.running = False
+        self.task: Optional[asyncio.Task] = None
+        # Wired by server.py: port choice, "someone is testing this node right now", "back off"
+        self.port_for: Callable[[Node], int] = lambda node: node.ping_port or node.port or 1723
+        self.is_busy: Callable[[int], bool] = lambda node_id: False
+        self.should_pause: Callable[[], bool] = lambda: False
+        self.freshness: Dict = {}
+        self._freshness_at = 0.0
+        self.stats = {
+            'cycles': 0,
+            'probed': 0,
+            'reachable': 0,
+            'unreachable': 0,
+            'skipped_busy': 0,
+            'paused_cycles': 0,
+        }
+        self._recent: List[tuple] = []  # (monotonic time, probes) of recent cycles for the achieved rate
+
+    def start(self):
+        if self.running or self.budget_pps <= 0:
+            return
+        self.running = True
+        self.task = asyncio.create_task(self._loop())
+        logger.info(f"🔁 Revalidation scheduler started - {self.budget_pps:g} probes/s, "
+                    f"max age {self.max_age.total_seconds() / 3600:g}h")
+
+    def stop(self):
+        self.running = False
+        if self.task:
+            self.task.cancel()
+
+    async def _loop(self):
+        while self.running:
+            started = time.monotonic()
+            try:
+                if self.should_pause():
+                    self.stats['paused_cycles'] += 1
+                else:
+                    await self.run_cycle(max(1, int(self.budget_pps * _PERIOD)))
+                if time.monotonic() - self._freshness_at >= _FRESHNESS_INTERVAL:
+                    self.freshness = self.measure_freshness()
+                    self._freshness_at = time.monotonic()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Error in revalidation cycle: {e}")
+            await asyncio.sleep(max(0.0, _PERIOD - (time.monotonic() - started)))
+
+    async def run_cycle(self, limit: int) -> int:
+        """Probe up to `limit` of the stalest validated nodes; returns the number probed"""
+        db = SessionLocal()
+        try:
+            # Quarantine is not applied here: a probed node moves to the back of the staleness order anyway
+            nodes = (db.query(Node)
+                     .filter(Node.status.in_(self.statuses))
+                     .order_by(Node.last_check.is_(None).desc(), Node.last_check.asc())
+                     .limit(limit * 2)  # headroom for nodes busy in manual sessions
+                     .all())
+            by_id = {}
+            for node in nodes:
+                if self.is_busy(node.id):
+                    self.stats['skipped_busy'] += 1
+                    continue
+                by_id[node.id] = node
+                if len(by_id) >= limit:
+                    break
+            if not by_id:
+                return 0
+
+            targets = [ScanTarget(node.id, node.ip, self.port_for(node),
+                                  probe_timeout_for(node, self.timeout, "adaptive"))
+                       for node in by_id.values()]
+            async for result in probe_engine().scan(targets, max_in_flight=len(targets)):
+                node = by_id[result.key]
+                if result.success:
+                    record_rtt_sample(node, result.rtt_ms)
+                    self.stats['reachable'] += 1
+                else:
+                    if result.error == "timeout":
+                        record_rtt_timeout(node)
+                    self.stats['unreachable'] += 1
+                record_probe_outcome(node, result.success)
+                yield_model.observe(node.provider, node.country, node.ip, result.success)
+                node.last_check = datetime.utcnow()
+
+            db.commit()
+            self.stats['cycles'] += 1
+            self.stats['probed'] += len(targets)
+            self._recent = [(t, n) for t, n in self._recent if time.monotonic() - t < 60] + [(time.monotonic(), len(targets))]
+            return len(targets)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def measure_freshness(self) -> Dict:
+        """Share of validated nodes checked within max_age, oldest check age and whether the budget keeps up"""
+        cutoff = datetime.utcnow() - self.max_age
+        db = SessionLocal()
+        try:
+            total, fresh, never, oldest = (
+                db.query(func.count(Node.id),
+                         func.sum(case((Node.last_check >= cutoff, 1), else_=0)),
+                         func.sum(case((Node.last_check.is_(None), 1), else_=0)),
+                         func.min(Node.last_check))
+                .filter(Node.status.in_(self.statuses))
+                .one()
+            )
+        finally:
+            db.close()
+        fresh, never = fresh or 0, never or 0
+        required_pps = total / self.max_age.total_seconds() if self.max_age.total_seconds() else 0.0
+        return {
+            "validated_nodes": total,
+            "fresh_nodes": fresh,
+            "freshness": round(fresh / total, 4) if total else 1.0,
+            "never_checked": never,
+            "oldest_check_age_hours": round((datetime.utcnow() - oldest).total_seconds() / 3600, 2) if oldest else None,
+            "required_pps": round(required_pps, 2),
+            "budget_sufficient": required_pps <= self.budget_pps,
+            "measured_at": datetime.utcnow().isoformat(),
+        }
+
+    def get_status(self) -> Dict:
+        window = [n for t, n in self._recent if time.monotonic() - t < 60]
+        return {
+            "enabled": self.running,
+            "budget_pps": self.budget_pps,
+            "achieved_pps": round(sum(window) / 60.0, 2),
+            "max_age_hours": self.max_age.total_seconds() / 3600,
+            "statuses": list(self.statuses),
+            **self.stats,
+            "freshness": self.freshness,
+        }
+
+
+# Global revalidation scheduler instance
+revalidation_scheduler = RevalidationScheduler()
@@ -0,0 +1,71 @@
+"""
+Per-node RTT estimator for adaptive probe timeouts
+Smoothed RTT + RTT variance in the style of TCP's RTO calculation (RFC 6298).
+Values are kept in milliseconds on the Node row (rtt_srtt / rtt_var).
+Samples only come from successful probes, so timeouts back the timeout off instead
+(RFC 6298 5.5: doubled per consecutive timeout, rtt_backoff on the Node row); after
+RTT_MAX_BACKOFF doublings the history is considered stale and dropped (5.7).
+"""
+import os
+from typing import Optional, Tuple
+
+RTT_ALPHA = 1 / 8   # gain for the smoothed RTT
+RTT_BETA = 1 / 4    # gain for the RTT variance
+RTT_K = 4           # variance multiplier in the timeout formula
+RTT_MIN_VAR_MS = 10.0  # clock granularity term G: keeps timeouts from collapsing onto srtt
+RTT_MAX_BACKOFF = 3    # consecutive timeout doublings before the RTT history is reset
+
+# Global bounds for adaptive timeouts (seconds)
+ADAPTIVE_TIMEOUT_FLOOR = float(os.environ.get('ADAPTIVE_TIMEOUT_FLOOR', 0.3))
+ADAPTIVE_TIMEOUT_CEILING = float(os.environ.get('ADAPTIVE_TIMEOUT_CEILING', 5.0))
+
+TIMEOUT_MODE_FIXED = "fixed"
+TIMEOUT_MODE_ADAPTIVE = "adaptive"
+
+
+def update_rtt(srtt: Optional[float], rttvar: Optional[float], sample_ms: float) -> Tuple[float, float]:
+    """Fold one successful RTT sample into (srtt, rttvar)"""
+    if srtt is None or rttvar is None:
+        return sample_ms, sample_ms / 2.0
+    rttvar = (1 - RTT_BETA) * rttvar + RTT_BETA * abs(srtt - sample_ms)
+    srtt = (1 - RTT_ALPHA) * srtt + RTT_ALPHA * sample_ms
+    return srtt, rttvar
+
+
+def adaptive_timeout(srtt: Optional[float], rttvar: Optional[float], default: float, backoff: int = 0) -> float:
+    """Probe timeout in seconds: (srtt + K*rttvar) * 2^backoff, clamped to the global floor/ceiling.
+    Nodes without history keep the caller's fixed timeout."""
+    if srtt is None or rttvar is None:
+        return default
+    rto_ms = srtt + max(RTT_MIN_VAR_MS, RTT_K * rttvar)
+    # Backoff doubles the floored timeout, so every timeout really widens the next one
+    rto = max(ADAPTIVE_TIMEOUT_FLOOR, rto_ms / 1000.0) * (2 ** min(backoff or 0, RTT_MAX_BACKOFF))
+    return min(ADAPTIVE_TIMEOUT_CEILING, rto)
+
+
+def probe_timeout_for(node, default: float, timeout_mode: Optional[str]) -> float:
+    """Timeout for one probe of this node under the requested timeout_mode"""
+    if timeout_mode != TIMEOUT_MODE_ADAPTIVE:
+        return default
+    return adaptive_timeout(getattr(node, 'rtt_srtt', None), getattr(node, 'rtt_var', None), default,
+                            getattr(node, 'rtt_backoff', 0))
+
+
+def record_rtt_sample(node, sample_ms: float):
+    """Update the node's estimator in place after a successful probe"""
+    node.rtt_srtt, node.rtt_var = update_rtt(node.rtt_srtt, node.rtt_var, sample_ms)
+    if node.rtt_backoff:
+        node.rtt_backoff = 0
+
+
+def record_rtt_timeout(node):
+    """Back the node's adaptive timeout off after a probe timed out (refusals are not timeouts)"""
+    if node.rtt_srtt is None:
+        return
+    backoff = (node.rtt_backoff or 0) + 1
+    if backoff > RTT_MAX_BACKOFF:
+        # Still timing out at 2^RTT_MAX_BACKOFF x RTO: the history no longer describes the path
+        node.rtt_srtt = node.rtt_var = None
+        node.rtt_backoff = 0
+    else:
+        node.rtt_backoff = backoff
@@ -135,6 +135,11 @@ class TestRequest(BaseModel):
     ping_timeouts: Optional[List[float]] = None  # seconds per attempt, e.g., [0.8,1.2,1.6]
     speed_sample_kb: Optional[int] = None        # e.g., 512
     speed_timeout: Optional[int] = None          # total timeout seconds
+    timeout_mode: Optional[str] = None           # "fixed" (default) or "adaptive" (per-node RTT estimate)
+    tiered: Optional[bool] = None                # PING LIGHT: fast sweep, then slow retry of timeouts only
+    include_quarantined: Optional[bool] = None   # Select All: also probe nodes in dead-node quarantine
+    preflight: Optional[bool] = None             # Probe a stratified sample and return an estimate, no session
+    preflight_sample: Optional[int] = None       # Preflight sample size (default PREFLIGHT_SAMPLE_SIZE)
 
 class ServiceStatus(BaseModel):
     node_id: int
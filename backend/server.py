@@ -14,6 +14,7 @@ import asyncio
 import threading
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
+from contextlib import aclosing
 import logging
 
 # Local imports
@@ -29,11 +30,25 @@ from schemas import (
 from services import service_manager, network_tester
 from socks_server import start_socks_service, stop_socks_service, get_socks_stats
 from socks_monitor import start_socks_monitoring, get_proxy_file_content, get_monitoring_stats
-
-# Progress Tracking System
+from rtt_estimator import probe_timeout_for, record_rtt_sample, record_rtt_timeout
+from quarantine import plan_sweep, record_probe_outcome
+from resource_governor import is_local_error, resource_governor
+from result_writer import result_writer
+from job_store import test_job_store
+from tunnel_speed import tunnel_speed_tester
+from revalidation import REVALIDATION_ENABLED, revalidation_scheduler
+from yield_model import ALIVE_STATUSES, DEAD_STATUSES, expected_yield_curve, yield_model
+from preflight import PREFLIGHT_SAMPLE_SIZE, run_preflight
+from concurrency_control import AIMDLimiter, run_worker_pool
+from tcp_scanner import SCANNER_MAX_IN_FLIGHT
+from probe_cache import PROBE_KIND_TCP, probe_cache
+from probe_scheduler import interleave_by_prefix, prefix_limiter
+from sharded_executor import probe_engine, sharded_executor
+from event_loop import new_event_loop, running_loop_name, uvicorn_loop_setting
+
+# Progress Tracking System (bounded stores, TTL eviction - progress_tracking)
 import uuid
-progress_store = {}
-import_progress = {}  # For chunked import progress tracking
+from progress_tracking import ProgressTracker, import_progress, progress_store
 
 # Global testing concurrency controls (АГРЕССИВНО увеличено для скорости)
 MAX_PING_GLOBAL = 20   # МАКСИМАЛЬНО увеличено для скорости ping
@@ -41,10 +56,19 @@ MAX_SPEED_GLOBAL = 10  # МАКСИМАЛЬНО увеличено для ско
 
 # СПЕЦИАЛЬНЫЕ ЛИМИТЫ ДЛЯ PING LIGHT (ТЗ требование)
 MAX_PING_LIGHT_GLOBAL = 100  # Увеличенный параллелизм для быстрой проверки портов без авторизации
-
-global_ping_sem = asyncio.Semaphore(MAX_PING_GLOBAL)
-global_speed_sem = asyncio.Semaphore(MAX_SPEED_GLOBAL)
-global_ping_light_sem = asyncio.Semaphore(MAX_PING_LIGHT_GLOBAL)
+PING_LIGHT_SCAN_IN_FLIGHT = 2000  # Initial TCP connects in flight per PING LIGHT session (tcp_scanner)
+PING_LIGHT_FAST_TIMEOUT = 0.6  # Pass 1 timeout for tiered PING LIGHT sweeps (seconds)
+
+# AIMD: MAX_* are starting points, the live limit follows timeouts / latency / loop lag;
+# the ceilings are fitted to this host's fd / ephemeral port budget (resource_governor)
+global_ping_sem = AIMDLimiter("ping", MAX_PING_GLOBAL, min_limit=5, max_limit=resource_governor.fit_concurrency(500),
+                              increase=2, window=40)
+global_speed_sem = AIMDLimiter("speed", MAX_SPEED_GLOBAL, min_limit=2, max_limit=100, window=20)
+# PING LIGHT: live per-session in-flight cap handed to tcp_scanner
+_PING_LIGHT_MAX_IN_FLIGHT = resource_governor.fit_concurrency(SCANNER_MAX_IN_FLIGHT)
+global_ping_light_sem = AIMDLimiter("ping_light", min(PING_LIGHT_SCAN_IN_FLIGHT, _PING_LIGHT_MAX_IN_FLIGHT),
+                                    min_limit=min(MAX_PING_LIGHT_GLOBAL, _PING_LIGHT_MAX_IN_FLIGHT),
+                                    max_limit=_PING_LIGHT_MAX_IN_FLIGHT, increase=100, window=500)
 
 # Система защиты от перегрузки (увеличена для скорости)
 active_sessions = set()
@@ -54,37 +78,6 @@ def can_start_new_session() -> bool:
     """Проверка возможности запуска новой сессии"""
     return len(active_sessions) < MAX_CONCURRENT_SESSIONS
 
-class ProgressTracker:
-    def __init__(self, session_id: str, total_items: int):
-        self.session_id = session_id
-        self.total_items = total_items
-        self.processed_items = 0
-        self.current_task = ""
-        self.status = "running"
-        self.results = []
-        
-    def update(self, processed: int, current_task: str = "", add_result: dict = None):
-        self.processed_items = processed
-        self.current_task = current_task
-        if add_result:
-            self.results.append(add_result)
-        progress_store[self.session_id] = self
-    
-    def complete(self, status: str = "completed"):
-        self.status = status
-        progress_store[self.session_id] = self
-    
-    def to_dict(self):
-        return {
-            "session_id": self.session_id,
-            "total_items": self.total_items,
-            "processed_items": self.processed_items,
-            "current_task": self.current_task,
-            "status": self.status,
-            "progress_percent": int((self.processed_items / self.total_items) * 100) if self.total_items > 0 else 0,
-            "results": self.results
-        }
-
 # Progress safe increment helper
 progress_locks = {}
 
@@ -112,6 +105,45 @@ async def cleanup_stuck_nodes():
     except Exception as e:
         logger.error(f"❌ Error during stuck nodes cleanup: {str(e)}")
 
+def run_test_job(session_id: str, kind: str, node_ids: list, params: dict):
+    """Background task for a batch test session: kind "ping_light" or "testing" (params carry testing_mode)"""
+    if kind == "ping_light":
+        return asyncio.create_task(process_ping_light_batches(session_id, node_ids, None, **params))
+    params = dict(params)
+    testing_mode = params.pop("testing_mode")
+    return asyncio.create_task(process_testing_batches(session_id, node_ids, testing_mode, None, **params))
+
+async def start_test_job(session_id: str, kind: str, node_ids: list, params: dict):
+    """Record the plan of a batch test session (test_jobs), then start it"""
+    try:
+        await asyncio.to_thread(test_job_store.create, session_id, kind, node_ids, params)
+    except Exception as e:
+        # Без журнала сессия все равно идет, но после перезапуска не продолжится
+        logger.error(f"❌ Test job {session_id}: plan not recorded, session will not survive a restart: {e}")
+    return run_test_job(session_id, kind, node_ids, params)
+
+async def resume_test_jobs():
+    """Resume batch test sessions interrupted by a restart from their last checkpoint"""
+    try:
+        jobs = await asyncio.to_thread(test_job_store.unfinished)
+    except Exception as e:
+        logger.error(f"❌ Error loading unfinished test jobs: {e}")
+        return
+    for job in jobs:
+        remaining = job["remaining"]
+        if not remaining:
+            await test_job_store.finish(job["id"], "completed")
+            continue
+        progress = ProgressTracker(job["id"], job["total_items"])
+        progress.alive_items = job["alive_items"]
+        progress.update(job["processed_items"],
+                        f"Возобновлено после перезапуска: осталось {len(remaining)} из {job['total_items']} узлов")
+        active_sessions.add(job["id"])
+        run_test_job(job["id"], job["kind"], remaining, job["params"])
+        test_job_store.stats['jobs_resumed'] += 1
+        logger.info(f"♻️ Resumed {job['kind']} test job {job['id']}: "
+                    f"{job['processed_items']}/{job['total_items']} done, {len(remaining)} remaining")
+
 # Setup
 ROOT_DIR = Path(__file__).parent
 
@@ -148,12 +180,45 @@ def has_ping_baseline(status: str) -> bool:
     return status in ("ping_ok", "speed_ok", "online")
 
 
+def record_reachability(node: Node, success: bool):
+    """Feed one reachability probe outcome to the dead-node quarantine and the yield model"""
+    record_probe_outcome(node, success)
+    yield_model.observe(node.provider, node.country, node.ip, success)
+
+
+async def run_batch_preflight(db: Session, node_ids: list, test_request: TestRequest,
+                              timeout: float, concurrency: int, ports_for=None) -> dict:
+    """Preflight for a batch endpoint: estimate alive rate and sweep duration from a stratified sample.
+    ports_for: ports the estimated sweep probes per node (PING LIGHT: 1723 only; default: the PING OK
+    multi-port race, get_ping_ports_for_node)."""
+    rows = []
+    for chunk_start in range(0, len(node_ids), 500):
+        chunk = node_ids[chunk_start:chunk_start + 500]
+        rows.extend(db.query(Node.id, Node.ip, Node.provider, Node.country, Node.protocol, Node.port,
+                             Node.ping_port, Node.socks_port)
+                    .filter(Node.id.in_(chunk)).all())
+    return await run_preflight(rows, timeout=timeout, concurrency=concurrency,
+                               sample_size=test_request.preflight_sample or PREFLIGHT_SAMPLE_SIZE,
+                               ports_for=ports_for or get_ping_ports_for_node)
+
+
+def ensure_yield_model_seeded(db: Session):
+    """First use after startup: current statuses are the probe history the model starts from"""
+    if not yield_model.seeded:
+        yield_model.seed(db.query(Node.provider, Node.country, Node.ip, Node.status)
+                         .filter(Node.status.in_(ALIVE_STATUSES + DEAD_STATUSES)).yield_per(5000))
+
+
 # Create tables on startup
 create_tables()
 
 # Create default admin user if not exists
 @app.on_event("startup")
 async def startup_event():
+    # uvicorn CLI runs choose the API loop with --loop; CONNEXA_EVENT_LOOP covers the rest
+    logger.info(f"🔁 API event loop: {running_loop_name()}, background loops: {uvicorn_loop_setting()}")
+    logger.info(f"🧮 Probe resources: {resource_governor.describe()}; PING LIGHT in-flight ceiling "
+                f"{global_ping_light_sem.max_limit}, ping ceiling {global_ping_sem.max_limit}")
     db = next(get_db())
     try:
         admin_user = db.query(User).filter(User.username == "admin").first()
@@ -169,6 +234,8 @@ async def startup_event():
         logger.error(f"Startup admin check/create error: {e}")
     # Clean up any nodes stuck in 'checking' status on startup
     await cleanup_stuck_nodes()
+    # Continue batch test sessions the restart interrupted
+    await resume_test_jobs()
     # Start background monitoring with improved protection
     start_background_monitoring()
     logger.info("✅ Background monitoring RE-ENABLED with enhanced speed_ok protection")
@@ -176,6 +243,13 @@ async def startup_event():
     # Start SOCKS monitoring system
     start_socks_monitoring()
     logger.info("✅ SOCKS monitoring service started - checking every 30 seconds")
+    
+    # Rolling revalidation: stalest validated nodes first, within a probes/s budget
+    if REVALIDATION_ENABLED:
+        revalidation_scheduler.port_for = lambda node: get_ping_ports_for_node(node)[0]
+        revalidation_scheduler.is_busy = lambda node_id: node_id in _test_inflight
+        revalidation_scheduler.should_pause = lambda: len(active_sessions) >= MAX_CONCURRENT_SESSIONS
+        revalidation_scheduler.start()
 
 # Deduplication registry to avoid duplicate tests and reduce load
 # Раздельные TTL для разных типов тестов
@@ -331,6 +405,7 @@ def get_ping_ports_for_node(node: Node) -> list[int]:
     - ovpn: node.port else [1194, 443, 80] (OpenVPN + HTTPS fallback)
     - ssh: node.port else [22, 2222, 443] (SSH + alt ports)
     - unknown: node.port else [80, 443, 8080] (HTTP/HTTPS)
+    A learned node.ping_port (winner of the last race) short-circuits the fallbacks.
     """
     try:
         proto = (node.protocol or "").lower()
@@ -338,6 +413,10 @@ def get_ping_ports_for_node(node: Node) -> list[int]:
         # Prefer explicit node.port when present
         if node.port:
             return [int(node.port)]
+        
+        # Port that won the last multi-port race - go straight to it
+        if getattr(node, "ping_port", None):
+            return [int(node.ping_port)]
             
         # Protocol-specific ports with intelligent fallbacks
         if proto == "pptp":
@@ -357,6 +436,21 @@ def get_ping_ports_for_node(node: Node) -> list[int]:
     except Exception:
         return [80, 443]  # Safe fallback to web ports
 
+def probe_timed_out(ping_result: dict) -> bool:
+    """True when a failed multiport_tcp_ping failed only by timeouts (feedback for AIMD limiters)"""
+    if not ping_result or ping_result.get('success'):
+        return False
+    errors = [d.get('error') for d in (ping_result.get('details') or {}).values() if d.get('fail')]
+    return bool(errors) and all(err == "timeout" for err in errors)
+
+def probe_local_error(ping_result: dict) -> bool:
+    """True when a probe failed only because this host ran out of fds / ports - the node was not judged"""
+    return bool(ping_result and ping_result.get('local_error'))
+
+def remember_ping_port(node: Node, ping_result: dict):
+    """Store the port that answered multiport_tcp_ping; forget it on failure so the next test races again"""
+    node.ping_port = ping_result.get('port') if ping_result and ping_result.get('success') else None
+
 
 # ===== BACKGROUND MONITORING SYSTEM =====
 # This system monitors ONLY online nodes every 5 minutes as per user requirements
@@ -441,7 +535,7 @@ async def monitor_online_nodes():
 
 def run_monitoring_loop():
     """Run the monitoring loop in a separate thread"""
-    loop = asyncio.new_event_loop()
+    loop = new_event_loop()
     asyncio.set_event_loop(loop)
     loop.run_until_complete(monitor_online_nodes())
 
@@ -460,6 +554,11 @@ async def shutdown_event():
     """Stop monitoring on app shutdown"""
     global monitoring_active
     monitoring_active = False
+    revalidation_scheduler.stop()
+    sharded_executor.shutdown()
+    # Running test jobs stay "running" in test_jobs and resume on the next startup
+    await test_job_store.stop()
+    await result_writer.stop()
     logger.info("Background monitoring service stopped")
 
 # Authentication Routes
@@ -2705,8 +2804,35 @@ async def cancel_all_progress(current_user: User = Depends(get_current_user)):
     for sid, tracker in list(progress_store.items()):
         tracker.status = 'cancelled'
         progress_store[sid] = tracker
+    await asyncio.to_thread(test_job_store.cancel_running)
     return {"success": True, "message": "All test sessions cancelled"}
 
+@api_router.get("/test-jobs")
+async def get_test_jobs(limit: int = 50, current_user: User = Depends(get_current_user)):
+    """Durable batch test jobs (newest first) and checkpoint statistics"""
+    return {
+        "jobs": await asyncio.to_thread(test_job_store.list_jobs, limit),
+        "store": test_job_store.get_stats(),
+    }
+
+@api_router.get("/revalidation/status")
+async def get_revalidation_status(current_user: User = Depends(get_current_user)):
+    """Rolling revalidation scheduler: budget, achieved rate and freshness of validated nodes"""
+    if not revalidation_scheduler.freshness:
+        revalidation_scheduler.freshness = revalidation_scheduler.measure_freshness()
+    return revalidation_scheduler.get_status()
+
+@api_router.get("/probe-resources")
+async def get_probe_resources(current_user: User = Depends(get_current_user)):
+    """fd / ephemeral port budgets, source addresses and local resource errors of the probe engine"""
+    from tcp_scanner import tcp_scanner
+    return {
+        "governor": resource_governor.get_stats(),
+        "scanner": tcp_scanner.get_stats(),
+        "ping_light_max_in_flight": global_ping_light_sem.max_limit,
+        "ping_max_concurrency": global_ping_sem.max_limit,
+    }
+
 # Statistics
 @api_router.get("/stats")
 async def get_stats(
@@ -2759,27 +2885,78 @@ async def get_stats(
         }
     }
 
+PROGRESS_SSE_INTERVAL = 0.5  # seconds between progress polls
+PROGRESS_SSE_KEEPALIVE = 15  # seconds without changes before a keepalive comment
+PROGRESS_SSE_MAX_RESULTS = int(os.environ.get('PROGRESS_SSE_MAX_RESULTS', 2000))  # results per event
+
+def _last_event_id(request: Request, last_event_id: Optional[int]) -> int:
+    """Result cursor to resume from: Last-Event-ID header (EventSource reconnect) or ?last_event_id="""
+    header = request.headers.get("last-event-id")
+    try:
+        return max(0, int(header)) if header else max(0, last_event_id or 0)
+    except ValueError:
+        return 0
+
 @api_router.get("/progress/{session_id}")
-async def get_progress_stream(session_id: str):
+async def get_progress_stream(session_id: str, request: Request, last_event_id: Optional[int] = None):
     """Server-Sent Events endpoint for real-time progress updates.
+    Every event carries the counters plus only the results appended since the previous event
+    ("results_from" is the index of the first one, "more" marks a backlog chunk that is not the
+    last - its status stays "running"); the event id is the result cursor, so a
+    reconnecting client resumes from Last-Event-ID instead of re-downloading the history.
+    Unchanged progress is not re-sent (live limiter gauges alone do not count as a change).
     No auth required - session_id serves as access control."""
     
     async def event_generator():
+        cursor = _last_event_id(request, last_event_id)
+        last_summary = None
+        idle = 0.0
+        yield "retry: 2000\n\n"
         while True:
+            backlog = False
             if session_id in progress_store:
                 progress = progress_store[session_id]
-                data = json.dumps(progress.to_dict())
-                yield f"data: {data}\n\n"
+                start, new_results = progress.results_since(cursor)
+                backlog = len(new_results) > PROGRESS_SSE_MAX_RESULTS
+                new_results = new_results[:PROGRESS_SSE_MAX_RESULTS]
+                summary = progress.summary()
+                if backlog:
+                    # Non-final chunk: clients close on a terminal status, so it is held back
+                    # until the last chunk of the backlog
+                    summary["status"] = "running"
+                # Live limiter gauges (in_flight, loop lag) ride along but do not make an event on their own
+                summary_key = ProgressTracker.change_key(summary)
+                if new_results or summary_key != last_summary:
+                    cursor = start + len(new_results)
+                    last_summary = summary_key
+                    idle = 0.0
+                    data = json.dumps({**summary, "results_from": start, "results": new_results, "more": backlog})
+                    yield f"id: {cursor}\ndata: {data}\n\n"
                 
-                # If completed or failed, break the loop
-                if progress.status in ["completed", "failed", "cancelled"]:
+                # If completed or failed (and the client has every result), break the loop
+                if progress.status in ["completed", "failed", "cancelled"] and not backlog:
                     break
             else:
-                # Session not found, send empty progress
-                yield f"data: {json.dumps({'error': 'Session not found'})}\n\n"
-                break
+                # Not in memory (restart, or waiting to resume): last durable checkpoint
+                snapshot = await asyncio.to_thread(test_job_store.snapshot, session_id)
+                if snapshot is None:
+                    # Session not found, send empty progress
+                    yield f"data: {json.dumps({'error': 'Session not found'})}\n\n"
+                    break
+                if snapshot != last_summary:
+                    last_summary = snapshot
+                    idle = 0.0
+                    yield f"id: {cursor}\ndata: {json.dumps({**snapshot, 'results_from': cursor})}\n\n"
+                if snapshot["status"] != "running":
+                    break
             
-            await asyncio.sleep(0.5)  # Update every 500ms
+            if backlog:
+                continue  # Catching up a reconnect: next chunk right away
+            if idle >= PROGRESS_SSE_KEEPALIVE:
+                idle = 0.0
+                yield ": keepalive\n\n"
+            await asyncio.sleep(PROGRESS_SSE_INTERVAL)
+            idle += PROGRESS_SSE_INTERVAL
     
     return StreamingResponse(
         event_generator(), 
@@ -2790,7 +2967,7 @@ async def get_progress_stream(session_id: str):
             "X-Accel-Buffering": "no",
             "Access-Control-Allow-Origin": "*",
             "Access-Control-Allow-Methods": "GET",
-            "Access-Control-Allow-Headers": "Cache-Control"
+            "Access-Control-Allow-Headers": "Cache-Control, Last-Event-ID"
         }
     )
 
@@ -2800,6 +2977,9 @@ async def cancel_progress(session_id: str, current_user: User = Depends(get_curr
     if session_id in progress_store:
         progress_store[session_id].status = "cancelled"
         return {"success": True, "message": "Operation cancelled"}
+    # Durable job not running in this process (e.g. waiting to resume)
+    if await asyncio.to_thread(test_job_store.cancel, session_id):
+        return {"success": True, "message": "Operation cancelled"}
     return {"success": False, "message": "Session not found"}
 
 # Service Management Routes
@@ -3385,7 +3565,12 @@ async def manual_ping_light_test(
     db: Session = Depends(get_db)
 ):
     """Manual PING LIGHT testing - быстрая проверка TCP порта без авторизации"""
+    from ping_speed_test import ping_light_result_from_scan
+    from tcp_scanner import ScanTarget
+
     node_ids = data.get('node_ids', [])
+    ping_light_timeout = 2.0
+    timeout_mode = data.get('timeout_mode')
     
     # Если node_ids пустой - тестируем ВСЕ узлы (Select All режим)
     if not node_ids:
@@ -3395,6 +3580,7 @@ async def manual_ping_light_test(
         logger.info(f"📊 Will test {len(node_ids)} nodes (all nodes in database)")
     
     results = []
+    nodes_to_probe = {}  # node_id -> (result index, node)
     
     for node_id in node_ids:
         # Проверка дедупликации
@@ -3427,20 +3613,63 @@ async def manual_ping_light_test(
             continue
 
         test_dedupe_mark_enqueued(node_id, "ping_light")
-        
+        nodes_to_probe[node_id] = (len(results), node)
+        results.append(None)  # заполняется после сканирования
+
+    # Все узлы проверяются одним проходом сканера, один connect на уникальный endpoint
+    timeout_by_id = {node_id: probe_timeout_for(node, ping_light_timeout, timeout_mode)
+                     for node_id, (_, node) in nodes_to_probe.items()}
+    endpoints = {}
+    for node_id, (_, node) in nodes_to_probe.items():
+        endpoints.setdefault(node.ip, []).append(node_id)
+    targets = [ScanTarget(ip, ip, 1723, max(timeout_by_id[node_id] for node_id in endpoints[ip]))
+               for ip in interleave_by_prefix(endpoints, lambda ip: ip)]
+    scan_results = {}
+    try:
+        async for scan_result in probe_engine().scan(targets, max_in_flight=global_ping_light_sem):
+            global_ping_light_sem.record(scan_result.success,
+                                         timed_out=scan_result.error == "timeout" or is_local_error(scan_result.error),
+                                         latency_ms=scan_result.rtt_ms)
+            for node_id in endpoints[scan_result.key]:
+                scan_results[node_id] = scan_result
+    except Exception as e:
+        logger.error(f"PING LIGHT scan error: {str(e)}")
+
+    for node_id, (index, node) in nodes_to_probe.items():
+        original_status = node.status
         try:
-            original_status = node.status
             node.last_update = datetime.utcnow()
             
-            # Выполнить PING LIGHT тест
-            from ping_speed_test import test_node_ping_light
-            ping_result = await test_node_ping_light(node.ip)
+            scan_result = scan_results.get(node_id)
+            if scan_result is None:
+                raise RuntimeError("no scan result")
+            ping_result = ping_light_result_from_scan(scan_result, timeout_by_id[node_id])
+            probe_cache.put(scan_result.ip, scan_result.port, PROBE_KIND_TCP, ping_result)
+            
+            if probe_local_error(ping_result):
+                # Нехватка fd / портов на этом сервере - узел не проверялся, статус не трогаем
+                logger.warning(f"⚠️ Node {node_id} PING LIGHT not tested: {scan_result.error}")
+                results[index] = {
+                    "node_id": node_id,
+                    "status": "local_error",
+                    "message": ping_result.get('message', ''),
+                    "success": False,
+                    "local_error": True,
+                    "avg_time": 0.0,
+                    "packet_loss": 0.0,
+                    "original_status": original_status,
+                    "new_status": original_status
+                }
+                continue
             
             # Обновить статус на основе результата (С ЗАЩИТОЙ для ping_light)
             if ping_result['success']:
                 node.status = "ping_light"
+                record_rtt_sample(node, scan_result.rtt_ms)
                 logger.info(f"✅ Node {node_id} PING LIGHT SUCCESS - status: {original_status} -> ping_light")
             else:
+                if scan_result.error == "timeout":
+                    record_rtt_timeout(node)
                 # ЗАЩИТА: если уже был ping_light (порт работал хотя бы раз), сохраняем статус
                 if original_status in ("ping_light", "ping_ok", "speed_ok", "online"):
                     node.status = original_status  # Сохраняем! Не откатываем до ping_failed
@@ -3448,33 +3677,34 @@ async def manual_ping_light_test(
                 else:
                     node.status = "ping_failed"
                     logger.info(f"❌ Node {node_id} PING LIGHT FAILED - status: {original_status} -> ping_failed")
+            record_reachability(node, ping_result['success'])
             
             node.last_check = datetime.utcnow()
             node.last_update = datetime.utcnow()
             
-            results.append({
+            results[index] = {
                 "node_id": node_id,
                 "status": "completed",
                 "message": ping_result.get('message', ''),
                 "success": ping_result.get('success', False),
                 "avg_time": ping_result.get('avg_time', 0.0),
-                "packet_loss": ping_result.get('packet_loss', 0.0),
+                "packet_loss": 0.0 if ping_result['success'] else 100.0,
                 "original_status": original_status,
                 "new_status": node.status
-            })
+            }
             
         except Exception as e:
             logger.error(f"Error in PING LIGHT test for node {node_id}: {str(e)}")
-            results.append({
+            results[index] = {
                 "node_id": node_id,
                 "status": "error",
                 "message": f"PING LIGHT test error: {str(e)}",
                 "success": False,
                 "avg_time": 0.0,
                 "packet_loss": 0.0,
-                "original_status": original_status if 'original_status' in locals() else None,
+                "original_status": original_status,
                 "new_status": None
-            })
+            }
         finally:
             test_dedupe_mark_finished(node_id)
     
@@ -3609,13 +3839,14 @@ async def manual_ping_test_batch(
     progress.update(0, f"Начинаем ping тестирование {len(nodes)} узлов...")
     
     # Start background batch testing
-    asyncio.create_task(process_testing_batches(
-        session_id, [n.id for n in nodes], "ping_only", db,
+    await start_test_job(session_id, "testing", [n.id for n in nodes], dict(
+        testing_mode="ping_only",
         ping_concurrency=test_request.ping_concurrency or 15,  # АГРЕССИВНО увеличено
         speed_concurrency=test_request.speed_concurrency or 8,   # АГРЕССИВНО увеличено
         ping_timeouts=test_request.ping_timeouts or [0.8,1.2,1.6],
         speed_sample_kb=test_request.speed_sample_kb or 512,
-        speed_timeout=test_request.speed_timeout or 15
+        speed_timeout=test_request.speed_timeout or 15,
+        timeout_mode=test_request.timeout_mode
     ))
     
     return {"results": [], "session_id": session_id, "message": f"Запущено тестирование {len(nodes)} узлов"}
@@ -3643,6 +3874,7 @@ async def manual_ping_light_test_batch_progress(
     
     # Если node_ids пустой - тестируем узлы по фильтрам (Select All режим)
     node_ids_to_test = test_request.node_ids
+    quarantined_skipped = 0
     if not node_ids_to_test:
         logger.info("🌐 PING LIGHT BATCH: Select All mode detected - loading nodes with filters")
         query = db.query(Node)
@@ -3650,10 +3882,24 @@ async def manual_ping_light_test_batch_progress(
         if test_request.filters:
             query = apply_node_filters(query, test_request.filters)
             logger.info(f"🔍 PING LIGHT BATCH: Applying filters: {test_request.filters}")
-        all_nodes = query.all()
-        node_ids_to_test = [node.id for node in all_nodes]
+        # Узлы в карантине (серия неудач) пропускаются, кроме случайной доли на повторную проверку
+        rows = query.with_entities(Node.id, Node.next_eligible_at).all()
+        node_ids_to_test, quarantined_skipped, readmitted = plan_sweep(rows, bool(test_request.include_quarantined))
+        if quarantined_skipped or readmitted:
+            logger.info(f"🧊 PING LIGHT BATCH: {quarantined_skipped} quarantined nodes skipped, {readmitted} re-admitted")
         logger.info(f"📊 PING LIGHT BATCH: Will test {len(node_ids_to_test)} nodes (with filters)")
     
+    # Preflight: выборка вместо полного прогона - оценка доли живых и длительности
+    if test_request.preflight:
+        active_sessions.discard(session_id)
+        timeouts = test_request.ping_timeouts or [2.0]
+        estimate = await run_batch_preflight(db, node_ids_to_test, test_request,
+                                             timeout=timeouts[-1] if test_request.tiered else timeouts[0],
+                                             concurrency=global_ping_light_sem.limit,
+                                             ports_for=lambda row: [1723])
+        return {"session_id": None, "started": False, "preflight": estimate,
+                "quarantined_skipped": quarantined_skipped}
+    
     # Get all valid nodes
     nodes = []
     for node_id in node_ids_to_test:
@@ -3662,7 +3908,8 @@ async def manual_ping_light_test_batch_progress(
             nodes.append(node)
     
     if not nodes:
-        return {"session_id": session_id, "message": "Нет узлов для тестирования", "started": False}
+        return {"session_id": session_id, "message": "Нет узлов для тестирования", "started": False,
+                "quarantined_skipped": quarantined_skipped}
     
     # Initialize progress tracker
     progress = ProgressTracker(session_id, len(nodes))
@@ -3671,16 +3918,24 @@ async def manual_ping_light_test_batch_progress(
     # Start background batch testing with ping_light mode
     # Получаем timeout из ping_timeouts (первое значение)
     ping_light_timeout = 2.0  # default
+    fast_timeout = PING_LIGHT_FAST_TIMEOUT
     if test_request.ping_timeouts and len(test_request.ping_timeouts) > 0:
         ping_light_timeout = test_request.ping_timeouts[0]
+        # Tiered: [быстрый, медленный] - первый и последний таймауты
+        if test_request.tiered and len(test_request.ping_timeouts) > 1:
+            fast_timeout = test_request.ping_timeouts[0]
+            ping_light_timeout = test_request.ping_timeouts[-1]
     
-    asyncio.create_task(process_ping_light_batches(
-        session_id, [n.id for n in nodes], db,
+    await start_test_job(session_id, "ping_light", [n.id for n in nodes], dict(
         ping_concurrency=test_request.ping_concurrency or 20,  # Еще выше для PING LIGHT
-        timeout=ping_light_timeout
+        timeout=ping_light_timeout,
+        timeout_mode=test_request.timeout_mode,
+        tiered=bool(test_request.tiered),
+        fast_timeout=min(fast_timeout, ping_light_timeout)
     ))
     
-    return {"session_id": session_id, "message": f"Запущено PING LIGHT тестирование {len(nodes)} узлов", "started": True}
+    return {"session_id": session_id, "message": f"Запущено PING LIGHT тестирование {len(nodes)} узлов", "started": True,
+            "quarantined_skipped": quarantined_skipped}
 
 
 @api_router.post("/manual/geo-test-batch")
@@ -3902,6 +4157,7 @@ async def manual_ping_test_batch_progress(
     
     # Если node_ids пустой - тестируем узлы по фильтрам (Select All режим)
     node_ids_to_test = test_request.node_ids or []
+    quarantined_skipped = 0
     if not node_ids_to_test:
         logger.info("🌐 PING OK BATCH: Select All mode detected - loading nodes with filters")
         query = db.query(Node)
@@ -3909,10 +4165,21 @@ async def manual_ping_test_batch_progress(
         if test_request.filters:
             query = apply_node_filters(query, test_request.filters)
             logger.info(f"🔍 PING OK BATCH: Applying filters: {test_request.filters}")
-        all_nodes = query.all()
-        node_ids_to_test = [node.id for node in all_nodes]
+        # Узлы в карантине (серия неудач) пропускаются, кроме случайной доли на повторную проверку
+        rows = query.with_entities(Node.id, Node.next_eligible_at).all()
+        node_ids_to_test, quarantined_skipped, readmitted = plan_sweep(rows, bool(test_request.include_quarantined))
+        if quarantined_skipped or readmitted:
+            logger.info(f"🧊 PING OK BATCH: {quarantined_skipped} quarantined nodes skipped, {readmitted} re-admitted")
         logger.info(f"📊 PING OK BATCH: Will test {len(node_ids_to_test)} nodes (with filters)")
     
+    if test_request.preflight:
+        active_sessions.discard(session_id)
+        estimate = await run_batch_preflight(db, node_ids_to_test, test_request,
+                                             timeout=(test_request.ping_timeouts or [0.8])[0],
+                                             concurrency=min(test_request.ping_concurrency or 15, global_ping_sem.limit))
+        return {"session_id": None, "started": False, "preflight": estimate,
+                "quarantined_skipped": quarantined_skipped}
+    
     # Get all valid nodes
     nodes = []
     for node_id in node_ids_to_test:
@@ -3921,23 +4188,26 @@ async def manual_ping_test_batch_progress(
             nodes.append(node)
     
     if not nodes:
-        return {"session_id": session_id, "message": "Нет узлов для тестирования", "started": False}
+        return {"session_id": session_id, "message": "Нет узлов для тестирования", "started": False,
+                "quarantined_skipped": quarantined_skipped}
     
     # Initialize progress tracker
     progress = ProgressTracker(session_id, len(nodes))
     progress.update(0, f"Начинаем ping тестирование {len(nodes)} узлов...")
     
     # Start background batch testing
-    asyncio.create_task(process_testing_batches(
-        session_id, [n.id for n in nodes], "ping_only", db,
+    await start_test_job(session_id, "testing", [n.id for n in nodes], dict(
+        testing_mode="ping_only",
         ping_concurrency=test_request.ping_concurrency or 15,  # АГРЕССИВНО увеличено
         speed_concurrency=test_request.speed_concurrency or 8,   # АГРЕССИВНО увеличено
         ping_timeouts=test_request.ping_timeouts or [0.8,1.2,1.6],
         speed_sample_kb=test_request.speed_sample_kb or 512,
-        speed_timeout=test_request.speed_timeout or 15
+        speed_timeout=test_request.speed_timeout or 15,
+        timeout_mode=test_request.timeout_mode
     ))
     
-    return {"session_id": session_id, "message": f"Запущено тестирование {len(nodes)} узлов", "started": True}
+    return {"session_id": session_id, "message": f"Запущено тестирование {len(nodes)} узлов", "started": True,
+            "quarantined_skipped": quarantined_skipped}
 
 @api_router.post("/manual/speed-test-batch-progress")
 async def manual_speed_test_batch_progress(
@@ -3986,13 +4256,14 @@ async def manual_speed_test_batch_progress(
     progress.update(0, f"Начинаем speed тестирование {len(nodes)} узлов...")
     
     # Start background batch testing
-    asyncio.create_task(process_testing_batches(
-        session_id, [n.id for n in nodes], "speed_only", db,
+    await start_test_job(session_id, "testing", [n.id for n in nodes], dict(
+        testing_mode="speed_only",
         ping_concurrency=test_request.ping_concurrency or 15,  # АГРЕССИВНО увеличено
         speed_concurrency=test_request.speed_concurrency or 8,   # АГРЕССИВНО увеличено
         ping_timeouts=test_request.ping_timeouts or [0.8,1.2,1.6],
         speed_sample_kb=test_request.speed_sample_kb or 512,
-        speed_timeout=test_request.speed_timeout or 15
+        speed_timeout=test_request.speed_timeout or 15,
+        timeout_mode=test_request.timeout_mode
     ))
     
     return {"session_id": session_id, "message": f"Запущено тестирование {len(nodes)} узлов", "started": True}
@@ -4015,13 +4286,14 @@ async def manual_ping_speed_test_batch_progress(
         return {"session_id": session_id, "message": "Нет узлов для тестирования", "started": False}
     progress = ProgressTracker(session_id, len(nodes))
     progress.update(0, f"Запуск speed-тестирования {len(nodes)} узлов (замена ping+speed)")
-    asyncio.create_task(process_testing_batches(
-        session_id, [n.id for n in nodes], "speed_only", db,
+    await start_test_job(session_id, "testing", [n.id for n in nodes], dict(
+        testing_mode="speed_only",
         ping_concurrency=test_request.ping_concurrency or 15,  # АГРЕССИВНО увеличено
         speed_concurrency=test_request.speed_concurrency or 8,   # АГРЕССИВНО увеличено
         ping_timeouts=test_request.ping_timeouts or [0.8,1.2,1.6],
         speed_sample_kb=test_request.speed_sample_kb or 512,
-        speed_timeout=test_request.speed_timeout or 15
+        speed_timeout=test_request.speed_timeout or 15,
+        timeout_mode=test_request.timeout_mode
     ))
     return {"session_id": session_id, "message": f"Запущено тестирование {len(nodes)} узлов (speed)", "started": True}
 
@@ -4030,255 +4302,275 @@ async def process_testing_batches(session_id: str, node_ids: list, testing_mode:
                                   speed_concurrency: int = 8,   # АГРЕССИВНО увеличено для скорости  
                                   ping_timeouts: list[float] | None = None,
                                   speed_sample_kb: int = 32,    # МИНИМИЗИРОВАНО для максимальной скорости
-                                  speed_timeout: int = 2):      # ЭКСТРЕМАЛЬНО быстро
-    """Process testing in batches for any test type with concurrency controls"""
+                                  speed_timeout: int = 2,       # ЭКСТРЕМАЛЬНО быстро
+                                  timeout_mode: str | None = None):
+    """Process testing for any test type with concurrency controls.
+    A pool of ping_concurrency / speed_concurrency workers pulls node ids from one queue
+    (concurrency_control.run_worker_pool), so the session stays at its limit until the queue drains.
+    timeout_mode="adaptive" derives each ping timeout from the node's RTT history (rtt_estimator)."""
     
     total_nodes = len(node_ids)
-    # АГРЕССИВНЫЕ большие батчи для максимальной скорости
-    if total_nodes < 100:
-        BATCH_SIZE = 50   # Большие батчи даже для малых объемов
-    elif total_nodes < 500:
-        BATCH_SIZE = 100  # Большие батчи
-    elif total_nodes < 1000:
-        BATCH_SIZE = 200  # Очень большие батчи
-    else:
-        BATCH_SIZE = 300  # МАКСИМАЛЬНЫЕ батчи для скорости
+    DEDUPE_CLEANUP_EVERY = 200  # finished nodes between dedupe registry cleanups
     processed_nodes = 0
     failed_tests = 0
 
     if ping_timeouts is None:
         ping_timeouts = [0.5]  # СВЕРХ-БЫСТРЫЙ единственный таймаут
+    job_status = "completed"
     
     try:
         # Get fresh database session for background processing
         db = SessionLocal()
         
-        logger.info(f"🚀 Testing Batch: Starting {total_nodes} nodes in batches of {BATCH_SIZE}, mode: {testing_mode}")
-        
         # Import testing functions
         from ping_speed_test import test_node_ping, test_node_speed
         
-        # Process nodes in batches
-        for batch_start in range(0, total_nodes, BATCH_SIZE):
-            batch_end = min(batch_start + BATCH_SIZE, total_nodes)
-            current_batch = node_ids[batch_start:batch_end]
-            
-            logger.info(f"📦 Testing batch {batch_start//BATCH_SIZE + 1}: nodes {batch_start+1}-{batch_end}")
-            
-            # Check if operation was cancelled
-            if session_id in progress_store and progress_store[session_id].status == "cancelled":
-                logger.info(f"🚫 Testing cancelled by user for session {session_id}")
-                break
-            
-            # Process current batch with concurrency
-            # Choose global semaphore by mode
-            global_sem = global_ping_sem if testing_mode == "ping_only" else global_speed_sem
-            
-            # Combine global limiter + session limiter
-            session_sem = asyncio.Semaphore(ping_concurrency if testing_mode == "ping_only" else speed_concurrency)
-            sem = session_sem
-            tasks = []
+        if session_id in progress_store:
+            progress_store[session_id].limiter = global_ping_sem if testing_mode == "ping_only" else global_speed_sem
+        
+        # Порядок round-robin по /24 подсетям вместо подряд идущих диапазонов импорта
+        ip_by_id = {}
+        for chunk_start in range(0, total_nodes, 500):
+            chunk = node_ids[chunk_start:chunk_start + 500]
+            ip_by_id.update(db.query(Node.id, Node.ip).filter(Node.id.in_(chunk)).all())
+        node_ids = interleave_by_prefix(node_ids, ip_by_id.get)
+        
+        # Choose global semaphore by mode
+        global_sem = global_ping_sem if testing_mode == "ping_only" else global_speed_sem
+        pool_size = ping_concurrency if testing_mode == "ping_only" else speed_concurrency
+
+        async def process_one(node_id: int, global_index: int):
+            # Per-prefix cap first, then the global AIMD limiter (the pool size is the session limit)
+            async with prefix_limiter.slot(ip_by_id.get(node_id)), global_sem:
+                local_db = SessionLocal()
+                node = None
+                try:
+                    node = local_db.query(Node).filter(Node.id == node_id).first()
+                    if not node:
+                        logger.warning(f"❌ Testing batch: Node {node_id} not found in database")
+                        return False
+
+                    # Dedupe check is done before scheduling; optional extra safety
+                    mode_key = "ping" if testing_mode in ["ping_only", "ping_speed"] else ("speed" if testing_mode in ["speed_only"] else testing_mode)
+
+                    # Update progress: starting this node (processed_items only moves on completion)
+                    if session_id in progress_store:
+                        progress_store[session_id].current_task = f"Тестирование {node.ip} ({global_index+1}/{total_nodes})"
+
+                    original_status = node.status
+                    logger.info(f"🔍 Testing batch: Node {node.id} ({node.ip}) original status: {original_status}")
+
+                    # Decide actions
+                    do_ping = False
+                    do_speed = False
+                    if testing_mode == "ping_only":
+                        do_ping = not has_ping_baseline(original_status)
+                    elif testing_mode == "speed_only":
+                        do_speed = (original_status != "ping_failed")
+                    else:
+                        # Treat any other as skip
+                        return True
 
-            async def process_one(node_id: int, global_index: int):
-                async with global_sem:
-                    async with sem:
-                        local_db = SessionLocal()
+                    # Skip if no action
+                    if not (do_ping or do_speed):
+                        progress_increment(session_id, f"⏭️ {node.ip} - skipped ({original_status})", {"node_id": node.id, "ip": node.ip, "status": original_status, "success": True})
+                        return True
+
+                    # Do ping
+                    if do_ping:
                         try:
-                            node = local_db.query(Node).filter(Node.id == node_id).first()
-                            if not node:
-                                logger.warning(f"❌ Testing batch: Node {node_id} not found in database")
-                                return False
-
-                            # Dedupe check is done before scheduling; optional extra safety
-                            mode_key = "ping" if testing_mode in ["ping_only", "ping_speed"] else ("speed" if testing_mode in ["speed_only"] else testing_mode)
-
-                            # Update progress: starting this node
-                            if session_id in progress_store:
-                                progress_store[session_id].update(global_index, f"Тестирование {node.ip} ({global_index+1}/{total_nodes})")
-
-                            original_status = node.status
-                            logger.info(f"🔍 Testing batch: Node {node.id} ({node.ip}) original status: {original_status}")
-
-                            # Decide actions
-                            do_ping = False
-                            do_speed = False
-                            if testing_mode == "ping_only":
-                                do_ping = not has_ping_baseline(original_status)
-                            elif testing_mode == "speed_only":
-                                do_speed = (original_status != "ping_failed")
+                            from ping_speed_test import multiport_tcp_ping
+                            ports = get_ping_ports_for_node(node)
+                            logger.info(f"🔍 Ping testing {node.ip} on ports {ports}")
+
+                            node_timeouts = [probe_timeout_for(node, ping_timeouts[0], timeout_mode)]
+                            ping_result = await multiport_tcp_ping(node.ip, ports=ports, timeouts=node_timeouts)
+                            logger.info(f"🏓 Ping result for {node.ip}: {ping_result}")
+                            remember_ping_port(node, ping_result)
+                            # Cached answers are neither new RTT samples nor load feedback
+                            if not ping_result.get('cached'):
+                                if ping_result.get('success'):
+                                    record_rtt_sample(node, ping_result['avg_time'])
+                                elif probe_timed_out(ping_result):
+                                    record_rtt_timeout(node)
+                                if not probe_local_error(ping_result):
+                                    record_reachability(node, bool(ping_result.get('success')))
+                                global_sem.record(
+                                    bool(ping_result.get('success')),
+                                    timed_out=probe_timed_out(ping_result) or probe_local_error(ping_result),
+                                    latency_ms=ping_result.get('avg_time'),
+                                )
+
+                            if probe_local_error(ping_result):
+                                # Local fd / port exhaustion: the node was not tested, keep its status
+                                node.status = original_status
+                                logger.warning(f"⚠️ {node.ip} ping not tested: {ping_result.get('message')}")
+                            elif ping_result.get('success'):
+                                node.status = "ping_ok"
+                                logger.info(f"✅ {node.ip} ping success: {ping_result.get('avg_time', 0)}ms")
+
+                                # УМНАЯ ЛОГИКА: Один запрос для гео + fraud если IPQualityScore
+                                try:
+                                    from service_manager_geo import service_manager
+                                    # Enrichment columns go out with the result via result_writer (no commit here)
+                                    complete_success = await service_manager.enrich_node_complete(node, local_db)
+                                    if complete_success:
+                                        logger.info(f"✅ Node enriched: {node.ip}")
+                                except Exception as enrich_error:
+                                    logger.warning(f"Enrichment error for {node.ip}: {enrich_error}")
                             else:
-                                # Treat any other as skip
-                                return True
+                                node.status = original_status if has_ping_baseline(original_status) else "ping_failed"
+                                logger.info(f"❌ {node.ip} ping failed: {ping_result.get('message', 'timeout')}")
 
-                            # Skip if no action
-                            if not (do_ping or do_speed):
-                                progress_increment(session_id, f"⏭️ {node.ip} - skipped ({original_status})", {"node_id": node.id, "ip": node.ip, "status": original_status, "success": True})
-                                return True
+                            node.last_update = datetime.now(timezone.utc)
+                        except Exception as ping_error:
+                            logger.error(f"❌ Ping test error for {node.ip}: {ping_error}")
+                            node.status = original_status if has_ping_baseline(original_status) else "ping_failed"
+                            node.last_update = datetime.now(timezone.utc)
 
-                            # Do ping
-                            if do_ping:
-                                try:
-                                    from ping_speed_test import multiport_tcp_ping
-                                    ports = get_ping_ports_for_node(node)
-                                    logger.info(f"🔍 Ping testing {node.ip} on ports {ports}")
-                                    
-                                    ping_result = await multiport_tcp_ping(node.ip, ports=ports, timeouts=ping_timeouts)
-                                    logger.info(f"🏓 Ping result for {node.ip}: {ping_result}")
-                                    
-                                    if ping_result.get('success'):
-                                        node.status = "ping_ok"
-                                        logger.info(f"✅ {node.ip} ping success: {ping_result.get('avg_time', 0)}ms")
-                                        
-                                        # УМНАЯ ЛОГИКА: Один запрос для гео + fraud если IPQualityScore
-                                        try:
-                                            from service_manager_geo import service_manager
-                                            complete_success = await service_manager.enrich_node_complete(node, local_db)
-                                            if complete_success:
-                                                logger.info(f"✅ Node enriched: {node.ip}")
-                                                local_db.commit()
-                                        except Exception as enrich_error:
-                                            logger.warning(f"Enrichment error for {node.ip}: {enrich_error}")
-                                    else:
-                                        node.status = original_status if has_ping_baseline(original_status) else "ping_failed"
-                                        logger.info(f"❌ {node.ip} ping failed: {ping_result.get('message', 'timeout')}")
-                                    
-                                    node.last_update = datetime.now(timezone.utc)
-                                    local_db.commit()
-                                except Exception as ping_error:
-                                    logger.error(f"❌ Ping test error for {node.ip}: {ping_error}")
-                                    node.status = original_status if has_ping_baseline(original_status) else "ping_failed"
-                                    node.last_update = datetime.now(timezone.utc)
-                                    local_db.commit()
-
-                            # Do speed
-                            if do_speed:
-                                try:
-                                    from ping_speed_test import test_node_speed
-                                    logger.info(f"🚀 Speed testing {node.ip}")
-                                    
-                                    speed_result = await test_node_speed(node.ip, sample_kb=speed_sample_kb, timeout_total=speed_timeout)
-                                    logger.info(f"📊 Speed result for {node.ip}: {speed_result}")
-                                    
-                                    # ИСПРАВЛЕНО: Проверка download_mbps (НЕ download)
-                                    if speed_result.get('success') and speed_result.get('download_mbps'):
-                                        download_speed = speed_result['download_mbps']
-                                        node.speed = f"{download_speed:.1f} Mbps"
-                                        node.status = "speed_ok" if download_speed > 1.0 else "ping_ok"
-                                        logger.info(f"✅ {node.ip} speed success: {download_speed:.1f} Mbps")
-                                    else:
-                                        node.status = "ping_ok" if has_ping_baseline(original_status) else "ping_failed"
-                                        node.speed = None
-                                        logger.info(f"❌ {node.ip} speed failed - result: {speed_result}")
-                                    
-                                    node.last_update = datetime.now(timezone.utc)
-                                    local_db.commit()
-                                except Exception as speed_error:
-                                    logger.error(f"❌ Speed test error for {node.ip}: {speed_error}")
-                                    node.status = "ping_ok" if has_ping_baseline(original_status) else "ping_failed"
-                                    node.speed = None
-                                    node.last_update = datetime.now(timezone.utc)
-                                    local_db.commit()
-
-                            node.last_check = datetime.now(timezone.utc)
-                            local_db.commit()
-
-                            # Progress
-                            progress_increment(session_id, f"✅ {node.ip} - {node.status}", {"node_id": node.id, "ip": node.ip, "status": node.status, "success": True})
-                            return True
-                        except Exception as e:
-                            logger.error(f"❌ Testing: Node {node_id} error: {e}")
-                            return False
-                        finally:
-                            try:
-                                test_dedupe_mark_finished(node_id)
-                                local_db.close()
-                            except Exception:
-                                pass
-
-            for i, node_id in enumerate(current_batch):
-                global_index = batch_start + i
-                # cancellation
-                if session_id in progress_store and progress_store[session_id].status == "cancelled":
+                    # Do speed
+                    if do_speed:
+                        try:
+                            from ping_speed_test import test_node_speed
+                            logger.info(f"🚀 Speed testing {node.ip}")
+
+                            speed_result = await test_node_speed(node.ip, sample_kb=speed_sample_kb, timeout_total=speed_timeout)
+                            logger.info(f"📊 Speed result for {node.ip}: {speed_result}")
+                            if not speed_result.get('cached'):
+                                global_sem.record(
+                                    bool(speed_result.get('success')),
+                                    timed_out='timeout' in str(speed_result.get('message', '')).lower(),
+                                    latency_ms=speed_result.get('ping_ms'),
+                                )
+
+                            # ИСПРАВЛЕНО: Проверка download_mbps (НЕ download)
+                            if speed_result.get('success') and speed_result.get('download_mbps'):
+                                download_speed = speed_result['download_mbps']
+                                node.speed = f"{download_speed:.1f} Mbps"
+                                node.status = "speed_ok" if download_speed > 1.0 else "ping_ok"
+                                logger.info(f"✅ {node.ip} speed success: {download_speed:.1f} Mbps")
+                            elif speed_result.get('success'):
+                                # Download не измерен (порт 1723 не отдает данные) - SPEED OK не присваивается
+                                node.status = "ping_ok"
+                                node.speed = None
+                                logger.info(f"⚠️ {node.ip} speed: download not measured, "
+                                            f"upload {speed_result.get('upload_mbps')} Mbps - status stays ping_ok")
+                            else:
+                                node.status = "ping_ok" if has_ping_baseline(original_status) else "ping_failed"
+                                node.speed = None
+                                logger.info(f"❌ {node.ip} speed failed - result: {speed_result}")
+
+                            node.last_update = datetime.now(timezone.utc)
+                        except Exception as speed_error:
+                            logger.error(f"❌ Speed test error for {node.ip}: {speed_error}")
+                            node.status = "ping_ok" if has_ping_baseline(original_status) else "ping_failed"
+                            node.speed = None
+                            node.last_update = datetime.now(timezone.utc)
+
+                    node.last_check = datetime.now(timezone.utc)
+
+                    # Progress
+                    progress_increment(session_id, f"✅ {node.ip} - {node.status}", {"node_id": node.id, "ip": node.ip, "status": node.status, "success": True})
+                    return True
+                except Exception as e:
+                    logger.error(f"❌ Testing: Node {node_id} error: {e}")
+                    return False
+                finally:
+                    try:
+                        test_dedupe_mark_finished(node_id)
+                        # Results go through the write-behind writer; the session is closed uncommitted
+                        if node is not None:
+                            result_writer.submit_node(node)
+                        local_db.close()
+                    except Exception:
+                        pass
+
+        async def schedule_one(item) -> bool | None:
+            """Dedupe check + test of one node; None when the node was skipped"""
+            global_index, node_id = item
+            # Определить какие типы тестов будут выполняться
+            mode_keys = []
+            if testing_mode in ["ping_only", "ping_speed"]:
+                mode_keys.append("ping")
+            if testing_mode in ["speed_only", "ping_speed"]:
+                mode_keys.append("speed")
+            if not mode_keys:  # Для остальных режимов (no_test и т.д.)
+                mode_keys.append(testing_mode)
+
+            # Проверить дедупликацию для ВСЕХ типов тестов
+            should_skip = False
+            skip_reason = ""
+            remaining_time = 0
+            for mode_key in mode_keys:
+                if test_dedupe_should_skip(node_id, mode_key):
+                    skip_reason = mode_key
+                    remaining_time = test_dedupe_get_remaining_time(node_id, mode_key)
+                    should_skip = True
                     break
-                
-                # Определить какие типы тестов будут выполняться
-                mode_keys = []
-                if testing_mode in ["ping_only", "ping_speed"]:
-                    mode_keys.append("ping")
-                if testing_mode in ["speed_only", "ping_speed"]:
-                    mode_keys.append("speed")
-                if not mode_keys:  # Для остальных режимов (no_test и т.д.)
-                    mode_keys.append(testing_mode)
-                
-                # Проверить дедупликацию для ВСЕХ типов тестов
-                should_skip = False
-                skip_reason = ""
-                remaining_time = 0
-                for mode_key in mode_keys:
-                    if test_dedupe_should_skip(node_id, mode_key):
-                        skip_reason = mode_key
-                        remaining_time = test_dedupe_get_remaining_time(node_id, mode_key)
-                        should_skip = True
-                        break
-                
-                if should_skip:
-                    logger.info(f"⏭️ Testing: Skipping node {node_id} (dedupe {skip_reason}, wait {remaining_time}s)")
-                    progress_increment(session_id, f"⏭️ Узел {node_id} недавно тестировался ({skip_reason}), подождите {remaining_time}с")
-                    # Очистить из inflight и _test_recent если время истекло (wait 0s)
-                    if remaining_time == 0:
-                        _test_inflight.discard(node_id)
-                        # Удалить из _test_recent для всех mode
-                        for mk in mode_keys:
-                            _test_recent.pop((node_id, mk), None)
-                    continue
-                
-                # Отметить все типы тестов в dedupe
-                for mode_key in mode_keys:
-                    test_dedupe_mark_enqueued(node_id, mode_key)
-                
-                tasks.append(asyncio.create_task(process_one(node_id, global_index)))
 
-            if tasks:
-                results = await asyncio.gather(*tasks, return_exceptions=True)
-                # Update counters
-                processed_nodes += sum(1 for r in results if r is True)
-                failed_tests += sum(1 for r in results if r is False)
-            
-            # Small delay between batches to prevent system overload
-            await asyncio.sleep(0.5)
-            
-            logger.info(f"✅ Testing batch {batch_start//BATCH_SIZE + 1} completed: {len(current_batch)} nodes scheduled")
-            
-            # Cleanup dedupe registry periodically (outside inner loops)
-            try:
-                test_dedupe_cleanup()
-            except Exception:
-                pass
-            
-            # Force commit after each batch and clear session cache
-            try:
-                db.commit()
-                db.expunge_all()  # Clear session cache to free memory
-            except Exception as commit_error:
-                logger.error(f"❌ Testing batch commit error: {commit_error}")
-                db.rollback()
-            
-            # БЕЗ задержек для максимальной скорости
-            # await asyncio.sleep(0)  # Убрано для скорости
-            
-            logger.info(f"✅ Testing batch {batch_start//BATCH_SIZE + 1} completed: {len(current_batch)} nodes processed")
+            if should_skip:
+                logger.info(f"⏭️ Testing: Skipping node {node_id} (dedupe {skip_reason}, wait {remaining_time}s)")
+                progress_increment(session_id, f"⏭️ Узел {node_id} недавно тестировался ({skip_reason}), подождите {remaining_time}с")
+                # Очистить из inflight и _test_recent если время истекло (wait 0s)
+                if remaining_time == 0:
+                    _test_inflight.discard(node_id)
+                    # Удалить из _test_recent для всех mode
+                    for mk in mode_keys:
+                        _test_recent.pop((node_id, mk), None)
+                return None
+
+            # Отметить все типы тестов в dedupe
+            for mode_key in mode_keys:
+                test_dedupe_mark_enqueued(node_id, mode_key)
+
+            return await process_one(node_id, global_index)
+
+        def is_cancelled() -> bool:
+            return session_id in progress_store and progress_store[session_id].status == "cancelled"
+
+        def count_result(item, result):
+            nonlocal processed_nodes, failed_tests
+            if result is True:
+                processed_nodes += 1
+            elif result is False or isinstance(result, Exception):
+                failed_tests += 1
+            test_job_store.mark_done(session_id, item[1], result is True)
+            if result is not None and (processed_nodes + failed_tests) % DEDUPE_CLEANUP_EVERY == 0:
+                try:
+                    test_dedupe_cleanup()
+                except Exception:
+                    pass
+
+        # Скользящее окно вместо батчей: pool_size воркеров берут узлы из общей очереди,
+        # медленный узел занимает один воркер, а не задерживает весь следующий батч
+        logger.info(f"🚀 Testing: {pool_size} workers over {total_nodes} nodes, mode: {testing_mode}")
+        await run_worker_pool(enumerate(node_ids), schedule_one, pool_size,
+                              should_stop=is_cancelled, on_result=count_result)
+        if is_cancelled():
+            logger.info(f"🚫 Testing cancelled by user for session {session_id}")
+
     
+    except asyncio.CancelledError:
+        job_status = None  # Shutdown: the job stays "running" and resumes on the next startup
+        raise
     except Exception as e:
         logger.error(f"❌ Testing batch processing error: {str(e)}", exc_info=True)
+        job_status = "failed"
         if session_id in progress_store:
             progress_store[session_id].complete("failed")
     
     finally:
+        # Queued node results must be in the database before the session reports completion
+        await result_writer.flush()
+        if job_status == "completed" and session_id in progress_store and progress_store[session_id].status == "cancelled":
+            job_status = "cancelled"
+        if job_status:
+            await test_job_store.finish(session_id, job_status)
         # Complete progress tracking
         if session_id in progress_store:
             progress_store[session_id].complete("completed")
             progress_store[session_id].update(
-                total_nodes, 
+                progress_store[session_id].total_items,  # Resumed jobs run only the remaining nodes
                 f"Тестирование завершено: {processed_nodes} успешно, {failed_tests} ошибок"
             )
         
@@ -4302,150 +4594,231 @@ async def process_testing_batches(session_id: str, node_ids: list, testing_mode:
         logger.info(f"📊 Testing batch processing completed: {processed_nodes} processed, {failed_tests} failed")
 
 async def process_ping_light_batches(session_id: str, node_ids: list, db_session, *,
-                                      ping_concurrency: int = 100, timeout: float = 2.0):
-    """Process PING LIGHT testing in batches - быстрая проверка TCP порта без авторизации с повышенным параллелизмом"""
+                                      ping_concurrency: int = 100, timeout: float = 2.0,
+                                      timeout_mode: str | None = None,
+                                      tiered: bool = False, fast_timeout: float = PING_LIGHT_FAST_TIMEOUT):
+    """Process PING LIGHT testing - быстрая проверка TCP порта без авторизации.
+    Probes go through the shared selector-based tcp_scanner (thousands of connects in flight),
+    or through PROBE_WORKERS worker processes each running its own scanner (sharded_executor);
+    each pass is one continuous scan whose results stream into a pool of ping_concurrency
+    result handlers (DB update + geolocation) - no per-batch barriers.
+    timeout_mode="adaptive" gives every node its own timeout from its RTT history.
+    tiered=True: pass 1 probes every node with fast_timeout, pass 2 re-probes only the nodes
+    that timed out (refused ones are final) with the full timeout, both into the same session.
+    Nodes sharing an IP (different credentials) are probed once per pass and share the result."""
     
     total_nodes = len(node_ids)
-    # АГРЕССИВНЫЕ большие батчи для максимальной скорости PING LIGHT
-    if total_nodes < 100:
-        BATCH_SIZE = 100   # Большие батчи даже для малых объемов
-    elif total_nodes < 1000:
-        BATCH_SIZE = 300   # Очень большие батчи
-    else:
-        BATCH_SIZE = 500   # МАКСИМАЛЬНЫЕ батчи для PING LIGHT
+    QUERY_CHUNK = 1000  # node rows loaded per query when planning a pass
     
     processed_nodes = 0
     failed_tests = 0
+    job_status = "completed"
     
     try:
         # Get fresh database session for background processing
         db = SessionLocal()
         
-        logger.info(f"🚀 PING LIGHT Batch: Starting {total_nodes} nodes in batches of {BATCH_SIZE}")
+        logger.info(f"🚀 PING LIGHT Batch: Starting {total_nodes} nodes"
+                    f"{' (tiered: %.1fs, then %.1fs for timeouts)' % (fast_timeout, timeout) if tiered else ''}")
         
-        # Import testing functions
-        from ping_speed_test import test_node_ping_light
+        from ping_speed_test import ping_light_result_from_scan
+        from tcp_scanner import ScanTarget
         
-        # Process nodes in batches
-        for batch_start in range(0, total_nodes, BATCH_SIZE):
-            batch_end = min(batch_start + BATCH_SIZE, total_nodes)
-            current_batch = node_ids[batch_start:batch_end]
-            
-            logger.info(f"📦 PING LIGHT batch {batch_start//BATCH_SIZE + 1}: nodes {batch_start+1}-{batch_end}")
-            
-            # Check if operation was cancelled
-            if session_id in progress_store and progress_store[session_id].status == "cancelled":
-                logger.info(f"🚫 PING LIGHT testing cancelled by user for session {session_id}")
-                break
-            
-            # Process current batch with concurrency (используем специальный семафор для PING LIGHT)
-            session_sem = asyncio.Semaphore(min(ping_concurrency, MAX_PING_LIGHT_GLOBAL))
-            tasks = []
-
-            async def process_one(node_id: int, global_index: int):
-                async with session_sem:
-                    local_db = SessionLocal()
-                    try:
-                        node = local_db.query(Node).filter(Node.id == node_id).first()
-                        if not node:
-                            logger.warning(f"❌ PING LIGHT batch: Node {node_id} not found in database")
-                            return False
-
-                        # Update progress: starting this node
-                        if session_id in progress_store:
-                            progress_store[session_id].update(global_index, f"PING LIGHT тест {node.ip} ({global_index+1}/{total_nodes})")
-
-                        original_status = node.status
-                        logger.info(f"🔍 PING LIGHT batch: Node {node.id} ({node.ip}) original status: {original_status}")
+        if session_id in progress_store:
+            progress_store[session_id].limiter = global_ping_light_sem
+        ensure_yield_model_seeded(db)
+        
+        # Обработчики результатов (БД + геолокация): пул из ping_concurrency воркеров
+        handler_count = min(ping_concurrency, MAX_PING_LIGHT_GLOBAL)
+        timeout_by_id = {}
 
-                        # Выполнить PING LIGHT тест с заданным timeout
-                        ping_result = await test_node_ping_light(node.ip, timeout=timeout)
-                        
-                        # Обновить статус на основе результата (С ЗАЩИТОЙ для ping_light)
-                        if ping_result['success']:
-                            node.status = "ping_light"
-                            logger.info(f"✅ PING LIGHT batch: Node {node_id} SUCCESS - status: {original_status} -> ping_light")
-                            success = True
-                            
-                            # IP Геолокация (если поля пустые) - через service manager
-                            try:
-                                from service_manager_geo import service_manager
-                                geo_success = await service_manager.enrich_node_geolocation(node, local_db)
-                                if geo_success:
-                                    logger.info(f"🌍 Geolocation enriched for {node.ip}")
-                                    local_db.commit()
-                            except Exception as geo_error:
-                                logger.warning(f"Geolocation error for {node.ip}: {geo_error}")
-                        else:
-                            # ЗАЩИТА: если уже был ping_light (порт работал хотя бы раз), сохраняем статус
-                            if original_status in ("ping_light", "ping_ok", "speed_ok", "online"):
-                                node.status = original_status  # Сохраняем! Не откатываем до ping_failed
-                                logger.info(f"🛡️ PING LIGHT batch: Node {node_id} FAILED but preserving status {original_status}")
-                            else:
-                                node.status = "ping_failed"
-                                logger.info(f"❌ PING LIGHT batch: Node {node_id} FAILED - status: {original_status} -> ping_failed")
-                            success = False
-                        
-                        node.last_check = datetime.utcnow()
-                        node.last_update = datetime.utcnow()
-                        
-                        local_db.commit()
-                        
-                        # Add result to progress
-                        result_data = {
-                            "node_id": node.id,
-                            "ip": node.ip,
-                            "status": node.status,
-                            "success": success,
-                            "original_status": original_status
-                        }
-                        progress_increment(session_id, f"✅ PING LIGHT {node.ip} - {node.status}", result_data)
-                        
-                        return success
-                        
-                    except Exception as e:
-                        logger.error(f"❌ PING LIGHT batch: Error testing node {node_id}: {str(e)}")
-                        return False
-                    finally:
-                        local_db.close()
+        def is_cancelled() -> bool:
+            return session_id in progress_store and progress_store[session_id].status == "cancelled"
 
-            # Create tasks for this batch
-            for i, node_id in enumerate(current_batch):
-                global_index = batch_start + i
-                tasks.append(process_one(node_id, global_index))
+        async def process_one(node_id: int, scan_result, probe_pass: int):
+            local_db = SessionLocal()
+            try:
+                node = local_db.query(Node).filter(Node.id == node_id).first()
+                if not node:
+                    logger.warning(f"❌ PING LIGHT batch: Node {node_id} not found in database")
+                    return False
 
-            # Execute batch
-            batch_results = await asyncio.gather(*tasks, return_exceptions=True)
-            
-            # Count results
-            for result in batch_results:
-                if isinstance(result, Exception):
-                    failed_tests += 1
-                elif result is True:
+                original_status = node.status
+                ping_result = ping_light_result_from_scan(scan_result, timeout_by_id.get(node_id, timeout))
+                probe_cache.put(scan_result.ip, scan_result.port, PROBE_KIND_TCP, ping_result)
+                
+                if probe_local_error(ping_result):
+                    # Нехватка fd / портов на этом сервере - узел не проверялся, статус не трогаем
+                    logger.warning(f"⚠️ PING LIGHT batch: Node {node_id} not tested: {scan_result.error}")
+                    progress_increment(session_id, f"⚠️ PING LIGHT {node.ip} - local error {scan_result.error}", {
+                        "node_id": node.id,
+                        "ip": node.ip,
+                        "status": original_status,
+                        "success": False,
+                        "local_error": True,
+                        "original_status": original_status,
+                        "pass": probe_pass
+                    })
+                    return False
+                
+                # Обновить статус на основе результата (С ЗАЩИТОЙ для ping_light)
+                if ping_result['success']:
+                    node.status = "ping_light"
+                    record_rtt_sample(node, scan_result.rtt_ms)
+                    logger.info(f"✅ PING LIGHT batch: Node {node_id} SUCCESS - status: {original_status} -> ping_light")
+                    success = True
+                    
+                    # IP Геолокация (если поля пустые) - через service manager
+                    try:
+                        from service_manager_geo import service_manager
+                        # Geo columns go out with the result via result_writer (no commit here)
+                        geo_success = await service_manager.enrich_node_geolocation(node, local_db)
+                        if geo_success:
+                            logger.info(f"🌍 Geolocation enriched for {node.ip}")
+                    except Exception as geo_error:
+                        logger.warning(f"Geolocation error for {node.ip}: {geo_error}")
+                else:
+                    if scan_result.error == "timeout":
+                        record_rtt_timeout(node)
+                    # ЗАЩИТА: если уже был ping_light (порт работал хотя бы раз), сохраняем статус
+                    if original_status in ("ping_light", "ping_ok", "speed_ok", "online"):
+                        node.status = original_status  # Сохраняем! Не откатываем до ping_failed
+                        logger.info(f"🛡️ PING LIGHT batch: Node {node_id} FAILED but preserving status {original_status}")
+                    else:
+                        node.status = "ping_failed"
+                        logger.info(f"❌ PING LIGHT batch: Node {node_id} FAILED - status: {original_status} -> ping_failed")
+                    success = False
+                record_reachability(node, success)
+                
+                node.last_check = datetime.utcnow()
+                node.last_update = datetime.utcnow()
+                
+                # Write-behind: batched with other nodes' results instead of a commit per node
+                result_writer.submit_node(node)
+                
+                # Add result to progress
+                result_data = {
+                    "node_id": node.id,
+                    "ip": node.ip,
+                    "status": node.status,
+                    "success": success,
+                    "original_status": original_status,
+                    "pass": probe_pass
+                }
+                progress_increment(session_id, f"✅ PING LIGHT {node.ip} - {node.status}", result_data)
+                
+                return success
+                
+            except Exception as e:
+                logger.error(f"❌ PING LIGHT batch: Error testing node {node_id}: {str(e)}")
+                return False
+            finally:
+                local_db.close()
+
+        async def run_pass(pass_ids: list, pass_timeout: float, pass_timeout_mode: str | None,
+                           probe_pass: int, defer_timeouts: bool) -> list:
+            """Probe each unique endpoint of pass_ids once and fan the result out to every node
+            sharing it; returns timed-out node ids when defer_timeouts is set"""
+            nonlocal processed_nodes, failed_tests
+            deferred = []
+
+            # План: node ids сгруппированы по endpoint (ip:1723) - один connect на группу
+            endpoints = {}
+            features_by_ip = {}
+            for chunk_start in range(0, len(pass_ids), QUERY_CHUNK):
+                chunk = pass_ids[chunk_start:chunk_start + QUERY_CHUNK]
+                rows = (db.query(Node.id, Node.ip, Node.rtt_srtt, Node.rtt_var, Node.rtt_backoff, Node.provider, Node.country)
+                        .filter(Node.id.in_(chunk)).all())
+                for row in rows:
+                    timeout_by_id[row.id] = probe_timeout_for(row, pass_timeout, pass_timeout_mode)
+                    endpoints.setdefault(row.ip, []).append(row.id)
+                    features_by_ip.setdefault(row.ip, (row.provider, row.country, row.ip))
+                failed_tests += len(chunk) - len(rows)
+            # Сначала вероятно живые (история провайдера / подсети / страны),
+            # внутри уровня чередуем /24 подсети, чтобы не бить пачкой SYN в один диапазон
+            endpoint_ips, alive_probabilities = yield_model.order(list(endpoints), features_by_ip.__getitem__)
+            if probe_pass == 1 and session_id in progress_store:
+                progress_store[session_id].expected_yield = expected_yield_curve(
+                    alive_probabilities, [len(endpoints[ip]) for ip in endpoint_ips])
+            if len(endpoint_ips) < len(pass_ids):
+                logger.info(f"🔗 PING LIGHT pass {probe_pass}: {len(pass_ids)} nodes share "
+                            f"{len(endpoint_ips)} unique endpoints")
+
+            # Общий endpoint получает самый длинный таймаут своей группы
+            targets = [ScanTarget(ip, ip, 1723, max(timeout_by_id[node_id] for node_id in endpoints[ip]))
+                       for ip in endpoint_ips]
+
+            async def node_results():
+                """One continuous scan for the whole pass; results arrive as connects complete"""
+                async with aclosing(probe_engine().scan(targets, max_in_flight=global_ping_light_sem)) as results:
+                    async for scan_result in results:
+                        global_ping_light_sem.record(scan_result.success,
+                                                     timed_out=scan_result.error == "timeout" or is_local_error(scan_result.error),
+                                                     latency_ms=scan_result.rtt_ms)
+                        group = endpoints[scan_result.key]
+                        if defer_timeouts and scan_result.error == "timeout":
+                            deferred.extend(group)
+                            continue
+                        # Статусные правила применяются к каждому узлу группы отдельно
+                        for node_id in group:
+                            yield node_id, scan_result
+                        if is_cancelled():
+                            return
+
+            def count_result(item, result):
+                nonlocal processed_nodes, failed_tests
+                if result is True:
                     processed_nodes += 1
                 else:
                     failed_tests += 1
-            
-            # Commit batch changes
-            try:
-                db.commit()
-            except Exception as commit_error:
-                logger.error(f"❌ PING LIGHT batch commit error: {commit_error}")
-                db.rollback()
-            
-            logger.info(f"✅ PING LIGHT batch {batch_start//BATCH_SIZE + 1} completed: {len(current_batch)} nodes processed")
+                test_job_store.mark_done(session_id, item[0], result is True)
+
+            logger.info(f"📦 PING LIGHT pass {probe_pass}: {len(targets)} endpoints, {handler_count} result handlers")
+            handled = await run_worker_pool(node_results(), lambda item: process_one(item[0], item[1], probe_pass),
+                                            handler_count, should_stop=is_cancelled, on_result=count_result)
+            if is_cancelled():
+                logger.info(f"🚫 PING LIGHT testing cancelled by user for session {session_id}")
+
+            # Pass 2 plans from fresh RTT estimates - land this pass's results first
+            await result_writer.flush()
+
+            logger.info(f"✅ PING LIGHT pass {probe_pass} completed: {handled} nodes processed")
+            return deferred
+
+        if tiered:
+            # Pass 1: короткий таймаут для всех, таймауты откладываем на pass 2
+            retry_ids = await run_pass(node_ids, fast_timeout, timeout_mode, 1, True)
+            if retry_ids and not is_cancelled():
+                logger.info(f"🔁 PING LIGHT pass 2: re-probing {len(retry_ids)} timed-out nodes with {timeout}s")
+                if session_id in progress_store:
+                    tracker = progress_store[session_id]
+                    tracker.update(tracker.processed_items,
+                                   f"PING LIGHT pass 2: повтор {len(retry_ids)} узлов с таймаутом {timeout}s")
+                # Pass 2 всегда с полным фиксированным таймаутом - адаптивный уже не успел
+                await run_pass(retry_ids, timeout, None, 2, False)
+        else:
+            await run_pass(node_ids, timeout, timeout_mode, 1, False)
     
+    except asyncio.CancelledError:
+        job_status = None  # Shutdown: the job stays "running" and resumes on the next startup
+        raise
     except Exception as e:
         logger.error(f"❌ PING LIGHT batch processing error: {str(e)}", exc_info=True)
+        job_status = "failed"
         if session_id in progress_store:
             progress_store[session_id].complete("failed")
     
     finally:
+        await result_writer.flush()
+        if job_status == "completed" and session_id in progress_store and progress_store[session_id].status == "cancelled":
+            job_status = "cancelled"
+        if job_status:
+            await test_job_store.finish(session_id, job_status)
         # Complete progress tracking
         if session_id in progress_store:
             progress_store[session_id].complete("completed")
             progress_store[session_id].update(
-                total_nodes, 
+                progress_store[session_id].total_items,  # Resumed jobs run only the remaining nodes
                 f"PING LIGHT тестирование завершено: {processed_nodes} успешно, {failed_tests} ошибок"
             )
         
@@ -4482,15 +4855,39 @@ async def manual_ping_speed_test_batch(
         
         try:
             # Step 1: Ping test
+            status_before_check = node.status
             node.status = "checking"
             node.last_check = datetime.utcnow()
             node.last_update = datetime.utcnow()
             db.commit()
             
-            # New single-port multi-timeout TCP ping
+            # Multi-port TCP ping (all candidate ports raced at once)
             from ping_speed_test import multiport_tcp_ping
             ports = get_ping_ports_for_node(node)
             ping_result = await multiport_tcp_ping(node.ip, ports=ports, timeouts=[0.8, 1.2, 1.6])
+            remember_ping_port(node, ping_result)
+            if ping_result and not ping_result.get('cached') and not probe_local_error(ping_result):
+                if ping_result.get('success'):
+                    record_rtt_sample(node, ping_result['avg_time'])
+                elif probe_timed_out(ping_result):
+                    record_rtt_timeout(node)
+                record_reachability(node, bool(ping_result.get('success')))
+            
+            if probe_local_error(ping_result):
+                # Local fd / port exhaustion: the node was not tested, put its status back
+                node.status = status_before_check
+                node.last_update = datetime.utcnow()
+                db.commit()
+                return {
+                    "node_id": node.id,
+                    "ip": node.ip,
+                    "success": False,
+                    "local_error": True,
+                    "status": node.status,
+                    "original_status": original_status,
+                    "ping_result": ping_result,
+                    "message": f"Ping not tested: {ping_result.get('message')}"
+                }
             
             if not ping_result or not ping_result.get('success', False):
                 # Ping failed - never drop below PING OK baseline
@@ -4537,10 +4934,13 @@ async def manual_ping_speed_test_batch(
             )
             
             # Update final status based on speed result
-            if speed_result and speed_result.get('success', False):
-                # On successful speed test, ensure baseline PING OK and set SPEED OK
+            if speed_result and speed_result.get('success', False) and speed_result.get('download_mbps'):
+                # On a measured download, ensure baseline PING OK and set SPEED OK
                 node.status = "speed_ok"
-                node.speed = f"{speed_result.get('download', 0)} Mbps"
+                node.speed = f"{speed_result['download_mbps']:.1f} Mbps"
+            elif speed_result and speed_result.get('success', False):
+                # Reachable, but download not measured - no SPEED OK from an unmeasured figure
+                node.status = "ping_ok"
             else:
                 # Speed failed: downgrade from SPEED OK only to PING OK; never to PING FAILED
                 if has_ping_baseline(original_status):
@@ -4735,6 +5135,60 @@ async def manual_speed_test(
     
     return {"results": results}
 
+@api_router.post("/manual/tunnel-speed-test")
+async def manual_tunnel_speed_test(
+    test_request: TestRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Speed through the node's own ppp tunnel against TUNNEL_SPEED_SINK (tunnel_speed).
+    Nodes need an established tunnel (ppp_interface); tunnels are measured concurrently
+    within TUNNEL_SPEED_SLOTS. Success -> speed_ok (> 1 Mbps) / ping_ok, failure keeps status:
+    a failed tunnel-side measurement can be the sink's fault, not the node's."""
+    results = []
+    interfaces = {}
+    nodes = {}
+    for node_id in test_request.node_ids:
+        node = db.query(Node).filter(Node.id == node_id).first()
+        if not node:
+            results.append({"node_id": node_id, "success": False, "message": "Node not found"})
+        elif not node.ppp_interface:
+            results.append({"node_id": node_id, "ip": node.ip, "success": False, "status": node.status,
+                            "message": "No active tunnel (ppp_interface not set)"})
+        else:
+            nodes[node_id] = node
+            interfaces[node_id] = node.ppp_interface
+
+    measurements = await tunnel_speed_tester.measure_many(interfaces) if interfaces else {}
+    for node_id, speed_result in measurements.items():
+        node = nodes[node_id]
+        if speed_result.get('success'):
+            download_speed = speed_result['download_mbps']
+            node.speed = f"{download_speed:.1f} Mbps"
+            node.status = "speed_ok" if download_speed > 1.0 else "ping_ok"
+        node.last_check = datetime.utcnow()
+        node.last_update = datetime.utcnow()
+        results.append({
+            "node_id": node_id,
+            "ip": node.ip,
+            "success": bool(speed_result.get('success')),
+            "status": node.status,
+            "speed": node.speed,
+            "speed_result": speed_result,
+            "message": speed_result.get('message', '')
+        })
+    try:
+        db.commit()
+    except Exception as commit_error:
+        logger.error(f"Tunnel speed test commit error: {commit_error}")
+
+    return {"results": results}
+
+@api_router.get("/tunnel-speed/status")
+async def get_tunnel_speed_status(current_user: User = Depends(get_current_user)):
+    """Tunnel speed sink, slot usage and measurement counters"""
+    return tunnel_speed_tester.get_stats()
+
 @api_router.post("/manual/launch-services")
 async def manual_launch_services(
     test_request: TestRequest,
@@ -5351,4 +5805,4 @@ async def health_check():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    uvicorn.run(app, host="0.0.0.0", port=8001, loop=uvicorn_loop_setting())
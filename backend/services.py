@@ -7,6 +7,8 @@ from typing import Dict, Optional, Tuple
 import re
 from pathlib import Path
 
+from icmp_engine import icmp_ping
+
 # Directories for service configurations
 PPTP_CONFIG_DIR = Path("/etc/ppp/peers")
 SOCKS_CONFIG_DIR = Path("/etc/dante")
@@ -256,45 +258,28 @@ class NetworkTester:
     
     @staticmethod
     async def ping_test(ip: str, count: int = 4) -> Dict:
-        """Ping test with latency measurement"""
+        """Ping test with latency measurement (async ICMP engine, no process per host)"""
         try:
-            result = await asyncio.create_subprocess_exec(
-                "ping", "-c", str(count), "-W", "3", ip,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            
-            stdout, stderr = await result.communicate()
+            result = await icmp_ping(ip, count=count, timeout=3.0)
             
-            if result.returncode == 0:
-                output = stdout.decode()
-                
-                # Parse ping results
-                packet_loss = 100
-                avg_latency = 0
-                
-                # Extract packet loss
-                loss_match = re.search(r'(\d+)% packet loss', output)
-                if loss_match:
-                    packet_loss = int(loss_match.group(1))
-                
-                # Extract average latency
-                latency_match = re.search(r'rtt min/avg/max/mdev = [\d.]+/([\d.]+)/[\d.]+/[\d.]+', output)
-                if latency_match:
-                    avg_latency = float(latency_match.group(1))
-                
+            if result['received'] > 0:
                 return {
                     'success': True,
-                    'reachable': packet_loss < 100,
-                    'packet_loss': packet_loss,
-                    'avg_latency': avg_latency,
-                    'details': output
+                    'reachable': True,
+                    'packet_loss': result['packet_loss'],
+                    'avg_latency': result['avg_ms'],
+                    'min_latency': result['min_ms'],
+                    'max_latency': result['max_ms'],
+                    'details': f"{result['sent']} packets transmitted, {result['received']} received, "
+                               f"{result['packet_loss']}% packet loss, rtt min/avg/max = "
+                               f"{result['min_ms']}/{result['avg_ms']}/{result['max_ms']} ms ({result['mode']})"
                 }
             else:
                 return {
                     'success': False,
                     'reachable': False,
-                    'error': stderr.decode()
+                    'packet_loss': 100,
+                    'error': result.get('error') or f"{result['sent']} packets transmitted, 0 received"
                 }
                 
         except Exception as e:
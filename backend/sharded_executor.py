@@ -0,0 +1,327 @@
+"""
+Multi-process sharded probe executor
+Scan targets are sharded by network prefix across PROBE_WORKERS worker processes; each
+worker runs its own event loop and TCPScanner and streams compact result tuples back to
+the API process over a pipe. scan() has the same interface as tcp_scanner.TCPScanner.scan,
+so result handling (DB, progress_store, AIMD feedback) stays in the API process unchanged.
+"""
+import asyncio
+import atexit
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import zlib
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+
+from probe_scheduler import prefix_of
+from resource_governor import LOCAL_ERROR_PREFIX
+from tcp_scanner import SCANNER_MAX_IN_FLIGHT, ScanResult, ScanTarget, tcp_scanner
+
+logger = logging.getLogger("sharded_executor")
+
+# 0 = probe in-process on the API event loop (default)
+PROBE_WORKERS = int(os.environ.get('PROBE_WORKERS', 0))
+
+# Worker -> API: results are flushed in batches of this size or after this many seconds
+_RESULT_FLUSH_SIZE = 256
+_RESULT_FLUSH_INTERVAL = 0.02
+# API -> worker: targets per pipe message
+_TARGET_CHUNK = 5000
+
+
+# ==== worker process ====
+
+class _Limit:
+    """Live per-job limit read by TCPScanner on every fill"""
+    __slots__ = ("limit",)
+
+    def __init__(self, limit: int):
+        self.limit = limit
+
+
+def _worker_main(conn, index: int):
+    from event_loop import run
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        run(_worker_loop(conn, index))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _worker_loop(conn, index: int):
+    from tcp_scanner import TCPScanner
+
+    scanner = TCPScanner()
+    loop = asyncio.get_running_loop()
+    inbox: asyncio.Queue = asyncio.Queue()
+
+    def on_readable():
+        try:
+            inbox.put_nowait(conn.recv())
+        except (EOFError, OSError):
+            loop.remove_reader(conn.fileno())
+            inbox.put_nowait(None)  # API process is gone
+
+    loop.add_reader(conn.fileno(), on_readable)
+    jobs: Dict[int, asyncio.Task] = {}
+    limits: Dict[int, _Limit] = {}
+    pending: Dict[int, List[ScanTarget]] = {}
+
+    while True:
+        msg = await inbox.get()
+        if msg is None or msg[0] == "stop":
+            break
+        kind, job_id = msg[0], msg[1]
+        if kind == "scan":
+            _, _, chunk, final, limit = msg
+            pending.setdefault(job_id, []).extend(ScanTarget(*t) for t in chunk)
+            if final:
+                limits[job_id] = _Limit(limit)
+                task = asyncio.create_task(_run_job(scanner, conn, index, job_id, pending.pop(job_id), limits[job_id]))
+                task.add_done_callback(lambda _, j=job_id: (jobs.pop(j, None), limits.pop(j, None)))
+                jobs[job_id] = task
+        elif kind == "limit":
+            if job_id in limits:
+                limits[job_id].limit = msg[2]
+                scanner.wake()
+        elif kind == "cancel":
+            pending.pop(job_id, None)
+            task = jobs.get(job_id)
+            if task:
+                task.cancel()
+
+    for task in list(jobs.values()):
+        task.cancel()
+    await asyncio.gather(*jobs.values(), return_exceptions=True)
+
+
+async def _run_job(scanner, conn, index: int, job_id: int, targets: List[ScanTarget], limit: _Limit):
+    batch: List[tuple] = []
+
+    def flush():
+        nonlocal batch
+        if batch:
+            items, batch = batch, []
+            conn.send(("results", job_id, items))
+
+    async def flush_periodically():
+        # Slow tails (timeouts) must not sit in the buffer waiting for the next result
+        while True:
+            await asyncio.sleep(_RESULT_FLUSH_INTERVAL)
+            flush()
+
+    flusher = asyncio.create_task(flush_periodically())
+    cancelled = False
+    try:
+        async for r in scanner.scan(targets, max_in_flight=limit):
+            batch.append((r.key, r.success, r.rtt_ms, r.error))
+            if len(batch) >= _RESULT_FLUSH_SIZE:
+                flush()
+    except asyncio.CancelledError:
+        cancelled = True
+    finally:
+        flusher.cancel()
+        try:
+            if not cancelled:
+                flush()
+            conn.send(("done", job_id, index))
+        except (BrokenPipeError, OSError):
+            pass
+
+
+# ==== API process ====
+
+class _Worker:
+    def __init__(self, ctx, index: int):
+        self.index = index
+        self.conn, child = ctx.Pipe(duplex=True)
+        self.process = ctx.Process(target=_worker_main, args=(child, index),
+                                   name=f"probe-worker-{index}", daemon=True)
+        self.process.start()
+        child.close()
+        # conn.send() runs in executor threads as well as on the loop
+        self._send_lock = threading.Lock()
+        self.alive = True
+
+    def send(self, msg):
+        with self._send_lock:
+            self.conn.send(msg)
+
+    def stop(self):
+        self.alive = False
+        try:
+            self.send(("stop", 0))
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+
+
+class ShardedProbeExecutor:
+    """Fans scans out to worker processes, one probe engine per core"""
+
+    def __init__(self, workers: int = PROBE_WORKERS):
+        self.workers = workers
+        self._workers: List[_Worker] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._ctx = None
+        self._jobs: Dict[int, asyncio.Queue] = {}
+        self._job_ids = itertools.count(1)
+        self.stats = {
+            'jobs': 0,
+            'targets': 0,
+            'results': 0,
+            'worker_restarts': 0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    async def scan(self, targets: Iterable[ScanTarget], max_in_flight=None) -> AsyncIterator[ScanResult]:
+        """Probe all targets in the worker processes and yield results in completion order.
+        max_in_flight is split evenly between the workers that received a shard; a live
+        ``limit`` attribute (AIMD limiter) is re-read and forwarded while results stream in."""
+        targets = list(targets)
+        if not targets:
+            return
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+
+        # Whole prefixes go to one worker so its per-prefix cap stays the effective global cap
+        shards: Dict[int, List[int]] = {}
+        for index, target in enumerate(targets):
+            shard = zlib.crc32(prefix_of(target.ip).encode()) % len(self._workers)
+            shards.setdefault(shard, []).append(index)
+
+        def per_worker_limit() -> int:
+            limit = getattr(max_in_flight, 'limit', max_in_flight) or SCANNER_MAX_IN_FLIGHT
+            return max(1, limit // len(shards))
+
+        job_id = next(self._job_ids)
+        queue: asyncio.Queue = asyncio.Queue()
+        self._jobs[job_id] = queue
+        self.stats['jobs'] += 1
+        self.stats['targets'] += len(targets)
+        delivered = bytearray(len(targets))
+        running = set(shards)
+        sent_limit = per_worker_limit()
+        try:
+            for shard, indices in shards.items():
+                worker = self._workers[shard]
+                for start in range(0, len(indices), _TARGET_CHUNK):
+                    chunk = [(i,) + tuple(targets[i][1:]) for i in indices[start:start + _TARGET_CHUNK]]
+                    final = start + _TARGET_CHUNK >= len(indices)
+                    # Large shards are pickled off the loop
+                    await loop.run_in_executor(None, worker.send, ("scan", job_id, chunk, final, sent_limit))
+
+            while running:
+                msg = await queue.get()
+                kind = msg[0]
+                if kind == "results":
+                    for index, success, rtt_ms, error in msg[2]:
+                        delivered[index] = 1
+                        target = targets[index]
+                        yield ScanResult(target.key, target.ip, target.port, success, rtt_ms, error)
+                    self.stats['results'] += len(msg[2])
+                    limit = per_worker_limit()
+                    if limit != sent_limit:
+                        sent_limit = limit
+                        for shard in running:
+                            self._send_quietly(self._workers[shard], ("limit", job_id, limit))
+                elif kind == "done":
+                    running.discard(msg[2])
+                elif kind == "died" and msg[2] in running:
+                    # Worker crashed mid-scan: its undelivered targets come back as local errors
+                    running.discard(msg[2])
+                    for index in shards[msg[2]]:
+                        if not delivered[index]:
+                            target = targets[index]
+                            yield ScanResult(target.key, target.ip, target.port, False, 0.0, f"{LOCAL_ERROR_PREFIX}WorkerDied")
+        finally:
+            self._jobs.pop(job_id, None)
+            for shard in running:
+                self._send_quietly(self._workers[shard], ("cancel", job_id))
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            'workers': self.workers,
+            'alive_workers': sum(1 for w in self._workers if w.alive and w.process.is_alive()),
+            'active_jobs': len(self._jobs),
+        }
+
+    def shutdown(self):
+        for worker in self._workers:
+            if self._loop is not None and not self._loop.is_closed():
+                try:
+                    self._loop.remove_reader(worker.conn.fileno())
+                except (OSError, ValueError, RuntimeError):
+                    pass
+            worker.stop()
+        self._workers = []
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._workers and self._loop is loop:
+            for i, worker in enumerate(self._workers):
+                if not worker.alive:
+                    self._workers[i] = self._spawn(i)
+                    self.stats['worker_restarts'] += 1
+            return
+        self.shutdown()
+        self._loop = loop
+        # spawn: workers must not inherit the API process' event loop and threads
+        self._ctx = multiprocessing.get_context("spawn")
+        self._workers = [self._spawn(i) for i in range(self.workers)]
+        logger.info(f"🚀 Sharded probe executor started ({self.workers} worker processes)")
+
+    def _spawn(self, index: int) -> _Worker:
+        worker = _Worker(self._ctx, index)
+        self._loop.add_reader(worker.conn.fileno(), self._on_readable, worker)
+        return worker
+
+    def _on_readable(self, worker: _Worker):
+        try:
+            msg = worker.conn.recv()
+        except (EOFError, OSError):
+            self._worker_died(worker)
+            return
+        queue = self._jobs.get(msg[1])
+        if queue is not None:
+            queue.put_nowait(msg)
+
+    def _worker_died(self, worker: _Worker):
+        logger.error(f"❌ Probe worker {worker.index} exited (code {worker.process.exitcode})")
+        worker.alive = False
+        try:
+            self._loop.remove_reader(worker.conn.fileno())
+        except (OSError, ValueError):
+            pass
+        for queue in self._jobs.values():
+            queue.put_nowait(("died", 0, worker.index))
+
+    @staticmethod
+    def _send_quietly(worker: _Worker, msg):
+        if not worker.alive:
+            return
+        try:
+            worker.send(msg)
+        except (BrokenPipeError, OSError):
+            pass
+
+
+def probe_engine():
+    """Engine PING LIGHT scans go through: worker processes when PROBE_WORKERS > 0, else in-process"""
+    return sharded_executor if sharded_executor.enabled else tcp_scanner
+
+
+# Global sharded executor instance
+sharded_executor = ShardedProbeExecutor()
+atexit.register(sharded_executor.shutdown)
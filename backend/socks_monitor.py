@@ -11,6 +11,7 @@ from typing import List, Dict
 from sqlalchemy.orm import Session
 from database import SessionLocal, Node
 from socks_server import socks_proxy, stop_socks_service
+from icmp_engine import icmp_ping
 import socket
 
 logger = logging.getLogger("socks_monitor")
@@ -76,7 +77,7 @@ class SOCKSMonitor:
                     
                     # Skip node reachability check for now - PPTP/SSH nodes may not respond to ping
                     # TODO: Implement proper connectivity check through PPTP/SSH tunnel
-                    # elif not self._is_node_reachable(node.ip):
+                    # elif not await self._is_node_reachable(node.ip):
                     #     logger.warning(f"⚠️ Target node {node.ip} (node {node.id}) unreachable")
                     #     await self._handle_node_unreachable(node, db)
                     
@@ -100,16 +101,11 @@ class SOCKSMonitor:
         except Exception:
             return False
     
-    def _is_node_reachable(self, node_ip: str) -> bool:
-        """Check if target node is reachable via ping"""
+    async def _is_node_reachable(self, node_ip: str) -> bool:
+        """Check if target node is reachable via ping (async ICMP engine, does not block the loop)"""
         try:
-            import subprocess
-            result = subprocess.run(
-                ['ping', '-c', '1', '-W', '5', node_ip], 
-                capture_output=True, 
-                timeout=10
-            )
-            return result.returncode == 0
+            result = await icmp_ping(node_ip, count=1, timeout=5.0)
+            return result['received'] > 0
         except Exception:
             return False
     
@@ -0,0 +1,400 @@
+"""
+Mass TCP connect scanner for PING LIGHT
+One selector (epoll) loop in a background thread drives thousands of non-blocking
+connects at once and streams results back to asyncio callers as an async iterator.
+Connects into one network prefix are capped (probe_scheduler.PROBE_PREFIX_IN_FLIGHT);
+targets of a saturated prefix wait while other prefixes proceed.
+"""
+import asyncio
+import errno
+import heapq
+import ipaddress
+import logging
+import os
+import selectors
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from probe_scheduler import PROBE_PREFIX_IN_FLIGHT, prefix_of
+from resource_governor import is_local_errno, is_local_error, local_error_label, resource_governor
+
+logger = logging.getLogger("tcp_scanner")
+
+# Global cap on half-open connects across all scan jobs
+SCANNER_MAX_IN_FLIGHT = int(os.environ.get('SCANNER_MAX_IN_FLIGHT', 4000))
+
+# SO_LINGER {on, 0}: close() sends RST, so probes never sit in TIME_WAIT
+_LINGER_RST = struct.pack('ii', 1, 0)
+_CONNECT_IN_PROGRESS = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY)
+# Upper bound on a single select() wait so limit changes are picked up promptly
+_MAX_SELECT_WAIT = 0.1
+# Pause before retrying a connect that hit a local resource limit (fds / ports)
+_LOCAL_BACKOFF = 0.05
+
+
+class ScanTarget(NamedTuple):
+    key: object      # caller handle (node_id, endpoint, ...)
+    ip: str
+    port: int
+    timeout: float   # seconds
+
+
+class ScanResult(NamedTuple):
+    key: object
+    ip: str
+    port: int
+    success: bool
+    rtt_ms: float
+    error: str       # "OK", "timeout", "refused", "unreachable", "ERR:<errno>" or "LOCAL:<errno>"
+
+
+def error_label(err: int) -> str:
+    """Map a connect() errno to the short labels used in probe results"""
+    if err == 0:
+        return "OK"
+    if err == errno.ECONNREFUSED:
+        return "refused"
+    if err in (errno.ETIMEDOUT,):
+        return "timeout"
+    if err in (errno.EHOSTUNREACH, errno.ENETUNREACH):
+        return "unreachable"
+    if is_local_errno(err):
+        return local_error_label(err)
+    return f"ERR:{errno.errorcode.get(err, err)}"
+
+
+class _Probe:
+    __slots__ = ("job", "target", "prefix", "sock", "started", "done")
+
+    def __init__(self, job: "_ScanJob", target: ScanTarget, prefix: str, sock: socket.socket, started: float):
+        self.job = job
+        self.target = target
+        self.prefix = prefix
+        self.sock = sock
+        self.started = started
+        self.done = False
+
+
+class _ScanJob:
+    """One scan() call: its targets, its in-flight limit and the queue results go to"""
+
+    def __init__(self, targets: List[ScanTarget], loop: asyncio.AbstractEventLoop, limit):
+        self.targets = targets
+        self.next_index = 0
+        # Targets parked because their prefix was at its in-flight cap, and ones released again
+        self.blocked: Dict[str, Deque[ScanTarget]] = {}
+        self.blocked_count = 0
+        self.ready: Deque[ScanTarget] = deque()
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.limit_source = limit
+        self.in_flight = 0
+        self.cancelled = False
+        self.finished = False
+        self.outbox: List[ScanResult] = []
+
+    @property
+    def limit(self) -> int:
+        # int, or a resizable limiter (concurrency_control.AIMDLimiter) read on every fill
+        return getattr(self.limit_source, 'limit', self.limit_source)
+
+    @property
+    def exhausted(self) -> bool:
+        return self.next_index >= len(self.targets) and not self.ready and not self.blocked_count
+
+    def flush(self, final: bool = False):
+        """Hand buffered results (and the end-of-scan marker) to the caller's loop"""
+        items = self.outbox
+        self.outbox = []
+        try:
+            if items:
+                self.loop.call_soon_threadsafe(self.queue.put_nowait, items)
+            if final:
+                self.loop.call_soon_threadsafe(self.queue.put_nowait, None)
+        except RuntimeError:
+            # Caller's loop is gone - nobody is listening any more
+            self.cancelled = True
+
+
+class TCPScanner:
+    """Selector-driven TCP connect engine shared by all PING LIGHT sessions"""
+
+    def __init__(self, max_in_flight: int = SCANNER_MAX_IN_FLIGHT, prefix_cap: int = PROBE_PREFIX_IN_FLIGHT):
+        self.max_in_flight = resource_governor.fit_concurrency(max_in_flight)
+        self.prefix_cap = prefix_cap
+        self._prefix_in_flight: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._incoming: List[_ScanJob] = []
+        self._jobs: List[_ScanJob] = []
+        self._thread: Optional[threading.Thread] = None
+        self._selector: Optional[selectors.BaseSelector] = None
+        self._wake_r: Optional[socket.socket] = None
+        self._wake_w: Optional[socket.socket] = None
+        self._deadlines: list = []
+        self._seq = 0
+        self._in_flight = 0
+        self._backoff_until = 0.0
+        self.stats = {
+            'started': 0,
+            'succeeded': 0,
+            'failed': 0,
+            'timeouts': 0,
+            'local_errors': 0,
+            'local_retries': 0,
+        }
+
+    # ---- caller side (asyncio) ----
+
+    async def scan(self, targets: Iterable[ScanTarget], max_in_flight=None) -> AsyncIterator[ScanResult]:
+        """Probe all targets and yield results in completion order.
+        max_in_flight is a fixed per-scan cap or an object with a live ``limit`` attribute."""
+        job = _ScanJob(list(targets), asyncio.get_running_loop(), max_in_flight or self.max_in_flight)
+        if not job.targets:
+            return
+        self._ensure_started()
+        with self._lock:
+            self._incoming.append(job)
+        self.wake()
+        try:
+            while True:
+                batch = await job.queue.get()
+                if batch is None:
+                    return
+                for result in batch:
+                    yield result
+        finally:
+            # No-op for completed jobs; aborts outstanding connects if the caller bailed out
+            job.cancelled = True
+            self.wake()
+
+    def wake(self):
+        """Interrupt the selector wait (new job, cancellation, limit change)"""
+        if self._wake_w is None:
+            return
+        try:
+            self._wake_w.send(b'\0')
+        except OSError:
+            pass  # Buffer full means a wakeup is already pending
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            'in_flight': self._in_flight,
+            'max_in_flight': self.max_in_flight,
+            'prefix_cap': self.prefix_cap,
+            'active_prefixes': len(self._prefix_in_flight),
+            'active_jobs': len(self._jobs),
+        }
+
+    # ---- engine side (scanner thread) ----
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._selector = selectors.DefaultSelector()
+            self._wake_r, self._wake_w = socket.socketpair()
+            self._wake_r.setblocking(False)
+            self._wake_w.setblocking(False)
+            self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+            self._thread = threading.Thread(target=self._run, name="tcp-scanner", daemon=True)
+            self._thread.start()
+            logger.info(f"🚀 TCP scanner engine started (max {self.max_in_flight} connects in flight; "
+                        f"{resource_governor.describe()})")
+
+    def _run(self):
+        while True:
+            try:
+                self._step()
+            except Exception as e:
+                logger.error(f"TCP scanner loop error: {e}", exc_info=True)
+                time.sleep(0.1)
+
+    def _step(self):
+        with self._lock:
+            if self._incoming:
+                self._jobs.extend(self._incoming)
+                self._incoming.clear()
+
+        self._reap_cancelled()
+        self._fill()
+
+        if self._deadlines:
+            wait = min(_MAX_SELECT_WAIT, max(0.0, self._deadlines[0][0] - time.monotonic()))
+        else:
+            wait = None if not self._jobs else _MAX_SELECT_WAIT
+
+        for key, _ in self._selector.select(wait):
+            probe = key.data
+            if probe is None:
+                try:
+                    while self._wake_r.recv(4096):
+                        pass
+                except OSError:
+                    pass
+                continue
+            err = probe.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            self._finish(probe, error_label(err))
+
+        now = time.monotonic()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, _, probe = heapq.heappop(self._deadlines)
+            if not probe.done:
+                self._finish(probe, "timeout")
+
+        still_active = []
+        for job in self._jobs:
+            if job.cancelled:
+                if job.in_flight == 0:
+                    continue
+            elif job.exhausted and job.in_flight == 0:
+                job.flush(final=True)
+                job.finished = True
+                continue
+            elif job.outbox:
+                job.flush()
+            still_active.append(job)
+        self._jobs = still_active
+
+    def _fill(self):
+        """Start connects round-robin across jobs until the global, per-job or per-prefix limit is hit"""
+        if time.monotonic() < self._backoff_until:
+            return
+        progress = True
+        while progress and self._in_flight < self.max_in_flight:
+            progress = False
+            for job in self._jobs:
+                if job.cancelled or job.exhausted or job.in_flight >= job.limit:
+                    continue
+                candidate = self._next_startable(job)
+                if candidate is None:
+                    continue
+                if not self._start(job, *candidate):
+                    return  # Out of local resources - wait for in-flight probes to free some
+                progress = True
+                if self._in_flight >= self.max_in_flight:
+                    break
+
+    def _next_startable(self, job: _ScanJob) -> Optional[Tuple[ScanTarget, str]]:
+        """Next target whose prefix has room; targets of saturated prefixes are parked on the job"""
+        while True:
+            if job.ready:
+                target = job.ready.popleft()
+            elif job.next_index < len(job.targets):
+                target = job.targets[job.next_index]
+                job.next_index += 1
+            else:
+                return None
+            prefix = prefix_of(target.ip)
+            if self._prefix_in_flight.get(prefix, 0) < self.prefix_cap:
+                return target, prefix
+            job.blocked.setdefault(prefix, deque()).append(target)
+            job.blocked_count += 1
+
+    def _release_prefix(self, prefix: str):
+        remaining = self._prefix_in_flight.get(prefix, 1) - 1
+        if remaining > 0:
+            self._prefix_in_flight[prefix] = remaining
+        else:
+            self._prefix_in_flight.pop(prefix, None)
+        for job in self._jobs:
+            parked = job.blocked.get(prefix)
+            if parked and not job.cancelled:
+                job.ready.append(parked.popleft())
+                job.blocked_count -= 1
+                if not parked:
+                    del job.blocked[prefix]
+                return
+
+    def _start(self, job: _ScanJob, target: ScanTarget, prefix: str) -> bool:
+        """Start one connect; False when it was put back because this host ran out of fds / ports"""
+        try:
+            family = socket.AF_INET6 if ipaddress.ip_address(target.ip).version == 6 else socket.AF_INET
+        except ValueError:
+            self.stats['started'] += 1
+            self._emit(job, target, False, 0.0, "ERR:InvalidAddress")
+            return True
+        sock = None
+        try:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, _LINGER_RST)
+            except OSError:
+                pass
+            resource_governor.bind_source(sock, family)
+            started = time.monotonic()
+            err = sock.connect_ex((target.ip, target.port))
+        except OSError as e:
+            if sock is not None:
+                sock.close()
+            err, started = e.errno or 0, time.monotonic()
+
+        if err not in _CONNECT_IN_PROGRESS:
+            if sock is not None and sock.fileno() != -1:
+                sock.close()
+            if is_local_errno(err) and self._in_flight > 0:
+                # Not the node's fault: retry once in-flight probes have released their fds / ports
+                job.ready.appendleft(target)
+                self.stats['local_retries'] += 1
+                self._backoff_until = time.monotonic() + _LOCAL_BACKOFF
+                return False
+            self.stats['started'] += 1
+            self._emit(job, target, err == 0, (time.monotonic() - started) * 1000.0, error_label(err))
+            return True
+
+        self.stats['started'] += 1
+        probe = _Probe(job, target, prefix, sock, started)
+        self._selector.register(sock, selectors.EVENT_WRITE, probe)
+        self._prefix_in_flight[prefix] = self._prefix_in_flight.get(prefix, 0) + 1
+        self._seq += 1
+        heapq.heappush(self._deadlines, (started + target.timeout, self._seq, probe))
+        job.in_flight += 1
+        self._in_flight += 1
+        return True
+
+    def _finish(self, probe: _Probe, label: str, deliver: bool = True):
+        if probe.done:
+            return
+        probe.done = True
+        elapsed_ms = (time.monotonic() - probe.started) * 1000.0
+        try:
+            self._selector.unregister(probe.sock)
+        except (KeyError, ValueError):
+            pass
+        probe.sock.close()
+        probe.job.in_flight -= 1
+        self._in_flight -= 1
+        self._release_prefix(probe.prefix)
+        if deliver:
+            self._emit(probe.job, probe.target, label == "OK", elapsed_ms, label)
+
+    def _emit(self, job: _ScanJob, target: ScanTarget, success: bool, rtt_ms: float, label: str):
+        if success:
+            self.stats['succeeded'] += 1
+        elif label == "timeout":
+            self.stats['timeouts'] += 1
+        elif is_local_error(label):
+            self.stats['local_errors'] += 1
+            resource_governor.record_local_error()
+        else:
+            self.stats['failed'] += 1
+        if not job.cancelled:
+            job.outbox.append(ScanResult(target.key, target.ip, target.port, success, rtt_ms, label))
+
+    def _reap_cancelled(self):
+        """Abort outstanding connects of jobs whose caller stopped listening"""
+        if not any(job.cancelled and job.in_flight for job in self._jobs):
+            return
+        for key in list(self._selector.get_map().values()):
+            probe = key.data
+            if probe is not None and probe.job.cancelled:
+                self._finish(probe, "cancelled", deliver=False)
+
+
+# Global scanner instance
+tcp_scanner = TCPScanner()
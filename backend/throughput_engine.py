@@ -0,0 +1,204 @@
+"""
+Convergent multi-stream throughput measurement
+N parallel TCP streams are sampled every interval; upload counts only bytes the peer has
+acknowledged (written minus what still sits in the asyncio and kernel send queues), so
+socket-buffer fill is not reported as link speed; a stream the peer resets keeps the count
+acked before the reset. The run stops early once the rolling
+estimate converges inside a confidence band and reports p50/p90 per direction.
+upload=False runs a download-only measurement (the peer sends, nothing is pushed).
+"""
+import asyncio
+import fcntl
+import math
+import os
+import struct
+import termios
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+SPEED_TEST_STREAMS = int(os.environ.get('SPEED_TEST_STREAMS', 4))
+SPEED_TEST_MAX_DURATION = float(os.environ.get('SPEED_TEST_MAX_DURATION', 8.0))
+
+StreamFactory = Callable[[], Awaitable[Tuple[asyncio.StreamReader, asyncio.StreamWriter]]]
+
+_CHUNK = b'X' * 16384
+
+
+def _kernel_send_queue(sock) -> int:
+    """Bytes in the kernel send queue not yet acknowledged by the peer (Linux SIOCOUTQ)"""
+    try:
+        return struct.unpack('i', fcntl.ioctl(sock.fileno(), termios.TIOCOUTQ, b'\x00' * 4))[0]
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def converged(rates: List[float], window: int, tolerance: float) -> bool:
+    """True when the 95% confidence half-width of the last `window` rates is within tolerance of their mean"""
+    if len(rates) < window:
+        return False
+    recent = rates[-window:]
+    mean = sum(recent) / window
+    if mean <= 0:
+        return False
+    std = math.sqrt(sum((r - mean) ** 2 for r in recent) / (window - 1))
+    return 1.96 * std / math.sqrt(window) <= tolerance * mean
+
+
+class _Stream:
+    __slots__ = ("reader", "writer", "sock", "written", "acked_seen", "received", "closed", "error", "finished_at")
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.sock = writer.get_extra_info('socket')
+        self.written = 0
+        self.acked_seen = 0  # last acked measurement while the transport was open
+        self.received = 0
+        self.closed = False
+        self.error: Optional[str] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def acked(self) -> int:
+        if self.closed or self.writer.transport.is_closing():
+            # A reset or closed stream delivered what was acked before - its send queues are gone
+            return self.acked_seen
+        pending = self.writer.transport.get_write_buffer_size() + _kernel_send_queue(self.sock)
+        self.acked_seen = max(self.acked_seen, self.written - pending)
+        return self.acked_seen
+
+    async def pump(self, stop: asyncio.Event, max_bytes: Optional[int]):
+        try:
+            while not stop.is_set() and (max_bytes is None or self.written < max_bytes):
+                chunk = _CHUNK if max_bytes is None else _CHUNK[:max_bytes - self.written]
+                self.writer.write(chunk)
+                self.written += len(chunk)
+                await self.writer.drain()
+            # Let the tail drain so the acked counter can catch up with written
+            while not stop.is_set() and self.acked < self.written:
+                if self.writer.transport.is_closing():
+                    raise ConnectionResetError("connection closed before the tail was acknowledged")
+                await asyncio.sleep(0.005)
+        except (ConnectionError, OSError) as e:
+            self.error = type(e).__name__
+            self.closed = True
+        if not stop.is_set():
+            self.finished_at = time.monotonic()
+
+    async def drain_input(self, stop: asyncio.Event):
+        try:
+            while not stop.is_set():
+                data = await self.reader.read(65536)
+                if not data:
+                    return
+                self.received += len(data)
+        except (ConnectionError, OSError):
+            pass
+
+    async def close(self):
+        self.acked  # last measurement before the send queues go away
+        self.closed = True
+        self.writer.close()
+        try:
+            await asyncio.wait_for(self.writer.wait_closed(), timeout=1.0)
+        except Exception:
+            pass
+
+
+async def measure_throughput(connect: StreamFactory, *, streams: int = SPEED_TEST_STREAMS,
+                             interval: float = 0.1, min_duration: float = 0.5,
+                             max_duration: float = SPEED_TEST_MAX_DURATION, tolerance: float = 0.1,
+                             window: int = 5, warmup_intervals: int = 1,
+                             max_bytes_per_stream: Optional[int] = None, connect_timeout: float = 5.0,
+                             upload: bool = True) -> Dict:
+    """
+    Run `streams` parallel streams opened by `connect` and sample them every `interval`.
+    Convergence is judged on the upload rate, or on the download rate when upload=False.
+    Returns: {"success", "streams", "upload_mbps_p50", "upload_mbps_p90", "download_mbps_p50",
+              "download_mbps_p90", "download_measured", "converged", "duration_s", "intervals",
+              "bytes_acked", "bytes_received", "error"}
+    """
+    opened = await asyncio.gather(*[asyncio.wait_for(connect(), timeout=connect_timeout) for _ in range(streams)],
+                                  return_exceptions=True)
+    active = [_Stream(*pair) for pair in opened if not isinstance(pair, BaseException)]
+    if not active:
+        error = next((e for e in opened if isinstance(e, BaseException)), None)
+        return {"success": False, "streams": 0, "error": f"no stream could be opened: {type(error).__name__}"}
+
+    stop = asyncio.Event()
+    pumps = [asyncio.create_task(s.pump(stop, max_bytes_per_stream)) for s in active] if upload else []
+    drains = [asyncio.create_task(s.drain_input(stop)) for s in active]
+    tasks = pumps + drains
+
+    up_rates: List[float] = []
+    down_rates: List[float] = []
+    start = last = time.monotonic()
+    last_acked = last_received = 0
+    is_converged = False
+    intervals = 0
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            acked = sum(s.acked for s in active)
+            received = sum(s.received for s in active)
+            elapsed = now - last
+            intervals += 1
+            if intervals > warmup_intervals and elapsed > 0:
+                up_rates.append((acked - last_acked) * 8 / (elapsed * 1_000_000))
+                down_rates.append((received - last_received) * 8 / (elapsed * 1_000_000))
+            last, last_acked, last_received = now, acked, received
+
+            if now - start >= min_duration and converged(up_rates if upload else down_rates, window, tolerance):
+                is_converged = True
+                break
+            if now - start >= max_duration or all(t.done() for t in (pumps if upload else drains)):
+                break
+    finally:
+        stop.set()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        bytes_acked = sum(s.acked for s in active)
+        bytes_received = sum(s.received for s in active)
+        errors = [s.error for s in active if s.error]
+        await asyncio.gather(*[s.close() for s in active], return_exceptions=True)
+
+    duration = time.monotonic() - start
+    if not up_rates:
+        # Everything finished inside the warm-up window - fall back to the whole-run average
+        finished = [s.finished_at for s in active if s.finished_at is not None]
+        span = max(1e-3, (max(finished) if finished else time.monotonic()) - start)
+        up_rates = [bytes_acked * 8 / (span * 1_000_000)]
+        down_rates = [bytes_received * 8 / (span * 1_000_000)]
+    # Idle download intervals mean the peer sends nothing back - not a measurement
+    download_measured = bytes_received >= 16384
+    measured_down = [r for r in down_rates if r > 0] if download_measured else []
+
+    return {
+        "success": bytes_acked > 0 if upload else download_measured,
+        "streams": len(active),
+        "upload_mbps_p50": round(percentile(up_rates, 50), 3),
+        "upload_mbps_p90": round(percentile(up_rates, 90), 3),
+        "download_mbps_p50": round(percentile(measured_down, 50), 3),
+        "download_mbps_p90": round(percentile(measured_down, 90), 3),
+        "download_measured": download_measured,
+        "converged": is_converged,
+        "duration_s": round(duration, 2),
+        "intervals": len(up_rates),
+        "bytes_acked": bytes_acked,
+        "bytes_received": bytes_received,
+        "error": (", ".join(sorted(set(errors))) if errors and (bytes_acked == 0 or len(errors) == len(active))
+                  else None) if upload
+                 else (None if download_measured else "peer sent no data"),
+    }
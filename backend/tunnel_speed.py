@@ -0,0 +1,271 @@
+"""
+Tunnel-bound throughput measurement
+Measures speed *through* a node's VPN tunnel: every stream is a TCP connection from a socket
+bound to the node's ppp interface (SO_BINDTODEVICE, as socks_server does), so the bytes go
+through the tunnel to a configurable sink instead of at the node's PPTP port. Download and
+upload are measured in separate phases with throughput_engine; concurrent measurements of
+different tunnels share TUNNEL_SPEED_SLOTS slots.
+
+Sinks (TUNNEL_SPEED_SINK):
+  tcp://host:port          - sink protocol: the client sends one byte, b'D' (sink streams data
+                             until the client closes) or b'U' (sink discards everything it reads);
+                             SinkServer below is a stand-in implementation for local runs and tests
+  http://host[:port]/path  - any HTTP server: GET path for download (response headers are read
+                             before the measurement starts), POST to path for upload
+
+An upload phase only counts bytes the sink acknowledged before any stream reset, and the sink
+must stay silent while it receives: an upload answered with data (an HTTP 413, an error page)
+or reset on every stream is reported as not measured.
+"""
+import asyncio
+import logging
+import os
+import socket
+from typing import Dict, Hashable, Optional, Tuple
+from urllib.parse import urlsplit
+
+from throughput_engine import SPEED_TEST_MAX_DURATION, SPEED_TEST_STREAMS, measure_throughput
+
+logger = logging.getLogger("tunnel_speed")
+
+TUNNEL_SPEED_SINK = os.environ.get('TUNNEL_SPEED_SINK', '')
+# Tunnels measured at the same time (each one saturates its own ppp link, but all share the uplink)
+TUNNEL_SPEED_SLOTS = int(os.environ.get('TUNNEL_SPEED_SLOTS', 4))
+TUNNEL_SPEED_STREAMS = int(os.environ.get('TUNNEL_SPEED_STREAMS', SPEED_TEST_STREAMS))
+
+SO_BINDTODEVICE = getattr(socket, 'SO_BINDTODEVICE', 25)
+SINK_DOWNLOAD = b'D'
+SINK_UPLOAD = b'U'
+# Declared POST body size for HTTP sinks; the measurement stops long before it is reached
+_HTTP_UPLOAD_LENGTH = 1 << 40
+_SINK_CHUNK = b'\0' * 65536
+
+Streams = Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+async def open_bound_connection(interface: Optional[str], host: str, port: int) -> Streams:
+    """TCP connection whose socket is bound to `interface` (None: normal routing)"""
+    loop = asyncio.get_running_loop()
+    family, sock_type, proto, _, address = (await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM))[0]
+    sock = socket.socket(family, sock_type, proto)
+    try:
+        if interface:
+            sock.setsockopt(socket.SOL_SOCKET, SO_BINDTODEVICE, interface.encode() + b'\0')
+        sock.setblocking(False)
+        await loop.sock_connect(sock, address)
+    except BaseException:
+        sock.close()
+        raise
+    return await asyncio.open_connection(sock=sock)
+
+
+def interface_exists(interface: str) -> bool:
+    try:
+        socket.if_nametoindex(interface)
+        return True
+    except OSError:
+        return False
+
+
+class StreamSink:
+    """Sink speaking the one-byte sink protocol (see SinkServer)"""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+
+    async def open(self, interface: Optional[str], download: bool) -> Streams:
+        reader, writer = await open_bound_connection(interface, self.host, self.port)
+        writer.write(SINK_DOWNLOAD if download else SINK_UPLOAD)
+        await writer.drain()
+        return reader, writer
+
+    def __str__(self):
+        return f"tcp://{self.host}:{self.port}"
+
+
+class SinkError(ConnectionError):
+    """The sink refused a measurement stream"""
+
+
+class HTTPSink:
+    """Plain HTTP server as a sink: GET downloads the resource, POST uploads into it"""
+
+    def __init__(self, host: str, port: int, path: str):
+        self.host = host
+        self.port = port
+        self.path = path or '/'
+
+    async def open(self, interface: Optional[str], download: bool) -> Streams:
+        reader, writer = await open_bound_connection(interface, self.host, self.port)
+        if download:
+            request = f"GET {self.path} HTTP/1.1\r\nHost: {self.host}\r\nConnection: close\r\n\r\n"
+        else:
+            request = (f"POST {self.path} HTTP/1.1\r\nHost: {self.host}\r\nConnection: close\r\n"
+                       f"Content-Type: application/octet-stream\r\nContent-Length: {_HTTP_UPLOAD_LENGTH}\r\n\r\n")
+        writer.write(request.encode())
+        await writer.drain()
+        if download:
+            # Status line and headers are not payload: consume them before the byte counters start
+            try:
+                head = await reader.readuntil(b'\r\n\r\n')
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+                writer.close()
+                raise SinkError(f"no HTTP response headers from {self}") from e
+            status = head.split(b'\r\n', 1)[0].decode(errors='replace')
+            if len(status.split()) < 2 or not status.split()[1].startswith('2'):
+                writer.close()
+                raise SinkError(f"{self} answered {status!r}")
+        return reader, writer
+
+    def __str__(self):
+        return f"http://{self.host}:{self.port}{self.path}"
+
+
+def parse_sink(spec: str):
+    """StreamSink / HTTPSink from a tcp:// or http:// spec; None when unset"""
+    if not spec:
+        return None
+    parts = urlsplit(spec if '://' in spec else f"tcp://{spec}")
+    if parts.scheme == 'http':
+        return HTTPSink(parts.hostname, parts.port or 80, parts.path)
+    if parts.scheme == 'tcp' and parts.hostname and parts.port:
+        return StreamSink(parts.hostname, parts.port)
+    raise ValueError(f"unsupported speed sink {spec!r} (expected tcp://host:port or http://host[:port]/path)")
+
+
+class SinkServer:
+    """Stand-in sink: streams zeros for b'D' connections and discards b'U' uploads"""
+
+    def __init__(self):
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.stats = {'downloads': 0, 'uploads': 0, 'bytes_sent': 0, 'bytes_received': 0}
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> int:
+        self.server = await asyncio.start_server(self._handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            command = await reader.read(1)
+            if command == SINK_DOWNLOAD:
+                self.stats['downloads'] += 1
+                while True:
+                    writer.write(_SINK_CHUNK)
+                    await writer.drain()
+                    self.stats['bytes_sent'] += len(_SINK_CHUNK)
+            elif command == SINK_UPLOAD:
+                self.stats['uploads'] += 1
+                while data := await reader.read(65536):
+                    self.stats['bytes_received'] += len(data)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+
+
+class TunnelSpeedTester:
+    """In-process speed measurement through ppp tunnels, bounded by tunnel slots"""
+
+    def __init__(self, sink_spec: str = TUNNEL_SPEED_SINK, slots: int = TUNNEL_SPEED_SLOTS):
+        self.sink = parse_sink(sink_spec)
+        self.slot_count = max(1, slots)
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.active = 0
+        self.waiting = 0
+        self.stats = {
+            'measured': 0,
+            'failed': 0,
+        }
+
+    def _slot(self) -> asyncio.Semaphore:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.slot_count)
+        return self._slots
+
+    async def measure(self, interface: Optional[str], sink=None, *, streams: int = TUNNEL_SPEED_STREAMS,
+                      max_duration: float = SPEED_TEST_MAX_DURATION) -> Dict:
+        """Download then upload through `interface` against the sink (default: TUNNEL_SPEED_SINK).
+        Returns: {"success", "interface", "sink", "download_mbps", "download_mbps_p90",
+                  "upload_mbps", "upload_mbps_p90", "download_measured", "upload_measured",
+                  "converged", "duration_s", "message"}; an unmeasured direction reports 0.0"""
+        sink = sink or self.sink
+        if sink is None:
+            return self._failure(interface, None, "no speed sink configured (TUNNEL_SPEED_SINK)")
+        if interface and not interface_exists(interface):
+            return self._failure(interface, sink, f"tunnel interface {interface} is not up")
+
+        self.waiting += 1
+        async with self._slot():
+            self.waiting -= 1
+            self.active += 1
+            try:
+                down = await measure_throughput(lambda: sink.open(interface, True), streams=streams,
+                                                max_duration=max_duration, upload=False)
+                up = await measure_throughput(lambda: sink.open(interface, False), streams=streams,
+                                              max_duration=max_duration)
+            except Exception as e:
+                return self._failure(interface, sink, f"{type(e).__name__}: {e}")
+            finally:
+                self.active -= 1
+
+        download_measured = bool(down["success"])
+        # A sink answering or resetting every stream during upload rejected it (HTTP 413, RST)
+        upload_measured = bool(up["success"] and not up.get("error") and not up.get("bytes_received"))
+        if not (download_measured or upload_measured):
+            return self._failure(interface, sink, down.get("error") or up.get("error") or "no data through tunnel")
+        self.stats['measured'] += 1
+        result = {
+            "success": True,
+            "interface": interface,
+            "sink": str(sink),
+            "download_mbps": down.get("download_mbps_p50", 0.0) if download_measured else 0.0,
+            "download_mbps_p90": down.get("download_mbps_p90", 0.0) if download_measured else 0.0,
+            "upload_mbps": up.get("upload_mbps_p50", 0.0) if upload_measured else 0.0,
+            "upload_mbps_p90": up.get("upload_mbps_p90", 0.0) if upload_measured else 0.0,
+            "download_measured": download_measured,
+            "upload_measured": upload_measured,
+            "converged": bool(down.get("converged") and up.get("converged")),
+            "duration_s": round(down.get("duration_s", 0.0) + up.get("duration_s", 0.0), 2),
+        }
+        result["message"] = (f"TUNNEL SPEED OK via {interface or 'default route'}: "
+                             + (f"{result['download_mbps']:.2f} Mbps down, " if download_measured
+                                else f"download not measured ({down.get('error')}), ")
+                             + (f"{result['upload_mbps']:.2f} Mbps up" if upload_measured
+                                else f"upload not measured ({up.get('error') or 'the sink answered the upload'})"))
+        return result
+
+    async def measure_many(self, interfaces: Dict[Hashable, Optional[str]], sink=None, **kwargs) -> Dict[Hashable, Dict]:
+        """Measure several tunnels concurrently (at most slot_count at a time); keys are caller handles"""
+        keys = list(interfaces)
+        results = await asyncio.gather(*[self.measure(interfaces[key], sink, **kwargs) for key in keys])
+        return dict(zip(keys, results))
+
+    def _failure(self, interface: Optional[str], sink, message: str) -> Dict:
+        self.stats['failed'] += 1
+        return {
+            "success": False,
+            "interface": interface,
+            "sink": str(sink) if sink else None,
+            "download_mbps": 0.0,
+            "upload_mbps": 0.0,
+            "message": f"TUNNEL SPEED FAILED: {message}",
+        }
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            'sink': str(self.sink) if self.sink else None,
+            'slots': self.slot_count,
+            'active': self.active,
+            'waiting': self.waiting,
+        }
+
+
+# Global tunnel speed tester instance
+tunnel_speed_tester = TunnelSpeedTester()
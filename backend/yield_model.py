@@ -0,0 +1,149 @@
+"""
+Predictive probe ordering
+Rolling (exponentially decayed) reachability success rates per provider, per network prefix
+(/24) and per country. A node's alive probability adds up the three in log-odds (naive
+Bayes), each shrunk towards the global rate by how much evidence it has; sweeps probe
+likely-alive nodes first and report the expected yield curve. Seeded from current node
+statuses on first use, then fed by live probes.
+"""
+import logging
+import math
+import os
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, TypeVar
+
+from probe_scheduler import interleave_by_prefix, prefix_of
+
+logger = logging.getLogger("yield_model")
+
+# Per-observation decay of a key's counts: ~1/(1-decay) recent probes dominate
+YIELD_DECAY = float(os.environ.get('YIELD_DECAY', 0.995))
+YIELD_GLOBAL_DECAY = float(os.environ.get('YIELD_GLOBAL_DECAY', 0.9999))
+# Pseudo-observations of the global rate mixed into every key (smoothing strength)
+YIELD_PRIOR_WEIGHT = float(os.environ.get('YIELD_PRIOR_WEIGHT', 5.0))
+# Probabilities are bucketed to this step; inside a bucket work is still interleaved by prefix
+_TIER_STEP = 0.1
+_CURVE_POINTS = 20
+
+ALIVE_STATUSES = ("ping_light", "ping_ok", "speed_ok", "online")
+DEAD_STATUSES = ("ping_failed",)
+
+T = TypeVar('T')
+
+
+def _logit(p: float) -> float:
+    p = min(0.99, max(0.01, p))
+    return math.log(p / (1.0 - p))
+
+
+class _Rate:
+    __slots__ = ("successes", "total")
+
+    def __init__(self):
+        self.successes = 0.0
+        self.total = 0.0
+
+    def observe(self, success: bool, decay: float):
+        self.successes = self.successes * decay + (1.0 if success else 0.0)
+        self.total = self.total * decay + 1.0
+
+
+class YieldModel:
+    """Success-rate statistics by provider / prefix / country"""
+
+    DIMENSIONS = ("provider", "prefix", "country")
+
+    def __init__(self, decay: float = YIELD_DECAY, prior_weight: float = YIELD_PRIOR_WEIGHT,
+                 global_decay: float = YIELD_GLOBAL_DECAY):
+        self.decay = decay
+        self.global_decay = global_decay
+        self.prior_weight = prior_weight
+        self.global_rate = _Rate()
+        self.rates: Dict[str, Dict[str, _Rate]] = {d: {} for d in self.DIMENSIONS}
+        self.seeded = False
+
+    @staticmethod
+    def _keys(provider: Optional[str], country: Optional[str], ip: Optional[str]) -> Dict[str, str]:
+        return {"provider": (provider or "").strip().lower(), "prefix": prefix_of(ip),
+                "country": (country or "").strip().lower()}
+
+    def observe(self, provider: Optional[str], country: Optional[str], ip: Optional[str], success: bool):
+        self.global_rate.observe(success, self.global_decay)
+        for dimension, key in self._keys(provider, country, ip).items():
+            if key:
+                self.rates[dimension].setdefault(key, _Rate()).observe(success, self.decay)
+
+    def seed(self, rows: Iterable):
+        """Bootstrap from (provider, country, ip, status) rows: current statuses are past probe outcomes"""
+        count = 0
+        for row in rows:
+            if row.status in ALIVE_STATUSES:
+                self.observe(row.provider, row.country, row.ip, True)
+            elif row.status in DEAD_STATUSES:
+                self.observe(row.provider, row.country, row.ip, False)
+            else:
+                continue
+            count += 1
+        self.seeded = True
+        logger.info(f"📈 Yield model seeded from {count} tested nodes "
+                    f"(global alive rate {self.global_probability():.1%})")
+
+    def global_probability(self) -> float:
+        g = self.global_rate
+        return (g.successes + 1.0) / (g.total + 2.0)  # Laplace: 0.5 with no data
+
+    def probability(self, provider: Optional[str], country: Optional[str], ip: Optional[str]) -> float:
+        base = self.global_probability()
+        log_odds = _logit(base)
+        for dimension, key in self._keys(provider, country, ip).items():
+            rate = self.rates[dimension].get(key) if key else None
+            if rate is None or rate.total <= 0:
+                continue
+            # Shrunk towards the global rate, so thin evidence barely moves the estimate
+            estimate = (rate.successes + base * self.prior_weight) / (rate.total + self.prior_weight)
+            log_odds += _logit(estimate) - _logit(base)
+        return 1.0 / (1.0 + math.exp(-log_odds))
+
+    def order(self, items: Sequence[T], features: Callable[[T], Tuple[Optional[str], Optional[str], Optional[str]]]
+              ) -> Tuple[List[T], List[float]]:
+        """Most-likely-alive first; items of one probability tier stay interleaved by prefix.
+        Returns (ordered items, their probabilities)."""
+        scored = [(self.probability(*features(item)), item) for item in items]
+        tiers: Dict[int, List[Tuple[float, T]]] = {}
+        for p, item in scored:
+            tiers.setdefault(int(p / _TIER_STEP), []).append((p, item))
+        ordered: List[Tuple[float, T]] = []
+        for tier in sorted(tiers, reverse=True):
+            bucket = sorted(tiers[tier], key=lambda pair: pair[0], reverse=True)
+            ordered.extend(interleave_by_prefix(bucket, lambda pair: features(pair[1])[2]))
+        return [item for _, item in ordered], [p for p, _ in ordered]
+
+    def snapshot(self) -> Dict:
+        return {
+            "global_alive_rate": round(self.global_probability(), 4),
+            "observations": round(self.global_rate.total, 1),
+            **{f"{d}_keys": len(self.rates[d]) for d in self.DIMENSIONS},
+        }
+
+
+def expected_yield_curve(probabilities: Sequence[float], weights: Optional[Sequence[int]] = None,
+                         points: int = _CURVE_POINTS) -> Dict:
+    """Cumulative expected alive nodes against nodes processed, sampled at `points` positions.
+    weights: nodes sharing each probed item (endpoint groups), 1 each by default."""
+    weights = weights or [1] * len(probabilities)
+    total_nodes = sum(weights)
+    curve = []
+    processed = 0
+    expected = 0.0
+    step = max(1, total_nodes // points)
+    next_mark = step
+    for p, w in zip(probabilities, weights):
+        processed += w
+        expected += p * w
+        if processed >= next_mark or processed == total_nodes:
+            curve.append({"processed": processed, "expected_alive": round(expected, 1)})
+            next_mark = processed + step
+    return {"expected_alive_total": round(expected, 1), "curve": curve}
+
+
+# Global yield model instance
+yield_model = YieldModel()
@@ -174,11 +174,24 @@ const TestingModal = ({ isOpen, onClose, selectedNodeIds = [], selectAllMode = f
     if (sessionId && loading) {
       // Обеспечиваем мгновенную видимость процесса до прихода первого SSE
       setProgressData(prev => prev || { status: 'running', processed_items: 0, total_items: totalNodes || selectedNodeIds.length, current_task: `Запущено тестирование ${selectedNodeIds.length} узлов...`, results: [] });
+      // События несут только новые результаты (results_from - индекс первого), копим их здесь;
+      // при переподключении браузер сам отправляет Last-Event-ID и сервер продолжает с него
+      const streamResults = [];
       eventSource = new EventSource(`${API}/progress/${sessionId}`);
       
       eventSource.onmessage = (event) => {
         try {
           const data = JSON.parse(event.data);
+          if (data.error) {
+            eventSource.close();
+            setLoading(false);
+            return;
+          }
+          if (data.results?.length) {
+            streamResults.length = Math.min(streamResults.length, data.results_from ?? streamResults.length);
+            streamResults.push(...data.results);
+          }
+          data.results = streamResults;
           setProgressData(data);
           setProcessedNodes(data.processed_items || 0);
           setTotalNodes(data.total_items || selectedNodeIds.length);
@@ -270,8 +283,10 @@ const TestingModal = ({ isOpen, onClose, selectedNodeIds = [], selectAllMode = f
       
       eventSource.onerror = (error) => {
         console.error('SSE Error:', error);
-        eventSource.close();
-        setLoading(false);
+        // CONNECTING: браузер переподключается сам и продолжит с Last-Event-ID
+        if (eventSource.readyState === EventSource.CLOSED) {
+          setLoading(false);
+        }
       };
     }
     
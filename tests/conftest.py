@@ -0,0 +1,45 @@
+"""
+Shared fixtures: backend modules on sys.path and an in-memory database for the write paths
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+
+@pytest.fixture
+def memory_engine(monkeypatch):
+    """In-memory SQLite with the full schema, swapped in for the engine the write paths use"""
+    from sqlalchemy import create_engine
+    from sqlalchemy.pool import StaticPool
+
+    import database
+    import job_store
+    import result_writer
+
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    database.Base.metadata.create_all(bind=engine)
+    for module in (database, result_writer, job_store):
+        monkeypatch.setattr(module, "engine", engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def add_nodes(memory_engine):
+    """add_nodes(n) -> ids of n fresh pptp nodes in the in-memory database"""
+    from sqlalchemy.orm import Session
+
+    from database import Node
+
+    def add(count: int, **columns):
+        with Session(memory_engine) as session:
+            nodes = [Node(ip=f"10.0.0.{index + 1}", protocol="pptp", status="not_tested", **columns)
+                     for index in range(count)]
+            session.add_all(nodes)
+            session.commit()
+            return [node.id for node in nodes]
+
+    return add
@@ -0,0 +1,114 @@
+"""
+Durable test jobs: checkpoints follow the node result writer, lost results keep a job resumable
+"""
+import asyncio
+
+import pytest
+from sqlalchemy import select
+
+import job_store
+from database import TestJob
+from job_store import TestJobStore
+from result_writer import NodeResultWriter
+
+
+@pytest.fixture
+def writer(memory_engine, monkeypatch):
+    """Fresh result writer behind job_store (no background flushes)"""
+    fresh = NodeResultWriter(flush_rows=10_000, flush_ms=600_000)
+    monkeypatch.setattr(job_store, "result_writer", fresh)
+    return fresh
+
+
+def _failing_write(batch):
+    raise RuntimeError("database is locked")
+
+
+def _job_status(engine, job_id):
+    with engine.connect() as conn:
+        return conn.execute(select(TestJob.__table__.c.status).where(TestJob.__table__.c.id == job_id)).scalar()
+
+
+def _complete(store, writer, job_id, node_ids):
+    """What a batch worker does per node: submit the node result, then mark the item done"""
+    for node_id in node_ids:
+        writer.submit(node_id, {"status": "ping_ok"})
+        store.mark_done(job_id, node_id, True)
+
+
+def test_checkpoints_only_items_whose_results_were_written(memory_engine, add_nodes, writer, monkeypatch):
+    ids = add_nodes(5)
+    store = TestJobStore(checkpoint_rows=10_000, checkpoint_ms=600_000)
+    store.create("job-written", "testing", ids, {"ping_only": True})
+    real_write = writer._write
+
+    async def run():
+        _complete(store, writer, "job-written", ids[:3])
+        monkeypatch.setattr(writer, "_write", _failing_write)
+        await store.flush()
+        after_failure = store.unfinished()[0]["remaining"]
+        monkeypatch.setattr(writer, "_write", real_write)
+        await store.flush()
+        return after_failure, store.unfinished()[0]
+
+    after_failure, job = asyncio.run(run())
+    assert after_failure == ids  # node rows not written: nothing checkpointed
+    assert job["remaining"] == ids[3:]
+    assert job["processed_items"] == 3
+    assert job["alive_items"] == 3
+    assert store.stats["items_checkpointed"] == 3
+
+
+def test_finish_keeps_a_job_running_when_results_were_lost(memory_engine, add_nodes, writer, monkeypatch):
+    ids = add_nodes(4)
+    store = TestJobStore(checkpoint_rows=10_000, checkpoint_ms=600_000)
+    store.create("job-lost", "testing", ids, {})
+
+    async def run():
+        _complete(store, writer, "job-lost", ids[:2])
+        monkeypatch.setattr(writer, "_write", _failing_write)
+        _complete(store, writer, "job-lost", ids[2:])
+        await store.finish("job-lost", "completed")
+
+    asyncio.run(run())
+    assert _job_status(memory_engine, "job-lost") == "running"
+    assert store.stats["items_lost"] == 4
+    assert store.unfinished()[0]["remaining"] == ids
+
+
+def test_finish_completes_a_fully_written_job(memory_engine, add_nodes, writer):
+    ids = add_nodes(3)
+    store = TestJobStore(checkpoint_rows=10_000, checkpoint_ms=600_000)
+    store.create("job-done", "ping_light", ids, {})
+
+    async def run():
+        _complete(store, writer, "job-done", ids)
+        await store.finish("job-done", "completed")
+
+    asyncio.run(run())
+    assert _job_status(memory_engine, "job-done") == "completed"
+    assert store.unfinished() == []
+
+
+def test_resume_test_jobs_runs_the_remaining_items(memory_engine, add_nodes, monkeypatch):
+    pytest.importorskip("fastapi")
+    import server
+
+    ids = add_nodes(4)
+    server.test_job_store.create("job-resume", "testing", ids, {"ping_only": True})
+    server.test_job_store._write({"job-resume": {ids[0]: True, ids[1]: False}})
+    server.test_job_store.create("job-empty", "ping_light", [], {})
+    started = []
+    monkeypatch.setattr(server, "run_test_job", lambda *args: started.append(args))
+
+    try:
+        asyncio.run(server.resume_test_jobs())
+        progress = server.progress_store["job-resume"]
+        assert started == [("job-resume", "testing", ids[2:], {"ping_only": True})]
+        assert progress.processed_items == 2
+        assert progress.alive_items == 1
+        assert _job_status(memory_engine, "job-empty") == "completed"
+    finally:
+        server.progress_store.pop("job-resume", None)
+        server.active_sessions.discard("job-resume")
+        server.test_job_store._jobs.discard("job-resume")
@@ -0,0 +1,80 @@
+"""
+Userspace PPTP client verdicts against the local stand-in server
+Correct and wrong credentials for MS-CHAPv2, CHAP-MD5 and PAP, over GRE-in-UDP on 127.0.0.1.
+"""
+import asyncio
+import os
+import socket
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from pptp_client import AUTH_CHAP_MD5, AUTH_MSCHAPV2, AUTH_PAP, gre_dispatcher, verify_pptp_credentials
+from pptp_standin_server import StandInPPTPServer
+
+LOGIN = "vpnuser"
+PASSWORD = "s3cret"
+
+
+def _free_udp_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _verdicts(auth_method: str, attempts):
+    """Run verify_pptp_credentials for every (login, password) at once against a stand-in server"""
+    if not gre_dispatcher.udp_port:
+        gre_dispatcher.udp_port = _free_udp_port()
+
+    async def run():
+        server = StandInPPTPServer(LOGIN, PASSWORD, auth_method=auth_method)
+        await server.start()
+        try:
+            return await asyncio.gather(*[
+                verify_pptp_credentials("127.0.0.1", login, password, timeout=5.0, port=server.port)
+                for login, password in attempts])
+        finally:
+            await server.stop()
+
+    return asyncio.run(run())
+
+
+def _check_method(auth_method: str):
+    good, wrong_password, wrong_login = _verdicts(
+        auth_method, [(LOGIN, PASSWORD), (LOGIN, "wrong"), ("intruder", PASSWORD)])
+
+    assert good["success"] is True, good["message"]
+    assert good["stage"] == "ok"
+    assert good["auth_method"] == auth_method
+    assert good["auth_tested"] is True
+
+    for rejected in (wrong_password, wrong_login):
+        assert rejected["success"] is False
+        assert rejected["stage"] == "auth", rejected["message"]
+        assert rejected["auth_method"] == auth_method
+        assert rejected["auth_tested"] is True
+
+
+def test_mschapv2_verdicts():
+    _check_method(AUTH_MSCHAPV2)
+
+
+def test_chap_md5_verdicts():
+    _check_method(AUTH_CHAP_MD5)
+
+
+def test_pap_verdicts():
+    _check_method(AUTH_PAP)
+
+
+def test_concurrent_verdicts():
+    attempts = [(LOGIN, PASSWORD if i % 2 == 0 else "bad") for i in range(50)]
+    results = _verdicts(AUTH_MSCHAPV2, attempts)
+    assert [result["success"] for result in results] == [i % 2 == 0 for i in range(50)]
+
+
+if __name__ == "__main__":
+    for test in (test_mschapv2_verdicts, test_chap_md5_verdicts, test_pap_verdicts, test_concurrent_verdicts):
+        test()
+        print(f"✅ {test.__name__}")
@@ -0,0 +1,41 @@
+"""
+Progress summaries as the SSE stream compares them
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from progress_tracking import ProgressTracker
+
+
+class _Limiter:
+    def __init__(self):
+        self.limit = 50
+        self.in_flight = 0
+        self.lag = 0.0
+
+    def snapshot(self):
+        return {"name": "test", "limit": self.limit, "in_flight": self.in_flight, "loop_lag_ms": self.lag}
+
+
+def test_live_limiter_gauges_are_not_a_change():
+    tracker = ProgressTracker("session-gauges", total_items=10)
+    tracker.limiter = _Limiter()
+    before = ProgressTracker.change_key(tracker.summary())
+
+    tracker.limiter.in_flight = 37
+    tracker.limiter.lag = 12.5
+    assert ProgressTracker.change_key(tracker.summary()) == before
+    # The event itself still carries the live values
+    assert tracker.summary()["concurrency"]["in_flight"] == 37
+
+    tracker.limiter.limit = 25
+    assert ProgressTracker.change_key(tracker.summary()) != before
+
+
+def test_counters_are_a_change():
+    tracker = ProgressTracker("session-counters", total_items=10)
+    before = ProgressTracker.change_key(tracker.summary())
+    tracker.update(1, "node 1", {"node_id": 1, "ip": "10.0.0.1", "status": "ping_ok", "success": True})
+    assert ProgressTracker.change_key(tracker.summary()) != before
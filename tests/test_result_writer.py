@@ -0,0 +1,110 @@
+"""
+Write-behind node result writer against an in-memory database
+"""
+import asyncio
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from database import Node
+from result_writer import _MAX_FLUSH_ATTEMPTS, NodeResultWriter, changed_columns
+
+
+def _writer() -> NodeResultWriter:
+    # No background flushes during a test: every write happens in an explicit flush()
+    return NodeResultWriter(flush_rows=10_000, flush_ms=600_000)
+
+
+def _rows(engine, node_ids):
+    with engine.connect() as conn:
+        table = Node.__table__
+        return {row.id: row for row in conn.execute(select(table).where(table.c.id.in_(node_ids)))}
+
+
+def test_changed_columns_skips_unchanged_values(memory_engine, add_nodes):
+    node_id, = add_nodes(1, speed="5.0 Mbps")
+    with Session(memory_engine) as session:
+        node = session.get(Node, node_id)
+        node.speed = "5.0 Mbps"  # same value
+        assert changed_columns(node) == {}
+        node.last_update = node.created_at  # bookkeeping column alone
+        assert changed_columns(node) == {}
+        node.status = "ping_ok"
+        changes = changed_columns(node)
+        assert changes["status"] == "ping_ok"
+        assert "speed" not in changes
+
+
+def test_flush_groups_rows_by_column_set(memory_engine, add_nodes):
+    ids = add_nodes(4)
+    writer = _writer()
+
+    async def run():
+        writer.submit(ids[0], {"status": "ping_ok"})
+        writer.submit(ids[1], {"status": "ping_failed"})
+        writer.submit(ids[2], {"status": "speed_ok", "speed": "12.0 Mbps"})
+        writer.submit(ids[3], {"status": "ping_ok"})
+        writer.submit(ids[3], {"ping_port": 443})  # coalesced into the first submit
+        return await writer.flush()
+
+    assert asyncio.run(run()) == set()
+    rows = _rows(memory_engine, ids)
+    assert [rows[node_id].status for node_id in ids] == ["ping_ok", "ping_failed", "speed_ok", "ping_ok"]
+    assert rows[ids[2]].speed == "12.0 Mbps"
+    assert rows[ids[3]].ping_port == 443
+    # (status,), (speed, status), (ping_port, status): one executemany per column set
+    assert writer.stats["statements"] == 3
+    assert writer.stats["rows_written"] == 4
+    assert writer.stats["coalesced"] == 1
+
+
+def test_failed_flush_returns_unwritten_ids_and_requeues(memory_engine, add_nodes, monkeypatch):
+    ids = add_nodes(2)
+    writer = _writer()
+    real_write = writer._write
+
+    def failing_write(batch):
+        raise RuntimeError("database is locked")
+
+    async def run():
+        writer.submit(ids[0], {"status": "ping_ok"})
+        writer.submit(ids[1], {"status": "ping_ok"})
+        monkeypatch.setattr(writer, "_write", failing_write)
+        unwritten = await writer.flush()
+        pending = [writer.is_pending(node_id) for node_id in ids]
+        # A newer value submitted while the batch was failing wins over the re-queued one
+        writer.submit(ids[0], {"status": "speed_ok"})
+        monkeypatch.setattr(writer, "_write", real_write)
+        return unwritten, pending, await writer.flush()
+
+    unwritten, pending, retried = asyncio.run(run())
+    assert unwritten == set(ids)
+    assert pending == [True, True]
+    assert retried == set()
+    assert writer.take_dropped() == set()
+    rows = _rows(memory_engine, ids)
+    assert rows[ids[0]].status == "speed_ok"
+    assert rows[ids[1]].status == "ping_ok"
+
+
+def test_repeated_failures_drop_the_batch(memory_engine, add_nodes, monkeypatch):
+    ids = add_nodes(3)
+    writer = _writer()
+
+    def failing_write(batch):
+        raise RuntimeError("disk I/O error")
+
+    monkeypatch.setattr(writer, "_write", failing_write)
+
+    async def run():
+        for node_id in ids:
+            writer.submit(node_id, {"status": "ping_ok"})
+        return [await writer.flush() for _ in range(_MAX_FLUSH_ATTEMPTS)]
+
+    results = asyncio.run(run())
+    assert all(unwritten == set(ids) for unwritten in results)
+    assert not any(writer.is_pending(node_id) for node_id in ids)
+    assert writer.take_dropped() == set(ids)
+    assert writer.take_dropped() == set()  # reported once
+    assert writer.stats["dropped"] == len(ids)
+    assert all(row.status == "not_tested" for row in _rows(memory_engine, ids).values())
@@ -0,0 +1,159 @@
+"""
+Selector TCP scanner over loopback
+A listening port, a closed port, a port whose accept queue is full (connects hang until their
+timeout) and injected local resource errors.
+"""
+import asyncio
+import errno
+import socket
+import time
+
+import pytest
+
+import tcp_scanner
+from resource_governor import is_local_error
+from tcp_scanner import _LOCAL_BACKOFF, ScanTarget, TCPScanner
+
+
+class _RecordingScanner(TCPScanner):
+    """TCPScanner that records the highest per-job and per-prefix in-flight counts it reached"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.job_peak = 0
+        self.prefix_peak = 0
+
+    def _start(self, job, target, prefix):
+        started = super()._start(job, target, prefix)
+        self.job_peak = max(self.job_peak, job.in_flight)
+        self.prefix_peak = max(self.prefix_peak, self._prefix_in_flight.get(prefix, 0))
+        return started
+
+
+class _Limit:
+    """Resizable limit, read by the scanner on every fill (like AIMDLimiter.limit)"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+
+
+@pytest.fixture
+def ports():
+    """(listening port, closed port, port whose connects never complete)"""
+    listening = socket.socket()
+    listening.bind(('127.0.0.1', 0))
+    listening.listen(128)
+    closed = socket.socket()
+    closed.bind(('127.0.0.1', 0))
+    closed_port = closed.getsockname()[1]
+    closed.close()
+    # Never accepted, backlog 0: once the queue is full further SYNs are dropped
+    stalled = socket.socket()
+    stalled.bind(('127.0.0.1', 0))
+    stalled.listen(0)
+    fillers = []
+    for _ in range(3):
+        filler = socket.socket()
+        filler.setblocking(False)
+        filler.connect_ex(stalled.getsockname())
+        fillers.append(filler)
+    time.sleep(0.05)
+    yield listening.getsockname()[1], closed_port, stalled.getsockname()[1]
+    for sock in [listening, stalled, *fillers]:
+        sock.close()
+
+
+def _scan(scanner, targets, max_in_flight=None, on_result=None):
+    async def run():
+        results = []
+        async for result in scanner.scan(targets, max_in_flight=max_in_flight):
+            results.append(result)
+            if on_result:
+                on_result(result)
+        return results
+
+    return asyncio.run(run())
+
+
+def test_open_closed_and_stalled_ports(ports):
+    open_port, closed_port, stalled_port = ports
+    results = {result.key: result for result in _scan(TCPScanner(), [
+        ScanTarget("open", '127.0.0.1', open_port, 2.0),
+        ScanTarget("closed", '127.0.0.1', closed_port, 2.0),
+        ScanTarget("stalled", '127.0.0.1', stalled_port, 0.2),
+        ScanTarget("invalid", 'not-an-ip', open_port, 2.0),
+    ])}
+    assert results["open"].success and results["open"].error == "OK"
+    assert not results["closed"].success and results["closed"].error == "refused"
+    assert not results["stalled"].success and results["stalled"].error == "timeout"
+    assert results["invalid"].error == "ERR:InvalidAddress"
+
+
+def _failing_binds(monkeypatch, fail_calls):
+    """Make resource_governor.bind_source raise EADDRNOTAVAIL on the given call numbers; returns call times"""
+    calls = []
+    real_bind = tcp_scanner.resource_governor.bind_source
+
+    def bind_source(sock, family):
+        calls.append(time.monotonic())
+        if len(calls) - 1 in fail_calls:
+            raise OSError(errno.EADDRNOTAVAIL, "Cannot assign requested address")
+        return real_bind(sock, family)
+
+    monkeypatch.setattr(tcp_scanner.resource_governor, "bind_source", bind_source)
+    return calls
+
+
+def test_local_error_is_requeued_after_backoff(ports, monkeypatch):
+    open_port, _, stalled_port = ports
+    # Call 0 starts the stalled probe (stays in flight), call 1 - the open port - runs out of ports
+    calls = _failing_binds(monkeypatch, {1})
+    scanner = TCPScanner()
+    results = {result.key: result for result in _scan(scanner, [
+        ScanTarget("stalled", '127.0.0.1', stalled_port, 0.5),
+        ScanTarget("open", '127.0.0.1', open_port, 2.0),
+    ])}
+    assert results["open"].success, results["open"]
+    assert results["stalled"].error == "timeout"
+    assert scanner.stats['local_retries'] == 1
+    assert scanner.stats['local_errors'] == 0
+    assert calls[2] - calls[1] >= _LOCAL_BACKOFF * 0.9
+
+
+def test_local_error_with_nothing_in_flight_is_reported(ports, monkeypatch):
+    open_port, _, _ = ports
+    _failing_binds(monkeypatch, {0})
+    scanner = TCPScanner()
+    result, = _scan(scanner, [ScanTarget("open", '127.0.0.1', open_port, 2.0)])
+    assert not result.success
+    assert is_local_error(result.error)
+    assert scanner.stats['local_errors'] == 1
+
+
+def test_live_limit_caps_in_flight(ports):
+    _, _, stalled_port = ports
+    scanner = _RecordingScanner(prefix_cap=100)
+    limit = _Limit(2)
+    peaks = []
+
+    def on_result(result):
+        if not peaks:
+            peaks.append(scanner.job_peak)
+            limit.limit = 5  # picked up on the next fill, like an AIMD increase
+            scanner.wake()
+
+    results = _scan(scanner, [ScanTarget(index, '127.0.0.1', stalled_port, 0.15) for index in range(20)],
+                    max_in_flight=limit, on_result=on_result)
+    assert len(results) == 20
+    assert peaks == [2]
+    assert scanner.job_peak == 5
+
+
+def test_prefix_cap_parks_and_releases_targets(ports):
+    _, _, stalled_port = ports
+    scanner = _RecordingScanner(prefix_cap=2)
+    results = _scan(scanner, [ScanTarget(index, '127.0.0.1', stalled_port, 0.1) for index in range(8)],
+                    max_in_flight=50)
+    # Every parked target was released and probed, never more than the cap into one prefix
+    assert sorted(result.key for result in results) == list(range(8))
+    assert scanner.prefix_peak == 2
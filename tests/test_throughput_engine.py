@@ -0,0 +1,64 @@
+"""
+Multi-stream throughput measurement over loopback
+A peer that reads everything is measured in full; a peer that stops reading and resets
+the streams only gets credit for bytes acknowledged before the reset.
+"""
+import asyncio
+import os
+import socket
+import struct
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from throughput_engine import measure_throughput
+
+STREAMS = 4
+PER_STREAM = 256 * 1024
+
+
+async def _measure_against(handle, rcvbuf: int = 0):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if rcvbuf:
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(16)
+    port = listener.getsockname()[1]
+    server = await asyncio.start_server(handle, sock=listener)
+    try:
+        return await measure_throughput(lambda: asyncio.open_connection('127.0.0.1', port), streams=STREAMS,
+                                        max_bytes_per_stream=PER_STREAM, max_duration=3.0)
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+def test_reading_peer_is_measured_in_full():
+    async def handle(reader, writer):
+        while await reader.read(65536):
+            pass
+        writer.close()
+
+    result = asyncio.run(_measure_against(handle))
+    assert result["success"] is True
+    assert result["bytes_acked"] == STREAMS * PER_STREAM
+    assert result["error"] is None
+
+
+def test_reset_peer_gets_no_credit_for_buffered_bytes():
+    async def handle(reader, writer):
+        # Never reads, then resets (what a PPTP server does with junk on 1723)
+        await asyncio.sleep(0.3)
+        writer.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        writer.transport.abort()
+
+    result = asyncio.run(_measure_against(handle, rcvbuf=4096))
+    assert result["bytes_acked"] < STREAMS * PER_STREAM
+    assert result["duration_s"] < 2.0  # reset streams end the run instead of waiting for an ack
+    assert result["error"]
+
+
+if __name__ == "__main__":
+    for test in (test_reading_peer_is_measured_in_full, test_reset_peer_gets_no_credit_for_buffered_bytes):
+        test()
+        print(f"✅ {test.__name__}")
@@ -0,0 +1,135 @@
+"""
+Tunnel speed measurement against local stand-in sinks (no tunnel: interface None)
+SinkServer for the tcp:// sink protocol, a sink that resets uploads, and an HTTP sink that
+answers uploads with 413.
+"""
+import asyncio
+import os
+import socket
+import struct
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from tunnel_speed import SINK_DOWNLOAD, HTTPSink, SinkServer, StreamSink, TunnelSpeedTester
+
+MAX_DURATION = 1.0
+STREAMS = 2
+
+
+async def _listen(handle, rcvbuf: int = 0):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if rcvbuf:
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(16)
+    server = await asyncio.start_server(handle, sock=listener)
+    return server, listener.getsockname()[1]
+
+
+async def _stream_zeros(writer):
+    try:
+        while True:
+            writer.write(b'\0' * 65536)
+            await writer.drain()
+    except (ConnectionError, OSError):
+        pass
+    finally:
+        writer.close()
+
+
+def test_stream_sink_against_sink_server():
+    async def run():
+        sink_server = SinkServer()
+        port = await sink_server.start()
+        try:
+            result = await TunnelSpeedTester(slots=1).measure(None, StreamSink('127.0.0.1', port),
+                                                              streams=STREAMS, max_duration=MAX_DURATION)
+        finally:
+            await sink_server.close()
+        return result, sink_server.stats
+
+    result, stats = asyncio.run(run())
+    assert result["success"] is True, result["message"]
+    assert result["download_measured"] and result["upload_measured"]
+    assert result["download_mbps"] > 0
+    assert result["upload_mbps"] > 0
+    assert stats["downloads"] == STREAMS and stats["uploads"] == STREAMS
+    assert stats["bytes_received"] > 0
+
+
+def test_sink_resetting_uploads_is_not_measured():
+    async def handle(reader, writer):
+        if await reader.read(1) == SINK_DOWNLOAD:
+            await _stream_zeros(writer)
+            return
+        # Upload: never read, then reset
+        await asyncio.sleep(0.3)
+        writer.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        writer.transport.abort()
+
+    async def run():
+        server, port = await _listen(handle, rcvbuf=4096)
+        try:
+            return await TunnelSpeedTester(slots=1).measure(None, StreamSink('127.0.0.1', port),
+                                                            streams=STREAMS, max_duration=MAX_DURATION)
+        finally:
+            server.close()
+
+    result = asyncio.run(run())
+    assert result["success"] is True  # download was measured
+    assert result["download_mbps"] > 0
+    assert result["upload_measured"] is False
+    assert result["upload_mbps"] == 0.0
+
+
+def test_http_sink_rejecting_uploads_is_not_measured():
+    async def handle(reader, writer):
+        head = await reader.readuntil(b'\r\n\r\n')
+        if head.startswith(b'GET'):
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\n\r\n')
+            await _stream_zeros(writer)
+            return
+        writer.write(b'HTTP/1.1 413 Payload Too Large\r\nConnection: close\r\nContent-Length: 0\r\n\r\n')
+        await writer.drain()
+        writer.close()
+
+    async def run():
+        server, port = await _listen(handle)
+        try:
+            return await TunnelSpeedTester(slots=1).measure(None, HTTPSink('127.0.0.1', port, '/blob'),
+                                                            streams=STREAMS, max_duration=MAX_DURATION)
+        finally:
+            server.close()
+
+    result = asyncio.run(run())
+    assert result["download_measured"] is True
+    assert result["download_mbps"] > 0
+    assert result["upload_measured"] is False
+    assert result["upload_mbps"] == 0.0
+
+
+def test_http_sink_error_status_fails_download():
+    async def handle(reader, writer):
+        await reader.readuntil(b'\r\n\r\n')
+        writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n')
+        await writer.drain()
+        writer.close()
+
+    async def run():
+        server, port = await _listen(handle)
+        try:
+            return await TunnelSpeedTester(slots=1).measure(None, HTTPSink('127.0.0.1', port, '/missing'),
+                                                            streams=STREAMS, max_duration=MAX_DURATION)
+        finally:
+            server.close()
+
+    result = asyncio.run(run())
+    assert result["success"] is False
+
+
+if __name__ == "__main__":
+    for test in (test_stream_sink_against_sink_server, test_sink_resetting_uploads_is_not_measured,
+                 test_http_sink_rejecting_uploads_is_not_measured, test_http_sink_error_status_fails_download):
+        test()
+        print(f"✅ {test.__name__}")